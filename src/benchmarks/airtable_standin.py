@@ -0,0 +1,479 @@
+"""
+Local stand-in for the subset of the Airtable REST API that pyairtable uses.
+
+Serves records from a fixture file (see cassettes.record_fixtures) so the
+portioning run, sticker generators and Excel exports can be benchmarked without
+touching the production base:
+
+    python -m src.benchmarks.airtable_standin --fixtures fixtures.json --port 8787 --latency 0.15
+
+    db = AirTable(ex_api_key="local", endpoint_url="http://127.0.0.1:8787")
+
+Supports list (view / filterByFormula / fields / sort / maxRecords / offset
+paging, GET or POST listRecords), get, create, batch create, update, batch
+update, performUpsert and batch delete. Latency and 429 responses can be
+injected, and every request is counted per table and operation.
+"""
+import argparse
+import copy
+import json
+import logging
+import random
+import string
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from src.benchmarks.formula import FormulaError, record_matches
+
+logger = logging.getLogger(__name__)
+
+MAX_PAGE_SIZE = 100
+MAX_RECORDS_PER_WRITE = 10
+
+
+def _now_iso():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def _new_record_id():
+    return "rec" + "".join(random.choices(string.ascii_letters + string.digits, k=14))
+
+
+class UnknownFieldError(KeyError):
+    pass
+
+
+class StandInTable:
+    """Records of one table plus the metadata the fixtures carry for it."""
+
+    def __init__(self, table_id, data):
+        self.id = table_id
+        self.name = data.get("name", table_id)
+        self.records = {r["id"]: r for r in data.get("records", [])}
+        self.field_names = dict(data.get("field_ids", {}))  # fld id -> field name
+        self.field_ids = {name: fid for fid, name in self.field_names.items()}
+        self.views = {view: list(ids) for view, ids in data.get("views", {}).items()}
+        self.last_modified = {rid: r.get("createdTime") for rid, r in self.records.items()}
+
+    def unknown_field(self, fields):
+        """First requested field that isn't in the schema; only checked when the fixtures carry one."""
+        if not fields or not self.field_names:
+            return None
+        known = set(self.field_names) | set(self.field_ids)
+        return next((f for f in fields if f not in known), None)
+
+    def field_name(self, name_or_id):
+        return self.field_names.get(name_or_id, name_or_id)
+
+    def ordered_records(self, view=None):
+        if view and view in self.views:
+            return [self.records[rid] for rid in self.views[view] if rid in self.records]
+        if view:
+            logger.debug("View %s not in fixtures for %s; serving all records", view, self.id)
+        return list(self.records.values())
+
+
+class AirtableStandIn:
+    """In-process HTTP server. Use start()/stop() or as a context manager."""
+
+    def __init__(self, fixtures=None, host="127.0.0.1", port=0, latency=0.0, latency_jitter=0.0,
+                 throttle_every=0, throttle_probability=0.0, max_requests_per_second=None, seed=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.throttle_every = throttle_every
+        self.throttle_probability = throttle_probability
+        self.max_requests_per_second = max_requests_per_second
+
+        self.tables = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self._server = None
+        self._thread = None
+        self.reset_stats()
+        if fixtures:
+            self.load_fixtures(fixtures)
+
+    # Fixtures -----------------------------------------------------------
+
+    def load_fixtures(self, fixtures):
+        """Accepts a fixture dict or the path to a fixture JSON file."""
+        if isinstance(fixtures, str):
+            with open(fixtures, "r", encoding="utf-8") as f:
+                fixtures = json.load(f)
+        with self._lock:
+            for table_id, data in fixtures.get("tables", {}).items():
+                self.tables[table_id] = StandInTable(table_id, copy.deepcopy(data))
+        return self
+
+    def _table(self, id_or_name):
+        table = self.tables.get(id_or_name)
+        if table is None:
+            table = next((t for t in self.tables.values() if t.name == id_or_name), None)
+        if table is None:
+            # Unknown tables start empty so writes to them still succeed
+            table = self.tables[id_or_name] = StandInTable(id_or_name, {})
+        return table
+
+    def schema(self):
+        """Base schema in the shape of the meta API, built from the fixture field ids."""
+        with self._lock:
+            tables = []
+            for table in self.tables.values():
+                fields = [{"id": fid, "name": name, "type": "singleLineText", "options": {}}
+                          for fid, name in table.field_names.items()]
+                tables.append({
+                    "id": table.id, "name": table.name, "description": None,
+                    "primaryFieldId": fields[0]["id"] if fields else "fldPrimary",
+                    "fields": fields,
+                    "views": [{"id": view, "name": view, "type": "grid"} for view in table.views],
+                })
+            return {"tables": tables}
+
+    # Lifecycle ------------------------------------------------------------
+
+    @property
+    def endpoint_url(self):
+        return f"http://{self.host}:{self._server.server_address[1]}"
+
+    def start(self):
+        handler = type("_BoundHandler", (_Handler,), {"standin": self})
+        self._server = ThreadingHTTPServer((self.host, self.port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info("Airtable stand-in listening on %s", self.endpoint_url)
+        return self.endpoint_url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # Stats ------------------------------------------------------------------
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls = Counter()
+            self.throttled = 0
+            self.bytes_sent = 0
+            self.unprojected_lists = 0  # list requests without fields[], i.e. every field returned
+            self.started_at = time.time()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": sum(self.calls.values()),
+                "throttled": self.throttled,
+                "bytes_sent": self.bytes_sent,
+                "unprojected_lists": self.unprojected_lists,
+                "elapsed_seconds": round(time.time() - self.started_at, 3),
+                "calls": {f"{table} {op}": n for (table, op), n in sorted(self.calls.items())},
+            }
+
+    def _should_throttle(self):
+        with self._lock:
+            now = time.time()
+            total = sum(self.calls.values()) + self.throttled + 1
+            if self.max_requests_per_second:
+                while self._recent and now - self._recent[0] > 1.0:
+                    self._recent.popleft()
+                if len(self._recent) >= self.max_requests_per_second:
+                    self.throttled += 1
+                    return True
+                self._recent.append(now)
+            if (self.throttle_every and total % self.throttle_every == 0) or \
+                    (self.throttle_probability and self._random.random() < self.throttle_probability):
+                self.throttled += 1
+                return True
+            return False
+
+    def _sleep(self):
+        delay = self.latency + (self._random.uniform(0, self.latency_jitter) if self.latency_jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _count(self, table, op, size):
+        with self._lock:
+            self.calls[(table.id, op)] += 1
+            self.bytes_sent += size
+
+    # Operations -----------------------------------------------------------
+
+    def list_records(self, table, options):
+        view = options.get("view")
+        formula = options.get("filterByFormula")
+        fields = options.get("fields")
+        by_field_id = str(options.get("returnFieldsByFieldId", "")).lower() in ("1", "true")
+
+        with self._lock:
+            unknown = table.unknown_field(fields)
+            if unknown:
+                raise UnknownFieldError(unknown)
+            if not fields:
+                self.unprojected_lists += 1
+            records = table.ordered_records(view)
+            if formula:
+                records = [r for r in records
+                           if record_matches(formula, r, table.field_names, table.last_modified.get(r["id"]))]
+            for sort in reversed(options.get("sort") or []):
+                name = table.field_name(sort["field"])
+                records.sort(key=lambda r: _sort_key(r.get("fields", {}).get(name)),
+                             reverse=sort.get("direction") == "desc")
+            if options.get("maxRecords"):
+                records = records[:int(options["maxRecords"])]
+
+            start = int(options.get("offset") or 0)
+            page_size = min(int(options.get("pageSize") or MAX_PAGE_SIZE), MAX_PAGE_SIZE)
+            page = [self._render(table, r, fields, by_field_id) for r in records[start:start + page_size]]
+
+        result = {"records": page}
+        if start + page_size < len(records):
+            result["offset"] = str(start + page_size)
+        return result
+
+    def get_record(self, table, record_id):
+        with self._lock:
+            record = table.records.get(record_id)
+            return self._render(table, record, None, False) if record else None
+
+    def create_records(self, table, records):
+        created = []
+        with self._lock:
+            for fields in records:
+                record = {"id": _new_record_id(), "createdTime": _now_iso(),
+                          "fields": self._named_fields(table, fields)}
+                table.records[record["id"]] = record
+                table.last_modified[record["id"]] = record["createdTime"]
+                for ids in table.views.values():
+                    ids.append(record["id"])
+                created.append(copy.deepcopy(record))
+        return created
+
+    def update_records(self, table, records, replace=False, merge_on=None):
+        updated, created_ids, updated_ids = [], [], []
+        with self._lock:
+            for item in records:
+                fields = self._named_fields(table, item.get("fields", {}))
+                record_id = item.get("id")
+                if record_id is None and merge_on:
+                    keys = [table.field_name(k) for k in merge_on]
+                    record_id = next((rid for rid, r in table.records.items()
+                                      if all(r["fields"].get(k) == fields.get(k) for k in keys)), None)
+                    if record_id is None:
+                        record_id = _new_record_id()
+                        table.records[record_id] = {"id": record_id, "createdTime": _now_iso(), "fields": {}}
+                        for ids in table.views.values():
+                            ids.append(record_id)
+                        created_ids.append(record_id)
+                    else:
+                        updated_ids.append(record_id)
+                record = table.records.get(record_id)
+                if record is None:
+                    raise KeyError(record_id)
+                record["fields"] = fields if replace else {**record["fields"], **fields}
+                record["fields"] = {k: v for k, v in record["fields"].items() if v is not None}
+                table.last_modified[record_id] = _now_iso()
+                updated.append(copy.deepcopy(record))
+        return updated, created_ids, updated_ids
+
+    def delete_records(self, table, record_ids):
+        deleted = []
+        with self._lock:
+            for record_id in record_ids:
+                if table.records.pop(record_id, None) is not None:
+                    table.last_modified.pop(record_id, None)
+                    for ids in table.views.values():
+                        if record_id in ids:
+                            ids.remove(record_id)
+                    deleted.append({"id": record_id, "deleted": True})
+        return deleted
+
+    def _named_fields(self, table, fields):
+        return {table.field_name(k): v for k, v in fields.items()}
+
+    def _render(self, table, record, fields, by_field_id):
+        out = copy.deepcopy(record)
+        if fields:
+            wanted = {table.field_name(f) for f in fields}
+            out["fields"] = {k: v for k, v in out["fields"].items() if k in wanted}
+        if by_field_id:
+            out["fields"] = {table.field_ids.get(k, k): v for k, v in out["fields"].items()}
+        return out
+
+
+def _sort_key(value):
+    if value is None:
+        return (0, "")
+    if isinstance(value, (int, float)):
+        return (1, value)
+    return (2, str(value))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    standin = None  # set on the bound subclass
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PATCH(self):
+        self._dispatch("PATCH")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        body = self._read_json()
+        if url.path == "/__standin/stats":
+            return self._send(200, self.standin.stats())
+
+        parts = [unquote(p) for p in url.path.strip("/").split("/")]
+        if parts[:2] == ["v0", "meta"] and parts[-1] == "tables":
+            return self._send(200, self.standin.schema())
+        if len(parts) < 3 or parts[0] != "v0":
+            return self._send(404, {"error": {"type": "NOT_FOUND"}})
+        table = self.standin._table(parts[2])
+        rest = parts[3:]
+
+        self.standin._sleep()
+        if self.standin._should_throttle():
+            return self._send(429, {"errors": [{"error": "RATE_LIMIT_REACHED"}]}, {"Retry-After": "1"})
+
+        try:
+            op, status, payload = self._handle(method, table, rest, parse_qs(url.query), body)
+        except UnknownFieldError as e:
+            op, status, payload = "list", 422, {"error": {"type": "UNKNOWN_FIELD_NAME",
+                                                          "message": f'Unknown field name: "{e.args[0]}"'}}
+        except FormulaError as e:
+            op, status, payload = "list", 422, {"error": {"type": "INVALID_FILTER_BY_FORMULA", "message": str(e)}}
+        except KeyError as e:
+            op, status, payload = "write", 404, {"error": {"type": "MODEL_ID_NOT_FOUND", "message": str(e)}}
+        encoded = self._send(status, payload)
+        self.standin._count(table, op, encoded)
+
+    def _handle(self, method, table, rest, query, body):
+        s = self.standin
+        if method == "GET" and not rest:
+            return "list", 200, s.list_records(table, _query_options(query))
+        if method == "POST" and rest == ["listRecords"]:
+            return "list", 200, s.list_records(table, body)
+        if method == "GET" and len(rest) == 1:
+            record = s.get_record(table, rest[0])
+            if record is None:
+                return "get", 404, {"error": "NOT_FOUND"}
+            return "get", 200, record
+        if method == "POST" and not rest:
+            if "records" in body:
+                if len(body["records"]) > MAX_RECORDS_PER_WRITE:
+                    return "create", 422, {"error": {"type": "INVALID_RECORDS"}}
+                created = s.create_records(table, [r.get("fields", {}) for r in body["records"]])
+                return "batch_create", 200, {"records": created}
+            return "create", 200, s.create_records(table, [body.get("fields", {})])[0]
+        if method in ("PATCH", "PUT"):
+            replace = method == "PUT"
+            if len(rest) == 1:
+                updated, _, _ = s.update_records(table, [{"id": rest[0], "fields": body.get("fields", {})}], replace)
+                return "update", 200, updated[0]
+            records = body.get("records", [])
+            if len(records) > MAX_RECORDS_PER_WRITE:
+                return "batch_update", 422, {"error": {"type": "INVALID_RECORDS"}}
+            merge_on = (body.get("performUpsert") or {}).get("fieldsToMergeOn")
+            updated, created_ids, updated_ids = s.update_records(table, records, replace, merge_on)
+            if merge_on:
+                return "batch_upsert", 200, {"records": updated, "createdRecords": created_ids,
+                                             "updatedRecords": updated_ids}
+            return "batch_update", 200, {"records": updated}
+        if method == "DELETE":
+            ids = rest[:1] or query.get("records[]", [])
+            deleted = s.delete_records(table, ids)
+            if rest:
+                return "delete", 200, deleted[0] if deleted else {"id": rest[0], "deleted": False}
+            return "batch_delete", 200, {"records": deleted}
+        return "unknown", 404, {"error": {"type": "NOT_FOUND"}}
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length).decode("utf-8") or "{}")
+
+    def _send(self, status, payload, headers=None):
+        encoded = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(encoded)
+        return len(encoded)
+
+
+def _query_options(query):
+    """Turn GET query params (fields[]=, sort[0][field]=...) into the listRecords body shape."""
+    options = {key: values[0] for key, values in query.items() if "[" not in key}
+    if "fields[]" in query:
+        options["fields"] = query["fields[]"]
+    sorts = {}
+    for key, values in query.items():
+        if key.startswith("sort["):
+            index, attr = key[5:].rstrip("]").split("][")
+            sorts.setdefault(int(index), {})[attr] = values[0]
+    if sorts:
+        options["sort"] = [sorts[i] for i in sorted(sorts)]
+    return options
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Airtable stand-in for offline benchmarking")
+    parser.add_argument("--fixtures", required=True, help="Fixture JSON recorded with cassettes.record_fixtures")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--latency-jitter", type=float, default=0.0)
+    parser.add_argument("--throttle-every", type=int, default=0, help="Answer every Nth request with 429")
+    parser.add_argument("--throttle-probability", type=float, default=0.0)
+    parser.add_argument("--max-rps", type=int, default=None, help="Answer 429 above this many requests/second")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    standin = AirtableStandIn(args.fixtures, host=args.host, port=args.port, latency=args.latency,
+                              latency_jitter=args.latency_jitter, throttle_every=args.throttle_every,
+                              throttle_probability=args.throttle_probability,
+                              max_requests_per_second=args.max_rps)
+    standin.start()
+    print(f"Serving on {standin.endpoint_url} — stats at {standin.endpoint_url}/__standin/stats")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        standin.stop()
+
+
+if __name__ == "__main__":
+    main()
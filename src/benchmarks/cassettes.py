@@ -0,0 +1,72 @@
+"""
+Record Airtable tables into a fixture file for the local stand-in.
+
+    python -m src.benchmarks.cassettes --out fixtures.json
+
+Pulls every table the AirTable access layer uses with `.all()`, the field
+id -> name mapping (when the token can read the schema) and the record order of
+the views the app queries, so `view=` requests replay the same subset.
+"""
+import argparse
+import json
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Views referenced by the access layer, per table id
+RECORDED_VIEWS = {
+    "tblxT3Pg9Qh0BVZhM": ["viwrZHgdsYWnAMhtX", "viwDpTtU0qaT9NcvG", "viwuVy9aN2LLZrcPF"],
+    "tblVwpvUmsTS2Se51": ["viwgt50kLisz8jx7b", "viw5hROs9I9vV0YEq", "viw4WN1XsjMnHwMkt"],
+}
+
+
+def _tables(db):
+    return {name: value for name, value in vars(db).items() if name.endswith("_table")}
+
+
+def record_fixtures(db, path=None, views=None):
+    """Dump every table of `db` into a fixture dict, and to `path` if given."""
+    views = RECORDED_VIEWS if views is None else views
+    fixtures = {
+        "base_id": db.base_id,
+        "recorded_at": datetime.now(timezone.utc).isoformat(),
+        "tables": {},
+    }
+    for attr, table in _tables(db).items():
+        logger.info(f"Recording {attr} ({table.id})")
+        entry = {"name": attr, "records": table.all(), "field_ids": {}, "views": {}}
+        try:
+            schema = table.schema()
+            entry["name"] = schema.name
+            entry["field_ids"] = {field.id: field.name for field in schema.fields}
+        except Exception as e:
+            # Schema access needs the schema.bases:read scope; replays still work by field name
+            logger.warning(f"Could not read schema for {table.id}: {str(e)}")
+        for view in views.get(table.id, []):
+            try:
+                entry["views"][view] = [r["id"] for r in table.all(view=view, fields=[])]
+            except Exception as e:
+                logger.warning(f"Could not record view {view} of {table.id}: {str(e)}")
+        fixtures["tables"][table.id] = entry
+
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(fixtures, f)
+        logger.info(f"Wrote fixtures for {len(fixtures['tables'])} tables to {path}")
+    return fixtures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record Airtable tables for the local stand-in")
+    parser.add_argument("--out", required=True, help="Fixture JSON to write")
+    parser.add_argument("--api-key", default=None, help="Defaults to AIRTABLE_API_KEY from Streamlit secrets")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    from src.data.store_access import AirTable
+    record_fixtures(AirTable(ex_api_key=args.api_key), args.out)
+
+
+if __name__ == "__main__":
+    main()
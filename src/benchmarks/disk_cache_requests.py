@@ -0,0 +1,85 @@
+"""
+Request check for the disk cache's freshness probe and id sweep.
+
+    python -m src.benchmarks.disk_cache_requests
+
+Runs DiskCache (src/data/disk_cache.py) against the local stand-in with every
+cached table at a zero TTL, so each fetch probes and every MAX_PROBE_RENEWALS-th
+one also sweeps the record ids. Fails (exit code 1) if a probe or sweep was sent
+without a fields[] parameter, i.e. downloaded every field of the table, or if a
+deleted record went unnoticed.
+"""
+import json
+import logging
+import sys
+import tempfile
+
+from pyairtable import Api
+
+from src.benchmarks.airtable_standin import AirtableStandIn
+from src.data.disk_cache import MAX_PROBE_RENEWALS, PROBE_FIELDS, DiskCache
+
+logger = logging.getLogger(__name__)
+
+BASE_ID = "appStandIn"
+RECORDS_PER_TABLE = 5
+
+
+def _fixtures():
+    tables = {}
+    for table_id, field in PROBE_FIELDS.items():
+        records = [{"id": f"rec{table_id[3:]}{i:03d}", "createdTime": "2024-01-01T00:00:00.000Z",
+                    "fields": {field: f"{field} {i}", "Notes": "x" * 200}}
+                   for i in range(RECORDS_PER_TABLE)]
+        tables[table_id] = {"records": records}
+    return {"tables": tables}
+
+
+def run():
+    """Returns (passed, report dict)."""
+    with tempfile.TemporaryDirectory() as directory, AirtableStandIn(_fixtures()) as standin:
+        cache = DiskCache(directory, ttls={table_id: 0 for table_id in PROBE_FIELDS}, personal_data=True)
+        api = Api("local", retry_strategy=None, endpoint_url=standin.endpoint_url)
+        tables = [api.table(BASE_ID, table_id) for table_id in PROBE_FIELDS]
+
+        for table in tables:
+            cache.fetch_all(table)
+        downloads = cache.downloads
+        standin.reset_stats()
+        for _ in range(MAX_PROBE_RENEWALS):
+            for table in tables:
+                cache.fetch_all(table)
+        stats = standin.stats()
+
+        # A deleted record must be picked up by the next sweep
+        deleted = standin.tables[tables[0].id]
+        deleted.records.pop(next(iter(deleted.records)))
+        for _ in range(MAX_PROBE_RENEWALS):
+            records, _ = cache.fetch_all(tables[0])
+
+    report = {
+        "tables": len(tables),
+        "probes": cache.probes,
+        "sweeps": cache.sweeps,
+        "redownloads_without_changes": cache.downloads - downloads - 1,
+        "unprojected_requests": stats["unprojected_lists"],
+        "deletion_detected": len(records) == RECORDS_PER_TABLE - 1,
+    }
+    passed = (report["sweeps"] > 0 and report["unprojected_requests"] == 0
+              and report["redownloads_without_changes"] == 0 and report["deletion_detected"])
+    return passed, report
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    passed, report = run()
+    print(json.dumps(report, indent=2))
+    if report["unprojected_requests"]:
+        logger.error(f"{report['unprojected_requests']} probe/sweep requests carried no fields[] parameter")
+    elif not passed:
+        logger.error("The disk cache re-downloaded an unchanged table or missed a deleted record")
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Small evaluator for the Airtable formula subset this app sends in filterByFormula.
+
+Covers field references ({Name} and bare fld ids), string/number literals,
+comparison, arithmetic and & concatenation, and the functions the access layer
+uses (AND, OR, NOT, IF, BLANK, RECORD_ID, LAST_MODIFIED_TIME, IS_AFTER, ...).
+Used by the local Airtable stand-in only.
+"""
+import re
+from functools import lru_cache
+from datetime import datetime, timezone
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+      (?P<string>'(?:\\.|[^'\\])*'|"(?:\\.|[^"\\])*")
+    | (?P<number>\d+(?:\.\d+)?)
+    | (?P<field>\{[^}]*\})
+    | (?P<op><=|>=|!=|=|<|>|&|\+|-|\*|/)
+    | (?P<punct>[(),])
+    | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+    )""", re.VERBOSE)
+
+
+class FormulaError(ValueError):
+    pass
+
+
+def tokenize(formula):
+    tokens = []
+    pos = 0
+    formula = formula.strip()
+    while pos < len(formula):
+        m = _TOKEN_RE.match(formula, pos)
+        if not m or m.end() == pos:
+            raise FormulaError(f"Cannot parse formula near: {formula[pos:pos + 20]!r}")
+        pos = m.end()
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == "string":
+            value = re.sub(r"\\(.)", r"\1", value[1:-1])
+        elif kind == "number":
+            value = float(value) if "." in value else int(value)
+        elif kind == "field":
+            value = value[1:-1]
+        tokens.append((kind, value))
+    return tokens
+
+
+class _Parser:
+    # Lowest to highest precedence
+    COMPARISON = ("=", "!=", "<", ">", "<=", ">=")
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def parse(self):
+        node = self.comparison()
+        if self.pos != len(self.tokens):
+            raise FormulaError(f"Unexpected token {self.tokens[self.pos]!r}")
+        return node
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, expected=None):
+        token = self.peek()
+        if expected is not None and token[1] != expected:
+            raise FormulaError(f"Expected {expected!r}, got {token[1]!r}")
+        self.pos += 1
+        return token
+
+    def comparison(self):
+        node = self.concat()
+        while self.peek()[0] == "op" and self.peek()[1] in self.COMPARISON:
+            op = self.take()[1]
+            node = ("binop", op, node, self.concat())
+        return node
+
+    def concat(self):
+        node = self.additive()
+        while self.peek() == ("op", "&"):
+            self.take()
+            node = ("binop", "&", node, self.additive())
+        return node
+
+    def additive(self):
+        node = self.term()
+        while self.peek()[0] == "op" and self.peek()[1] in ("+", "-"):
+            op = self.take()[1]
+            node = ("binop", op, node, self.term())
+        return node
+
+    def term(self):
+        node = self.unary()
+        while self.peek()[0] == "op" and self.peek()[1] in ("*", "/"):
+            op = self.take()[1]
+            node = ("binop", op, node, self.unary())
+        return node
+
+    def unary(self):
+        if self.peek() == ("op", "-"):
+            self.take()
+            return ("neg", self.unary())
+        return self.primary()
+
+    def primary(self):
+        kind, value = self.take()
+        if kind in ("string", "number"):
+            return ("lit", value)
+        if kind == "field":
+            return ("field", value)
+        if kind == "punct" and value == "(":
+            node = self.comparison()
+            self.take(")")
+            return node
+        if kind == "name":
+            if self.peek() == ("punct", "("):
+                self.take("(")
+                args = []
+                if self.peek() != ("punct", ")"):
+                    args.append(self.comparison())
+                    while self.peek() == ("punct", ","):
+                        self.take()
+                        args.append(self.comparison())
+                self.take(")")
+                return ("call", value.upper(), args)
+            if value.upper() in ("TRUE", "FALSE"):
+                return ("lit", value.upper() == "TRUE")
+            # Bare field ids, e.g. fldQbBplmx4oOHhR4=589
+            return ("field", value)
+        raise FormulaError(f"Unexpected token {value!r}")
+
+
+@lru_cache(maxsize=256)
+def parse(formula):
+    return _Parser(tokenize(formula)).parse()
+
+
+def is_blank(value):
+    return value is None or value == "" or value == [] or value is False
+
+
+def _scalar(value):
+    # Airtable compares lookup/linked arrays as their comma-joined text
+    if isinstance(value, list):
+        return ", ".join(str(v) for v in value)
+    return value
+
+
+def _as_number(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _as_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    if not value:
+        return None
+    text = str(value).replace("Z", "+00:00")
+    parsed = datetime.fromisoformat(text)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _compare(op, left, right):
+    left, right = _scalar(left), _scalar(right)
+    if op in ("=", "!="):
+        if is_blank(left) or is_blank(right):
+            equal = is_blank(left) and is_blank(right)
+        else:
+            ln, rn = _as_number(left), _as_number(right)
+            equal = ln == rn if ln is not None and rn is not None else str(left) == str(right)
+        return equal if op == "=" else not equal
+    ln, rn = _as_number(left), _as_number(right)
+    if ln is None or rn is None:
+        ln, rn = str(left if left is not None else ""), str(right if right is not None else "")
+    return {"<": ln < rn, ">": ln > rn, "<=": ln <= rn, ">=": ln >= rn}[op]
+
+
+class RecordContext:
+    """What a formula can see about one record."""
+
+    def __init__(self, record, field_names=None, last_modified=None):
+        self.record = record
+        self.field_names = field_names or {}
+        self.last_modified = last_modified or record.get("createdTime")
+
+    def field(self, name):
+        fields = self.record.get("fields", {})
+        if name in fields:
+            return fields[name]
+        return fields.get(self.field_names.get(name))
+
+
+def evaluate(node, ctx):
+    kind = node[0]
+    if kind == "lit":
+        return node[1]
+    if kind == "field":
+        return ctx.field(node[1])
+    if kind == "neg":
+        return -(_as_number(evaluate(node[1], ctx)) or 0)
+    if kind == "binop":
+        op, left, right = node[1], evaluate(node[2], ctx), evaluate(node[3], ctx)
+        if op in _Parser.COMPARISON:
+            return _compare(op, left, right)
+        if op == "&":
+            return "".join(str(_scalar(v)) for v in (left, right) if v is not None)
+        ln, rn = _as_number(left) or 0, _as_number(right) or 0
+        if op == "/":
+            return ln / rn if rn else None
+        return {"+": ln + rn, "-": ln - rn, "*": ln * rn}[op]
+    if kind == "call":
+        return _call(node[1], node[2], ctx)
+    raise FormulaError(f"Unknown node {kind!r}")
+
+
+def _call(name, args, ctx):
+    # Short-circuiting functions evaluate their own arguments
+    if name == "AND":
+        return all(not is_blank(evaluate(a, ctx)) for a in args)
+    if name == "OR":
+        return any(not is_blank(evaluate(a, ctx)) for a in args)
+    if name == "IF":
+        branch = args[1] if not is_blank(evaluate(args[0], ctx)) else (args[2] if len(args) > 2 else None)
+        return evaluate(branch, ctx) if branch is not None else None
+
+    values = [evaluate(a, ctx) for a in args]
+    if name == "NOT":
+        return is_blank(values[0])
+    if name == "BLANK":
+        return None
+    if name == "RECORD_ID":
+        return ctx.record.get("id")
+    if name == "LAST_MODIFIED_TIME":
+        return ctx.last_modified
+    if name == "CREATED_TIME":
+        return ctx.record.get("createdTime")
+    if name in ("IS_AFTER", "IS_BEFORE", "IS_SAME"):
+        left, right = _as_datetime(values[0]), _as_datetime(values[1])
+        if left is None or right is None:
+            return False
+        return {"IS_AFTER": left > right, "IS_BEFORE": left < right, "IS_SAME": left == right}[name]
+    if name == "DATETIME_PARSE":
+        return values[0]
+    if name == "LEN":
+        return len(str(_scalar(values[0]) or ""))
+    if name == "LOWER":
+        return str(_scalar(values[0]) or "").lower()
+    if name == "UPPER":
+        return str(_scalar(values[0]) or "").upper()
+    if name == "TRIM":
+        return str(_scalar(values[0]) or "").strip()
+    if name == "FIND":
+        haystack = str(_scalar(values[1]) or "")
+        return haystack.find(str(values[0])) + 1
+    if name == "ARRAYJOIN":
+        separator = values[1] if len(values) > 1 else ", "
+        items = values[0] if isinstance(values[0], list) else [values[0]]
+        return separator.join(str(v) for v in items if v is not None)
+    if name == "VALUE":
+        return _as_number(values[0])
+    if name == "TRUE":
+        return True
+    if name == "FALSE":
+        return False
+    raise FormulaError(f"Unsupported formula function {name}()")
+
+
+def record_matches(formula, record, field_names=None, last_modified=None):
+    if not formula:
+        return True
+    return not is_blank(evaluate(parse(formula), RecordContext(record, field_names, last_modified)))
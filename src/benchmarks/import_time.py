@@ -0,0 +1,99 @@
+"""
+Import-time check for the Streamlit entry point.
+
+    python -m src.benchmarks.import_time --runs 5 --budget 2.0
+
+Imports streamlitController in fresh interpreters that can't see any Streamlit
+secrets, and fails (exit code 1) if the import raises, if it creates the shared
+database instance (src/data/database.py), or if the median import time is over
+the budget. The slowest modules of the last run are listed from -X importtime.
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+DEFAULT_BUDGET_SECONDS = 2.0
+DEFAULT_RUNS = 5
+
+_CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import streamlitController
+elapsed = time.perf_counter() - start
+database = sys.modules.get("src.data.database")
+print(json.dumps({"seconds": elapsed, "db_created": database is not None and database._db is not None}))
+"""
+
+
+def measure_import(module_stats=False):
+    """Import streamlitController once in a clean interpreter. Returns {"seconds", "db_created"},
+    plus "modules" ([(cumulative seconds, module)], slowest first) with module_stats."""
+    with tempfile.TemporaryDirectory() as home:
+        # No ~/.streamlit/secrets.toml, so any st.secrets read at import fails the run
+        env = {**os.environ, "HOME": home, "AIRTABLE_CACHE_DIR": "off"}
+        command = [sys.executable] + (["-X", "importtime"] if module_stats else []) + ["-c", _CHILD]
+        proc = subprocess.run(command, cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import streamlitController failed:\n{proc.stderr[-2000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    if module_stats:
+        result["modules"] = _slowest_modules(proc.stderr)
+    return result
+
+
+def _slowest_modules(importtime_output, limit=10):
+    modules = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(modules, reverse=True)[:limit]
+
+
+def run(runs=DEFAULT_RUNS, budget=DEFAULT_BUDGET_SECONDS):
+    """Measure `runs` imports; returns (passed, report dict)."""
+    results = [measure_import(module_stats=(i == runs - 1)) for i in range(runs)]
+    median = statistics.median(r["seconds"] for r in results)
+    report = {
+        "runs": runs,
+        "median_seconds": round(median, 3),
+        "max_seconds": round(max(r["seconds"] for r in results), 3),
+        "budget_seconds": budget,
+        "db_created": any(r["db_created"] for r in results),
+        "slowest_modules": [(round(s, 3), name) for s, name in results[-1]["modules"]],
+    }
+    return median <= budget and not report["db_created"], report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fail if importing streamlitController got slow or has side effects")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS)
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET_SECONDS, help="Maximum median import seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        passed, report = run(args.runs, args.budget)
+    except RuntimeError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    print(json.dumps(report, indent=2))
+    if report["db_created"]:
+        logger.error("Importing streamlitController created the database instance; use get_db() at the point of use")
+    elif not passed:
+        logger.error(f"Median import time {report['median_seconds']}s is over the {args.budget}s budget")
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+Regression corpus for the portioning optimizer (NewDishOptimizer).
+
+    python -m src.benchmarks.optimizer_corpus                # compare against the recorded digests
+    python -m src.benchmarks.optimizer_corpus --record       # re-record after an intended change
+    python -m src.benchmarks.optimizer_corpus --solver qp    # same for the QP solver mode
+    python -m src.benchmarks.optimizer_corpus --solver qp --batch   # also check solve_batch
+
+Generates synthetic dishes, client targets and portion constraints from a fixed
+seed, solves every case and compares a digest of each result dict (or of the
+exception it raised) with optimizer_corpus.json (optimizer_corpus_qp.json for
+the QP mode). Any optimizer change that isn't meant to change portions should
+leave every digest unchanged.
+
+With --batch, every dish is also portioned for several of the corpus clients at once
+with solve_batch, some of them with the dish lines in another order, and each batched
+result must equal the same optimizer's own solve().
+"""
+import argparse
+import hashlib
+import json
+import logging
+import random
+import sys
+import time
+from pathlib import Path
+
+from src.portioning.dish_optimizer_ifelse import SOLVER_MODES, NewDishOptimizer, solve_batch
+
+logger = logging.getLogger(__name__)
+
+DIGESTS_PATHS = {
+    "rules": Path(__file__).with_name("optimizer_corpus.json"),
+    "qp": Path(__file__).with_name("optimizer_corpus_qp.json"),
+}
+DEFAULT_SEED = 2024
+DEFAULT_CASES = 400
+# Clients per dish in the --batch check
+BATCH_SIZE = 4
+
+# Same nutrient keys MealRecommendation.optimize passes to the optimizer
+NUTRIENTS = ['kcal', 'protein(g)', 'fat(g)', 'dietaryFiber(g)', 'carbohydrate(g)', 'Sodium (mg)',
+             'Calcium (mg)', 'Phosphorus, P (mg)', 'Fatty acids, total saturated (g)']
+
+# (name, component, protein type, nutrients per gram in NUTRIENTS order)
+INGREDIENTS = [
+    ("Chicken Breast", "protein", "meat", [1.65, 0.31, 0.036, 0.0, 0.0, 0.74, 0.15, 2.2, 0.010]),
+    ("Beef Sirloin", "protein", "meat", [2.06, 0.27, 0.10, 0.0, 0.0, 0.54, 0.12, 2.0, 0.040]),
+    ("Salmon", "protein", "fish", [2.08, 0.20, 0.13, 0.0, 0.0, 0.59, 0.09, 2.5, 0.030]),
+    ("Cod", "protein", "fish", [0.82, 0.18, 0.007, 0.0, 0.0, 0.54, 0.16, 2.0, 0.001]),
+    ("Firm Tofu", "protein", "tofu", [1.44, 0.17, 0.087, 0.023, 0.028, 0.14, 6.8, 1.9, 0.013]),
+    ("Tempeh", "protein", "vegan", [1.92, 0.20, 0.11, 0.09, 0.076, 0.09, 1.1, 2.7, 0.022]),
+    ("Greek Yogurt", "protein", "ignore", [0.97, 0.09, 0.05, 0.0, 0.04, 0.35, 1.0, 1.35, 0.030]),
+    ("Broccoli", "veggies", "ignore", [0.34, 0.028, 0.004, 0.026, 0.066, 0.33, 0.47, 0.66, 0.001]),
+    ("Spinach", "veggies", "ignore", [0.23, 0.029, 0.004, 0.022, 0.036, 0.79, 0.99, 0.49, 0.001]),
+    ("Roasted Carrots", "veggies", "ignore", [0.41, 0.009, 0.002, 0.028, 0.096, 0.69, 0.33, 0.35, 0.0]),
+    ("Mixed Berries", "veggies", "ignore", [0.50, 0.007, 0.003, 0.024, 0.12, 0.01, 0.12, 0.2, 0.0]),
+    ("Brown Rice", "starch", "ignore", [1.12, 0.026, 0.009, 0.018, 0.23, 0.05, 0.1, 0.83, 0.002]),
+    ("Sweet Potato", "starch", "ignore", [0.90, 0.02, 0.002, 0.033, 0.21, 0.36, 0.38, 0.54, 0.0]),
+    ("Quinoa", "starch", "ignore", [1.20, 0.044, 0.019, 0.028, 0.21, 0.07, 0.17, 1.52, 0.002]),
+    ("Rolled Oats", "starch", "ignore", [3.79, 0.13, 0.065, 0.10, 0.68, 0.06, 0.52, 4.1, 0.011]),
+    ("Teriyaki Sauce", "sauce", "ignore", [0.89, 0.059, 0.0, 0.001, 0.16, 38.0, 0.25, 1.1, 0.0]),
+    ("Tahini Dressing", "sauce", "ignore", [5.2, 0.15, 0.46, 0.05, 0.12, 1.5, 4.3, 7.3, 0.065]),
+    ("Sesame Seeds", "garnish", "ignore", [5.73, 0.18, 0.50, 0.12, 0.23, 0.11, 9.75, 6.3, 0.070]),
+    ("Scallions", "garnish", "ignore", [0.32, 0.018, 0.002, 0.026, 0.073, 0.16, 0.72, 0.37, 0.0]),
+]
+BASE_GRAMS = {"protein": (60, 180), "veggies": (40, 160), "starch": (40, 160), "sauce": (15, 45), "garnish": (3, 12)}
+
+
+def _line(rng, name, component, protein_type, per_gram):
+    # Rounded to two decimals like MealRecommendation.clean_up_dish
+    base_grams = float('{:.2f}'.format(rng.uniform(*BASE_GRAMS[component])))
+    line = {
+        "id": f"rec{rng.randrange(16 ** 8):08x}",
+        "protein_type": protein_type,
+        "component": component,
+        "ingredientName": name,
+        "ingredientId": name.upper().replace(" ", "_"),
+        "baseGrams": base_grams,
+    }
+    for nutrient, rate in zip(NUTRIENTS, per_gram):
+        line[f"{nutrient}PerBaseGrams"] = float('{:.2f}'.format(rate * base_grams))
+    return line
+
+
+def _pick(rng, component, exclude=()):
+    return rng.choice([i for i in INGREDIENTS if i[1] == component and i[0] not in exclude])
+
+
+def generate_dish(rng):
+    """A dish in the shape MealRecommendation.clean_up_dish returns."""
+    kind = rng.choices(["full", "single", "two_component", "yogurt", "fruit_salad"], [70, 6, 10, 7, 7])[0]
+    if kind == "single":
+        picks = [_pick(rng, rng.choice(["protein", "starch"]))]
+    elif kind == "two_component":
+        picks = [_pick(rng, "protein"), _pick(rng, rng.choice(["veggies", "starch"])), _pick(rng, "sauce")]
+    elif kind == "yogurt":
+        picks = [next(i for i in INGREDIENTS if i[0] == "Greek Yogurt"), _pick(rng, "starch"),
+                 next(i for i in INGREDIENTS if i[0] == "Mixed Berries"), _pick(rng, "garnish")]
+    elif kind == "fruit_salad":
+        picks = [next(i for i in INGREDIENTS if i[0] == "Mixed Berries"), _pick(rng, "veggies", {"Mixed Berries"}),
+                 _pick(rng, "protein", {"Greek Yogurt"}), _pick(rng, "starch")]
+    else:
+        picks = [_pick(rng, "protein", {"Greek Yogurt"}), _pick(rng, "veggies", {"Mixed Berries"}), _pick(rng, "starch")]
+        if rng.random() < 0.4:
+            picks.append(_pick(rng, "veggies", {picks[1][0], "Mixed Berries"}))
+        if rng.random() < 0.8:
+            picks.append(_pick(rng, "sauce"))
+        if rng.random() < 0.5:
+            picks.append(_pick(rng, "garnish"))
+    dish_name = {"yogurt": "Berry Yogurt Parfait", "fruit_salad": "Seasonal Fruit Salad"}.get(
+        kind, " & ".join(p[0] for p in picks[:2]))
+    return {"dishName": dish_name, "ingredients": [_line(rng, *pick) for pick in picks]}
+
+
+def generate_client(rng):
+    """Customer requirements as MealRecommendation.optimize passes them (goal_* plus Airtable names)."""
+    kcal = round(rng.uniform(300, 900))
+    requirements = {
+        "goal_calories": kcal,
+        "goal_protein(g)": round(kcal * rng.uniform(0.06, 0.10)),
+        "goal_fat(g)": round(kcal * rng.uniform(0.025, 0.045)),
+        "goal_fiber(g)": round(rng.uniform(5, 15)),
+        "goal_carbs(g)": round(kcal * rng.uniform(0.06, 0.13)),
+    }
+    requirements.update({
+        "Kcal": requirements["goal_calories"],
+        "Protein (g)": requirements["goal_protein(g)"],
+        "Fat, Total (g)": requirements["goal_fat(g)"],
+        "Dietary Fiber (g)": requirements["goal_fiber(g)"],
+        "Carbohydrate, total (g)": requirements["goal_carbs(g)"],
+    })
+    return requirements
+
+
+def generate_constraints(rng):
+    """Nutrient bounds as MealRecommendation.convert_to_nutrient_constraints builds them,
+    plus the optimizer's other constraint arguments."""
+    nutrient_constraints = {}
+    for nutrient in ["Protein (g)", "Kcal", "Fat, Total (g)", "Dietary Fiber (g)", "Carbohydrate, total (g)"]:
+        nutrient_constraints[nutrient] = {
+            "lb": None if rng.random() < 0.02 else round(rng.uniform(0.7, 0.95), 2),
+            "ub": None if rng.random() < 0.1 else round(rng.uniform(1.05, 1.3), 2),
+        }
+    fixed = rng.random() < 0.15
+    return {
+        "nutrient_constraints": nutrient_constraints,
+        "double_sauce": rng.random() < 0.2,
+        "veggie_ge_starch": rng.random() < 0.5,
+        "min_meat_per_100_cal": rng.choice([None, None, 8, 12]),
+        "max_meal_grams_per_100_cal": rng.choice([None, None, 90, 120, 160]),
+        "fixed_protein_grams": rng.choice([120, 150]) if fixed and rng.random() < 0.5 else None,
+        "fixed_starch_grams": rng.choice([80, 100]) if fixed and rng.random() < 0.5 else None,
+        "fixed_veggies_grams": rng.choice([100, 150]) if fixed and rng.random() < 0.5 else None,
+    }
+
+
+def generate_cases(count=DEFAULT_CASES, seed=DEFAULT_SEED):
+    rng = random.Random(seed)
+    return [{"dish": generate_dish(rng), "client": generate_client(rng), **generate_constraints(rng)}
+            for _ in range(count)]
+
+
+def build_optimizer(case, solver="rules"):
+    """A NewDishOptimizer for a corpus case, built the way MealRecommendation.optimize builds it."""
+    garnish_grams = sum(i["baseGrams"] for i in case["dish"]["ingredients"] if i["component"] == "garnish")
+    return NewDishOptimizer(
+        {}, dict(case["client"]), NUTRIENTS, case["nutrient_constraints"], garnish_grams,
+        case["double_sauce"], case["veggie_ge_starch"], case["min_meat_per_100_cal"],
+        case["max_meal_grams_per_100_cal"], json.loads(json.dumps(case["dish"])),
+        case["fixed_protein_grams"], case["fixed_starch_grams"], case["fixed_veggies_grams"], solver=solver,
+    )
+
+
+def solve_case(case, solver="rules"):
+    """The optimizer's result dict, or {"error": exception type} when it raises."""
+    try:
+        return build_optimizer(case, solver).solve()
+    except Exception as e:
+        return {"error": type(e).__name__}
+
+
+def result_digest(result):
+    return hashlib.sha256(json.dumps(result, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def run(count=DEFAULT_CASES, seed=DEFAULT_SEED, solver="rules"):
+    """Solve the corpus; returns (digests, seconds spent solving)."""
+    cases = generate_cases(count, seed)
+    digests = []
+    start = time.perf_counter()
+    for case in cases:
+        digests.append(result_digest(solve_case(case, solver)))
+    return digests, time.perf_counter() - start
+
+
+def batch_cases(cases, size=BATCH_SIZE):
+    """Per corpus dish, `size` cases sharing it: the dish's own case and the clients and
+    constraints of the next ones, every other one with its dish lines reversed."""
+    batches = []
+    for i, case in enumerate(cases):
+        batch = []
+        for j in range(size):
+            other = cases[(i + j) % len(cases)]
+            ingredients = case["dish"]["ingredients"]
+            batch.append({**other, "dish": {**case["dish"], "ingredients": ingredients[::-1] if j % 2 else ingredients}})
+        batches.append(batch)
+    return batches
+
+
+def _outcome(result):
+    if isinstance(result, Exception):
+        return {"error": type(result).__name__}
+    return result
+
+
+def check_batch(count=DEFAULT_CASES, seed=DEFAULT_SEED, solver="rules"):
+    """Indices of the corpus dishes where solve_batch and per-order solve() disagree."""
+    mismatched = []
+    for i, batch in enumerate(batch_cases(generate_cases(count, seed))):
+        batched = solve_batch([build_optimizer(case, solver) for case in batch])
+        single = [solve_case(case, solver) for case in batch]
+        if [result_digest(_outcome(r)) for r in batched] != [result_digest(r) for r in single]:
+            mismatched.append(i)
+    return mismatched
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check NewDishOptimizer results against recorded digests")
+    parser.add_argument("--record", action="store_true", help="Write the current digests instead of comparing")
+    parser.add_argument("--cases", type=int, default=DEFAULT_CASES)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--solver", choices=SOLVER_MODES, default="rules")
+    parser.add_argument("--digests", help="Digest file (default: the recorded one for --solver)")
+    parser.add_argument("--batch", action="store_true", help="Also check solve_batch against per-order solves")
+    args = parser.parse_args()
+    args.digests = args.digests or str(DIGESTS_PATHS[args.solver])
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    digests, seconds = run(args.cases, args.seed, args.solver)
+    logger.info(f"Solved {len(digests)} cases in {seconds:.2f}s ({len(digests) / seconds:.0f} solves/s)")
+
+    if args.record:
+        with open(args.digests, "w", encoding="utf-8") as f:
+            json.dump({"seed": args.seed, "cases": args.cases, "digests": digests}, f, indent=0)
+        logger.info(f"Wrote {len(digests)} digests to {args.digests}")
+        return
+
+    with open(args.digests, encoding="utf-8") as f:
+        recorded = json.load(f)
+    if (recorded["seed"], recorded["cases"]) != (args.seed, args.cases):
+        logger.error(f"Recorded digests are for seed {recorded['seed']} with {recorded['cases']} cases")
+        sys.exit(1)
+    changed = [i for i, (old, new) in enumerate(zip(recorded["digests"], digests)) if old != new]
+    if changed:
+        logger.error(f"{len(changed)} of {len(digests)} results changed, e.g. cases {changed[:10]}")
+        sys.exit(1)
+    logger.info(f"All {len(digests)} results match")
+
+    if args.batch:
+        mismatched = check_batch(args.cases, args.seed, args.solver)
+        if mismatched:
+            logger.error(f"solve_batch differs from per-order solves for {len(mismatched)} dishes, e.g. {mismatched[:10]}")
+            sys.exit(1)
+        logger.info(f"Batched results match per-order results for all {args.cases} dishes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+Speed benchmark for the portioning optimizer (NewDishOptimizer), per branch of solve().
+
+    python -m src.benchmarks.optimizer_speed                  # compare against the local baseline
+    python -m src.benchmarks.optimizer_speed --record         # re-record it (e.g. on a new machine)
+    python -m src.benchmarks.optimizer_speed --solver qp      # same for the QP solver mode
+
+Generates synthetic dishes, client targets and portion constraints aimed at each branch
+of the rule-based solve(): a single ingredient, two components, yogurt / parfait,
+fruit snack, fixed protein / starch / veggie grams, double sauce, the _final_adjustment
+fallback, and full dishes that converge in the adjustment loop. Every case is built the
+way MealRecommendation.optimize builds its optimizer (see optimizer_corpus.build_optimizer)
+and solved --repeat times; the report gives, per branch, solves per second, mean and p95
+time per solve, mean iterations and the peak memory (tracemalloc) of a solve.
+
+A separate traced pass records which branch each case actually took ("hit" is the share
+of cases that reached the branch they were generated for, "errors" the share that
+raised; for QP, "fallback" is the share that fell back to the rule-based solver). Timings depend on the machine, so the
+baseline (optimizer_speed_baseline.json) is meant for local before/after runs: record it
+on the machine you compare on. The run fails (exit code 1) when a branch is slower,
+takes more iterations or needs more memory than the baseline by more than --tolerance.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from src.benchmarks.optimizer_corpus import INGREDIENTS, _line, _pick, build_optimizer, generate_client, generate_constraints
+from src.portioning.dish_optimizer_ifelse import SOLVER_MODES, SPECIAL_YOGURT_PROTEIN_ITEM_KEYWORDS
+
+logger = logging.getLogger(__name__)
+
+BASELINE_PATH = Path(__file__).with_name("optimizer_speed_baseline.json")
+DEFAULT_SEED = 2025
+DEFAULT_CASES = 40  # per branch
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.25
+
+BRANCHES = ["single_ingredient", "two_components", "yogurt_parfait", "fruit_snack", "fixed_grams",
+            "double_sauce", "final_adjustment", "converged"]
+
+
+def _named(name):
+    return next(i for i in INGREDIENTS if i[0] == name)
+
+
+def _full_dish(rng, sauce=None):
+    picks = [_pick(rng, "protein", {"Greek Yogurt"}), _pick(rng, "veggies", {"Mixed Berries"}), _pick(rng, "starch")]
+    if rng.random() < 0.4:
+        picks.append(_pick(rng, "veggies", {picks[1][0], "Mixed Berries"}))
+    if sauce if sauce is not None else rng.random() < 0.8:
+        picks.append(_pick(rng, "sauce"))
+    if rng.random() < 0.5:
+        picks.append(_pick(rng, "garnish"))
+    return picks
+
+
+def generate_case(rng, branch):
+    """A corpus-shaped case (dish, client, constraint arguments) aimed at one branch."""
+    constraints = generate_constraints(rng)
+    constraints.update(double_sauce=False, fixed_protein_grams=None, fixed_starch_grams=None, fixed_veggies_grams=None)
+    client = generate_client(rng)
+    dish_name = None
+    if branch == "single_ingredient":
+        picks = [_pick(rng, rng.choice(["protein", "starch"]), {"Greek Yogurt"})]
+    elif branch == "two_components":
+        picks = [_pick(rng, "protein", {"Greek Yogurt"}), _pick(rng, rng.choice(["veggies", "starch"])), _pick(rng, "sauce")]
+    elif branch == "yogurt_parfait":
+        picks = [_named("Greek Yogurt"), _pick(rng, "starch"), _named("Mixed Berries"), _pick(rng, "garnish")]
+        dish_name = "Berry Yogurt Parfait"
+    elif branch == "fruit_snack":
+        picks = [_named("Mixed Berries"), _pick(rng, "veggies", {"Mixed Berries"}),
+                 _pick(rng, "protein", {"Greek Yogurt"}), _pick(rng, "starch")]
+        dish_name = "Seasonal Fruit Salad"
+    else:
+        picks = _full_dish(rng, sauce=True if branch == "double_sauce" else None)
+    if branch == "fixed_grams":
+        fixed = rng.sample(["protein", "starch", "veggies"], rng.randint(1, 3))
+        constraints.update(
+            fixed_protein_grams=rng.choice([120, 150]) if "protein" in fixed else None,
+            fixed_starch_grams=rng.choice([80, 100]) if "starch" in fixed else None,
+            fixed_veggies_grams=rng.choice([100, 150]) if "veggies" in fixed else None,
+        )
+    elif branch == "double_sauce":
+        constraints["double_sauce"] = True
+    elif branch == "final_adjustment":
+        # Tight bounds around lopsided targets, which the adjustment loop can't meet
+        for bounds in constraints["nutrient_constraints"].values():
+            bounds.update(lb=round(rng.uniform(0.95, 0.99), 2), ub=round(rng.uniform(1.01, 1.05), 2))
+        client["goal_protein(g)"] = client["Protein (g)"] = round(client["goal_calories"] * rng.uniform(0.12, 0.16))
+        client["goal_carbs(g)"] = client["Carbohydrate, total (g)"] = round(client["goal_calories"] * rng.uniform(0.01, 0.03))
+    elif branch == "converged":
+        # The loop only returns early with at least MAX_STARCH_GRAM of starch (see
+        # _within_range), which the starch limit never lets a free starch reach; a
+        # fixed starch portion that large needs a big, carb-heavy target and wide bounds
+        for bounds in constraints["nutrient_constraints"].values():
+            bounds.update(lb=round(rng.uniform(0.2, 0.3), 2), ub=round(rng.uniform(4.0, 5.0), 2))
+        client["goal_calories"] = client["Kcal"] = round(rng.uniform(900, 1100))
+        client["goal_carbs(g)"] = client["Carbohydrate, total (g)"] = round(client["goal_calories"] * rng.uniform(0.18, 0.22))
+        constraints.update(min_meat_per_100_cal=None, max_meal_grams_per_100_cal=None,
+                           fixed_starch_grams=rng.choice([281, 290, 300]))
+    dish = {"dishName": dish_name or " & ".join(p[0] for p in picks[:2]),
+            "ingredients": [_line(rng, *pick) for pick in picks]}
+    return {"branch": branch, "dish": dish, "client": client, **constraints}
+
+
+def generate_cases(count=DEFAULT_CASES, seed=DEFAULT_SEED, branches=BRANCHES):
+    rng = random.Random(seed)
+    return [generate_case(rng, branch) for branch in branches for _ in range(count)]
+
+
+def taken_branches(case, final_adjusted):
+    """The branches of the rule-based solve() a case went through (when it didn't raise)."""
+    recipe = case["dish"]["ingredients"]
+    components = {i["component"] for i in recipe if i["component"] not in {"sauce", "garnish"}}
+    yogurt = any(keyword in i["ingredientName"].lower()
+                 for i in recipe if i["component"] == "protein" for keyword in SPECIAL_YOGURT_PROTEIN_ITEM_KEYWORDS)
+    if len(recipe) == 1:
+        return {"single_ingredient"}
+    if len(components) <= 2 and not yogurt:
+        return {"two_components"}
+    taken = {"final_adjustment"} if final_adjusted else {"converged"}
+    if yogurt:
+        taken.add("yogurt_parfait")
+    if "seasonal fruit salad" in case["dish"]["dishName"].lower():
+        taken.add("fruit_snack")
+    if any(case[f"fixed_{component}_grams"] is not None for component in ("protein", "starch", "veggies")):
+        taken.add("fixed_grams")
+    if case["double_sauce"] and any(i["component"] == "sauce" for i in recipe):
+        taken.add("double_sauce")
+    return taken
+
+
+def _solve(case, solver):
+    optimizer = build_optimizer(case, solver)
+    try:
+        optimizer.solve()
+    except Exception:
+        pass
+    return optimizer
+
+
+def _trace(case, solver):
+    """(branches taken, fell back from QP to rules, iterations, peak bytes) of one solve;
+    the branches are {"error"} when it raised."""
+    optimizer = build_optimizer(case, solver)
+    calls = {"final_adjustment": 0, "rules": 0}
+
+    def counted(name, method):
+        def call(*args, **kwargs):
+            calls[name] += 1
+            return method(*args, **kwargs)
+        return call
+
+    optimizer._final_adjustment = counted("final_adjustment", optimizer._final_adjustment)
+    optimizer._solve_rules = counted("rules", optimizer._solve_rules)
+    tracemalloc.reset_peak()
+    start = tracemalloc.get_traced_memory()[0]
+    try:
+        optimizer.solve()
+        taken = taken_branches(case, calls["final_adjustment"] > 0)
+    except Exception:
+        taken = {"error"}
+    peak = tracemalloc.get_traced_memory()[1] - start
+    fell_back = solver == "qp" and calls["rules"] > 0
+    return taken, fell_back, optimizer.iterations or 0, peak
+
+
+def run(count=DEFAULT_CASES, seed=DEFAULT_SEED, solver="rules", repeat=DEFAULT_REPEAT):
+    """Per-branch stats: solves, solves_per_second, mean_ms, p95_ms, mean_iterations,
+    peak_kib, errors, and hit (rules) or fallback (QP)."""
+    cases = generate_cases(count, seed)
+    seconds = {branch: [] for branch in BRANCHES}
+    traces = {branch: [] for branch in BRANCHES}
+    # The optimizer prints its diagnostics; keep them out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        for case in cases:
+            _solve(case, solver)  # warm-up: compiled bounds, imports, allocator
+        for _ in range(repeat):
+            for case in cases:
+                start = time.perf_counter()
+                _solve(case, solver)
+                seconds[case["branch"]].append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            for case in cases:
+                traces[case["branch"]].append(_trace(case, solver))
+        finally:
+            tracemalloc.stop()
+
+    stats = {}
+    for branch in BRANCHES:
+        times = sorted(seconds[branch])
+        branch_traces = traces[branch]
+        stats[branch] = {
+            "solves": len(times),
+            "solves_per_second": round(len(times) / sum(times), 1),
+            "mean_ms": round(1000 * statistics.fmean(times), 3),
+            "p95_ms": round(1000 * times[min(len(times) - 1, int(0.95 * len(times)))], 3),
+            "mean_iterations": round(statistics.fmean(t[2] for t in branch_traces), 1),
+            "peak_kib": round(max(t[3] for t in branch_traces) / 1024, 1),
+            "errors": round(sum("error" in t[0] for t in branch_traces) / len(branch_traces), 2),
+        }
+        # QP solves don't go through the rule-based branches unless they fall back to them
+        if solver == "qp":
+            stats[branch]["fallback"] = round(sum(t[1] for t in branch_traces) / len(branch_traces), 2)
+        else:
+            stats[branch]["hit"] = round(sum(branch in t[0] for t in branch_traces) / len(branch_traces), 2)
+    return stats
+
+
+def regressions(stats, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Messages for every branch that is slower, iterates more or uses more memory than
+    the baseline by more than the tolerance."""
+    found = []
+    for branch, current in stats.items():
+        recorded = baseline.get(branch)
+        if recorded is None:
+            continue
+        if current["solves_per_second"] < recorded["solves_per_second"] * (1 - tolerance):
+            found.append(f"{branch}: {current['solves_per_second']} solves/s, baseline {recorded['solves_per_second']}")
+        if current["mean_iterations"] > recorded["mean_iterations"] * (1 + tolerance):
+            found.append(f"{branch}: {current['mean_iterations']} iterations, baseline {recorded['mean_iterations']}")
+        if current["peak_kib"] > recorded["peak_kib"] * (1 + tolerance):
+            found.append(f"{branch}: {current['peak_kib']} KiB peak, baseline {recorded['peak_kib']}")
+    return found
+
+
+def _report(stats, baseline=None):
+    share = "fallback" if any("fallback" in s for s in stats.values()) else "hit"
+    lines = [f"{'branch':<18} {'solves/s':>9} {'mean ms':>8} {'p95 ms':>8} {'iters':>7} {'peak KiB':>9} "
+             f"{'errors':>6} {share:>8}"]
+    for branch, s in stats.items():
+        line = (f"{branch:<18} {s['solves_per_second']:>9.1f} {s['mean_ms']:>8.3f} {s['p95_ms']:>8.3f} "
+                f"{s['mean_iterations']:>7.1f} {s['peak_kib']:>9.1f} {s['errors']:>6.0%} {s[share]:>8.0%}")
+        if baseline and branch in baseline:
+            change = s["solves_per_second"] / baseline[branch]["solves_per_second"] - 1
+            line += f"  ({change:+.0%} vs baseline)"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark NewDishOptimizer per branch of solve()")
+    parser.add_argument("--record", action="store_true", help="Write the results as the baseline instead of comparing")
+    parser.add_argument("--cases", type=int, default=DEFAULT_CASES, help="Cases per branch")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Timed solves per case")
+    parser.add_argument("--solver", choices=SOLVER_MODES, default="rules")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed slowdown / growth against the baseline (0.25 = 25%%)")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    stats = run(args.cases, args.seed, args.solver, args.repeat)
+    solves = sum(s["solves"] for s in stats.values())
+    seconds = sum(s["solves"] * s["mean_ms"] for s in stats.values()) / 1000
+    logger.info(f"Solved {solves} cases in {seconds:.2f}s ({solves / seconds:.0f} solves/s)")
+
+    baselines = {}
+    if Path(args.baseline).exists():
+        with open(args.baseline, encoding="utf-8") as f:
+            baselines = json.load(f)
+    machine = {"python": platform.python_version(), "system": platform.system(), "machine": platform.machine()}
+
+    if args.record:
+        baselines[args.solver] = {"seed": args.seed, "cases": args.cases, "machine": machine, "branches": stats}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2)
+        print(_report(stats))
+        logger.info(f"Wrote the {args.solver} baseline to {args.baseline}")
+        return
+
+    recorded = baselines.get(args.solver)
+    if recorded is None:
+        print(_report(stats))
+        logger.warning(f"No {args.solver} baseline in {args.baseline}; run with --record to create one")
+        return
+    print(_report(stats, recorded["branches"]))
+    if (recorded["seed"], recorded["cases"]) != (args.seed, args.cases):
+        logger.error(f"The baseline is for seed {recorded['seed']} with {recorded['cases']} cases per branch")
+        sys.exit(1)
+    if recorded["machine"] != machine:
+        logger.warning(f"The baseline was recorded on {recorded['machine']}; timings may not be comparable")
+    found = regressions(stats, recorded["branches"], args.tolerance)
+    if found:
+        logger.error(f"{len(found)} regressions against the baseline:\n" + "\n".join(found))
+        sys.exit(1)
+    logger.info(f"No regressions against the baseline (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
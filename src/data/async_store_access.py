@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import time
+
+import httpx
+
+from src.data.exceptions import AirTableError, AirtableFetchError
+from src.data.rate_limiter import AIRTABLE_REQUESTS_PER_SECOND, BULK, _retry_after_seconds, is_retriable
+from src.data.clientservings_writer import AIRTABLE_BATCH_SIZE
+from src.data.instrumentation import instrument_methods, record_request
+from src.data.store_access import (
+    AirTable,
+    CLIENT_DETAIL_FIELDS,
+    CLIENTSERVINGS_MERGE_FIELD,
+    _merge_field_rejected,
+    _upsert_unsupported,
+    _unknown_field_name,
+    _unknown_fields,
+    client_details_from_record,
+    dish_lines_formula,
+)
+
+logger = logging.getLogger(__name__)
+
+# listRecords returns at most 100 records per page
+MAX_PAGE_SIZE = 100
+
+
+@instrument_methods
+class AsyncAirTable:
+    """asyncio counterpart of AirTable for I/O-heavy jobs such as portioning.
+
+    Record reads and writes go over one pooled keep-alive httpx.AsyncClient. At most
+    `max_in_flight` requests are open at once, and each one waits on the same
+    process-wide scheduler as the synchronous client, so both together stay within
+    Airtable's rate limit and share its 429 backoff.
+
+    Methods implemented here are native coroutines. Every other AirTable method is
+    available under the same name as a coroutine that runs the synchronous method in
+    a worker thread, so the two classes have the same surface.
+    """
+
+    def __init__(self, db=None, max_in_flight=AIRTABLE_REQUESTS_PER_SECOND, priority=BULK, timeout=30.0):
+        if db is None:
+            from src.data.database import get_db
+            db = get_db()
+        self.db = db
+        self.scheduler = db.scheduler
+        self.priority = priority
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._client = httpx.AsyncClient(
+            base_url=f"{db.endpoint_url.rstrip('/')}/v0/{db.base_id}/",
+            headers={"Authorization": f"Bearer {db.api_key}"},
+            limits=httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight),
+            timeout=timeout,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    def __getattr__(self, name):
+        # Anything not implemented natively: the synchronous method, run off the event loop
+        if name == "db":
+            raise AttributeError(name)
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            def run():
+                with self.scheduler.priority(self.priority):
+                    return attr(*args, **kwargs)
+            return await asyncio.to_thread(run)
+
+        call.__name__ = name
+        call.__doc__ = attr.__doc__
+        return call
+
+    # HTTP -------------------------------------------------------------------
+
+    async def _acquire(self):
+        waited = 0.0
+        while True:
+            wait = self.scheduler.try_acquire(self.priority)
+            if not wait:
+                break
+            await asyncio.sleep(wait)
+            waited += wait
+        if waited:
+            self.scheduler.record_wait(waited)
+        return waited
+
+    async def _request(self, method, path, json=None):
+        attempt = 0
+        throttled = 0.0
+        start = time.perf_counter()
+        table = path.split("/", 1)[0]
+        while True:
+            async with self._in_flight:
+                throttled += await self._acquire()
+                try:
+                    response = await self._client.request(method, path, json=json)
+                except Exception:
+                    record_request(table, time.perf_counter() - start, retries=attempt,
+                                   throttle_seconds=throttled, error=True)
+                    raise
+            if not is_retriable(method, path, response.status_code) or attempt >= self.scheduler.max_retries:
+                record_request(table, time.perf_counter() - start, len(response.content),
+                               retries=attempt, throttle_seconds=throttled, error=response.is_error)
+                response.raise_for_status()
+                return response.json()
+            delay = self.scheduler.backoff(attempt, _retry_after_seconds(response))
+            logger.warning(f"Airtable returned {response.status_code} for {method} {path}; retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    # Reads ------------------------------------------------------------------
+
+    async def iterate(self, table, fields=None, view=None, formula=None, max_records=None, page_size=MAX_PAGE_SIZE):
+        """Pages of table records as they arrive, like Table.iterate(). Uses POST listRecords
+        so long formulas and field lists never hit the URL length limit."""
+        body = {"pageSize": min(page_size, MAX_PAGE_SIZE)}
+        if fields:
+            body["fields"] = list(fields)
+        if view:
+            body["view"] = view
+        if formula:
+            body["filterByFormula"] = str(formula)
+        if max_records:
+            body["maxRecords"] = max_records
+        while True:
+            result = await self._request("POST", f"{table.id}/listRecords", json=body)
+            yield result.get("records", [])
+            if not result.get("offset"):
+                return
+            body["offset"] = result["offset"]
+
+    async def all_records(self, table, fields=None, **options):
+        """All matching records; unknown projected fields are dropped as in AirTable.all_records."""
+        if fields:
+            fields = [f for f in fields if f not in _unknown_fields.get(table.id, ())]
+        while True:
+            try:
+                return [record async for page in self.iterate(table, fields=fields, **options) for record in page]
+            except httpx.HTTPStatusError as e:
+                unknown = _unknown_field_name(e)
+                if not fields or unknown not in fields:
+                    raise
+                logger.warning(f"Field '{unknown}' no longer exists in {table.id}; leaving it out of projected reads")
+                _unknown_fields.setdefault(table.id, set()).add(unknown)
+                fields = [f for f in fields if f != unknown]
+
+    async def get(self, table, record_id):
+        return await self._request("GET", f"{table.id}/{record_id}")
+
+    async def get_many(self, table, record_ids, fields=None):
+        """Same as AirTable.get_many, with the id chunks fetched concurrently on the event loop."""
+        unique_ids = list(dict.fromkeys(rid for rid in record_ids if rid))
+        if not unique_ids:
+            return {}
+        chunks = AirTable._record_id_chunks(unique_ids, fields)
+        try:
+            results = await asyncio.gather(*(self.all_records(table, fields=fields, formula=chunk) for chunk in chunks))
+        except httpx.HTTPError as e:
+            raise AirTableError(f"Failed to fetch {len(unique_ids)} records from {table.id}: {str(e)}")
+        return {record['id']: record for result in results for record in result}
+
+    # Writes -----------------------------------------------------------------
+
+    async def batch_create(self, table, records):
+        """Create records (field dicts), 10 per request with the requests sent concurrently."""
+        chunks = [records[i:i + AIRTABLE_BATCH_SIZE] for i in range(0, len(records), AIRTABLE_BATCH_SIZE)]
+        results = await asyncio.gather(*(
+            self._request("POST", table.id, json={"records": [{"fields": fields} for fields in chunk]})
+            for chunk in chunks
+        ))
+        return [record for result in results for record in result.get("records", [])]
+
+    async def batch_update(self, table, records):
+        """Update records given as {"id": ..., "fields": {...}}, 10 per request."""
+        chunks = [records[i:i + AIRTABLE_BATCH_SIZE] for i in range(0, len(records), AIRTABLE_BATCH_SIZE)]
+        results = await asyncio.gather(*(
+            self._request("PATCH", table.id, json={"records": [{"id": r["id"], "fields": r["fields"]} for r in chunk]})
+            for chunk in chunks
+        ))
+        return [record for result in results for record in result.get("records", [])]
+
+    # AirTable methods used by the portioning driver -------------------------------
+
+    async def iterate_open_orders_for_portioning(self, page_size=MAX_PAGE_SIZE, include_portioned=False):
+        async for page in self.iterate(self.db.open_orders_table, page_size=page_size,
+                                       **self.db._portioning_open_orders_query(include_portioned)):
+            yield page
+
+    async def get_all_open_orders_for_portioning(self, include_portioned=False):
+        return await self.all_records(self.db.open_orders_table, **self.db._portioning_open_orders_query(include_portioned))
+
+    async def get_client_details(self, recId):
+        record = self.db._snapshot_record('get_client', recId)
+        if record is None:
+            record = (await self.get_many(self.db.client_table, [recId], fields=CLIENT_DETAIL_FIELDS)).get(recId)
+        return client_details_from_record(record)
+
+    async def get_dish_calc_nutritions_by_dishId(self, dish_id):
+        if self.db.has_dish_lines(dish_id):
+            # Prefetched (see AirTable.prefetch_dish_lines): built from memory
+            return self.db.get_dish_calc_nutritions_by_dishId(dish_id)
+        try:
+            dish_all_ingrdts = await self.all_records(self.db.dishes_table, formula=dish_lines_formula(dish_id))
+        except Exception as e:
+            raise AirtableFetchError(f"Unexpected error processing dish {dish_id}: {str(e)}")
+        # Ingredient lookups are answered by the snapshot once it is loaded
+        return self.db.build_dish_calc_nutritions(dish_id, dish_all_ingrdts)
+
+    async def create_clientservings(self, prepared_rows):
+        return await self.batch_create(self.db.clientserving_table, prepared_rows)
+
+    async def upsert_clientservings(self, prepared_rows, existing_ids=None):
+        """AirTable.upsert_clientservings: one performUpsert keyed on Linked OrderItem. Once
+        Airtable refuses that merge field, the synchronous resolve-and-update path is used."""
+        table = self.db.clientserving_table
+        if table.id not in _upsert_unsupported:
+            try:
+                result = await self._request("PATCH", table.id, json={
+                    "records": [{"fields": row} for row in prepared_rows],
+                    "performUpsert": {"fieldsToMergeOn": [CLIENTSERVINGS_MERGE_FIELD]},
+                })
+                return result.get("records", [])
+            except httpx.HTTPStatusError as e:
+                if not _merge_field_rejected(e):
+                    raise
+                logger.warning(f"Airtable can't merge {table.id} on '{CLIENTSERVINGS_MERGE_FIELD}'; "
+                               f"updating existing rows by record id instead")
+                _upsert_unsupported.add(table.id)
+        # Resolve existing rows and update them in a worker thread
+        return await self.__getattr__("upsert_clientservings")(prepared_rows, existing_ids)
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Airtable accepts at most 10 records per create/update request
+AIRTABLE_BATCH_SIZE = 10
+
+
+class ClientServingsWriter:
+    """Buffers Client Servings rows and writes them with batch_create.
+
+    Rows are flushed in chunks of `batch_size` once that many are pending, when
+    `flush_interval` seconds have passed since the last flush, and on `close()`.
+    Safe to call `add()` from several worker threads. A chunk that fails to write
+    is recorded in `failures` together with the orders it contained.
+
+    With `upsert=True` chunks go through AirTable.upsert_clientservings instead, so an
+    order item that already has a row gets it updated in place rather than a second one.
+    """
+
+    def __init__(self, db, batch_size=AIRTABLE_BATCH_SIZE, flush_interval=5.0, upsert=False):
+        self.db = db
+        self.batch_size = max(1, min(batch_size, AIRTABLE_BATCH_SIZE))
+        self.flush_interval = flush_interval
+        self.upsert = upsert
+
+        self.written_orders = set()
+        self.failures = []  # [{"orders": [...], "error": "..."}]
+
+        self._pending = []  # [(order_id, prepared_row)]
+        self._lock = threading.Lock()
+        self._last_flush = time.time()
+        self._existing_ids = None  # {order item id: Client Servings id}, only read if performUpsert is refused
+        self._existing_ids_lock = threading.Lock()
+
+    def add(self, portion_recommendations, order_id):
+        """Queue one recommendation; raises if the row itself can't be prepared."""
+        prepared_row = self.db.prepare_clientservings_row(portion_recommendations)
+        with self._lock:
+            self._pending.append((order_id, prepared_row))
+            chunks = self._take_due_chunks()
+        self._write_chunks(chunks)
+
+    def flush_if_due(self):
+        with self._lock:
+            chunks = self._take_due_chunks()
+        self._write_chunks(chunks)
+
+    def flush(self):
+        """Write everything that is pending, regardless of thresholds."""
+        with self._lock:
+            chunks = self._take_chunks(everything=True)
+        self._write_chunks(chunks)
+
+    def close(self):
+        self.flush()
+        return self
+
+    @property
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    @property
+    def failed_orders(self):
+        return [order_id for failure in self.failures for order_id in failure["orders"]]
+
+    def _take_due_chunks(self):
+        # Caller holds self._lock
+        timed_out = time.time() - self._last_flush >= self.flush_interval
+        return self._take_chunks(everything=timed_out)
+
+    def _take_chunks(self, everything):
+        # Caller holds self._lock
+        chunks = []
+        while len(self._pending) >= self.batch_size or (everything and self._pending):
+            chunks.append(self._pending[:self.batch_size])
+            self._pending = self._pending[self.batch_size:]
+        if chunks:
+            self._last_flush = time.time()
+        return chunks
+
+    def _write_chunks(self, chunks):
+        for chunk in chunks:
+            order_ids = [order_id for order_id, _ in chunk]
+            try:
+                if self.upsert:
+                    self.db.upsert_clientservings([row for _, row in chunk], self._load_existing_ids)
+                else:
+                    self.db.create_clientservings([row for _, row in chunk])
+            except Exception as e:
+                self._record_failure(order_ids, e)
+            else:
+                self._record_written(order_ids)
+
+    def _load_existing_ids(self):
+        # One read of the table per writer; upsert_clientservings adds the rows it creates
+        with self._existing_ids_lock:
+            if self._existing_ids is None:
+                self._existing_ids = self.db.clientservings_ids_by_order()
+            return self._existing_ids
+
+    def _record_written(self, order_ids):
+        with self._lock:
+            self.written_orders.update(order_ids)
+
+    def _record_failure(self, order_ids, error):
+        logger.error(f"Failed to write Client Servings for orders {order_ids}: {str(error)}")
+        with self._lock:
+            self.failures.append({"orders": order_ids, "error": str(error)})
+
+
+class AsyncClientServingsWriter(ClientServingsWriter):
+    """ClientServingsWriter for the asyncio portioning driver.
+
+    Due chunks are written by tasks on the event loop the writer was created on, through
+    an AsyncAirTable, so `add()` never blocks the loop; it may also be called from worker
+    threads (asyncio.to_thread). Call `await aclose()` instead of `close()` to flush and
+    wait for every write.
+    """
+
+    def __init__(self, db, async_db, **kwargs):
+        super().__init__(db, **kwargs)
+        self.async_db = async_db
+        self._tasks = set()
+        self._loop = asyncio.get_running_loop()
+
+    async def aclose(self):
+        self.flush()
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks))
+        return self
+
+    def _write_chunks(self, chunks):
+        if not chunks:
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._start_writes(chunks)
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._start_writes, chunks)
+        except RuntimeError as e:
+            # The loop is closed (the run was cancelled while this order was finishing)
+            for chunk in chunks:
+                self._record_failure([order_id for order_id, _ in chunk], e)
+
+    def _start_writes(self, chunks):
+        for chunk in chunks:
+            task = self._loop.create_task(self._write_chunk(chunk))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _write_chunk(self, chunk):
+        order_ids = [order_id for order_id, _ in chunk]
+        try:
+            if self.upsert:
+                await self.async_db.upsert_clientservings([row for _, row in chunk], self._load_existing_ids)
+            else:
+                await self.async_db.create_clientservings([row for _, row in chunk])
+        except Exception as e:
+            self._record_failure(order_ids, e)
+        else:
+            self._record_written(order_ids)
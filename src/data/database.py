@@ -1,5 +1,38 @@
 # database.py
-from src.data.store_access import new_database_access
+"""
+Shared database instance, created on first use rather than at import.
 
-# Create a single instance of the database connection
-db = new_database_access()
\ No newline at end of file
+Creating an AirTable reads st.secrets and .env, so importing a module that uses the
+shared instance stays cheap and works headless (benchmarks, tests) until something
+actually talks to Airtable. Use get_db(); `from src.data.database import db` still
+works but creates the instance at that point.
+"""
+import threading
+
+_db = None
+_lock = threading.Lock()
+
+
+def get_db():
+    """The shared AirTable, created on the first call (thread-safe)."""
+    global _db
+    if _db is None:
+        with _lock:
+            if _db is None:
+                from src.data.store_access import new_database_access
+                _db = new_database_access()
+    return _db
+
+
+def set_db(db):
+    """Make `db` the shared instance, e.g. an AirTable pointed at the local stand-in
+    (src/benchmarks/airtable_standin.py). set_db(None) makes the next get_db() create a fresh one."""
+    global _db
+    with _lock:
+        _db = db
+
+
+def __getattr__(name):
+    if name == "db":
+        return get_db()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,352 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(".cache", "airtable")
+CACHE_DIR_ENV = "AIRTABLE_CACHE_DIR"
+# Tables holding personal data are only written to disk when this is set to 1
+CACHE_PERSONAL_DATA_ENV = "AIRTABLE_CACHE_PERSONAL_DATA"
+PERSONAL_DATA_TABLES = {"tbl63hIXZYUYY774v"}  # clients
+
+# Seconds a cached table is served without even a freshness probe
+DEFAULT_TTL = 300
+TABLE_TTLS = {
+    "tblPhcO06ce4VcAPD": 900,   # ingredients
+    "tbl3jZNKowrO1IPAm": 900,   # portion algo constraints
+    "tblfdLImqSdAfHYI7": 900,   # variants rule
+    "tblZqBM26nx9QW1mN": 900,   # shopify products (weekly menu)
+    "tbl63hIXZYUYY774v": 300,   # clients, only with AIRTABLE_CACHE_PERSONAL_DATA=1
+}
+
+# One small field per cached table for the freshness probe and the id sweep. pyairtable
+# drops `fields=[]` from the request, which would download every field of every record
+PROBE_FIELDS = {
+    "tblPhcO06ce4VcAPD": "Ingredient ID",     # ingredients
+    "tbl3jZNKowrO1IPAm": "Name",              # portion algo constraints
+    "tblfdLImqSdAfHYI7": "Ingredient",        # variants rule
+    "tblZqBM26nx9QW1mN": "Internal Dish ID",  # shopify products (weekly menu)
+    "tbl63hIXZYUYY774v": "Name",              # clients
+}
+
+# Watermarks are taken from the local clock; look back this far to cover clock skew
+CLOCK_SKEW_SECONDS = 120
+
+# The modified-since probe can't see deleted records: after this many TTL renewals by
+# probe alone, the table's record ids are listed and compared with the cached ones
+MAX_PROBE_RENEWALS = 3
+
+
+def _utc_iso(dt):
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+class DiskCache:
+    """SQLite-backed cache of whole Airtable tables (per table and view) plus small
+    key/value namespaces, shared by every session and generator on this machine.
+
+    A cached table is served as-is until its TTL runs out. After that one probe
+    request asks Airtable whether any record changed since the download; only if
+    one did is the table fetched again. Every MAX_PROBE_RENEWALS renewals the probe is
+    followed by an id sweep (a listing of one small field, see PROBE_FIELDS), which
+    catches deleted records.
+
+    Tables in PERSONAL_DATA_TABLES are read straight from Airtable unless
+    `personal_data` (or AIRTABLE_CACHE_PERSONAL_DATA=1) opts them in.
+    """
+
+    def __init__(self, directory=None, ttls=None, personal_data=None):
+        self.directory = directory or os.getenv(CACHE_DIR_ENV) or DEFAULT_CACHE_DIR
+        if personal_data is None:
+            personal_data = os.getenv(CACHE_PERSONAL_DATA_ENV, "") == "1"
+        self.personal_data = personal_data
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, "airtable_cache.sqlite3")
+        self.ttls = {**TABLE_TTLS, **(ttls or {})}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.probes = 0
+        self.downloads = 0
+        self.sweeps = 0
+
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tables ("
+                " key TEXT PRIMARY KEY, table_id TEXT, checked_at REAL,"
+                " watermark TEXT, record_count INTEGER, records TEXT, renewals INTEGER DEFAULT 0)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(tables)")}
+            if "renewals" not in columns:
+                # Cache files from before the id sweep
+                conn.execute("ALTER TABLE tables ADD COLUMN renewals INTEGER DEFAULT 0")
+            if not self.personal_data:
+                # Drop what cache files from before the opt-in still hold
+                conn.execute(f"DELETE FROM tables WHERE table_id IN ({','.join('?' * len(PERSONAL_DATA_TABLES))})",
+                             tuple(PERSONAL_DATA_TABLES))
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                " namespace TEXT, key TEXT, value TEXT, updated_at REAL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS mirrors ("
+                " key TEXT PRIMARY KEY, table_id TEXT, view TEXT, watermark TEXT,"
+                " synced_at REAL, swept_at REAL, resynced_at REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS mirror_records ("
+                " key TEXT, record_id TEXT, position INTEGER, record TEXT,"
+                " PRIMARY KEY (key, record_id))"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:  # commits on success
+                yield conn
+        finally:
+            conn.close()
+
+    def ttl_for(self, table_id):
+        return self.ttls.get(table_id, DEFAULT_TTL)
+
+    # Tables -----------------------------------------------------------------
+
+    def get_table(self, key):
+        """(records, checked_at, watermark, renewals) or None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT records, checked_at, watermark, renewals FROM tables WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1], row[2], row[3] or 0
+
+    def put_table(self, key, table_id, records, watermark):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO tables (key, table_id, checked_at, watermark, record_count, records)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, table_id, time.time(), watermark, len(records), json.dumps(records)),
+            )
+
+    def touch_table(self, key, renewals=0):
+        """Probe found nothing new: restart the TTL without rewriting the records.
+        `renewals` counts the renewals since the last download or id sweep."""
+        with self._lock, self._connect() as conn:
+            conn.execute("UPDATE tables SET checked_at = ?, renewals = ? WHERE key = ?", (time.time(), renewals, key))
+
+    def invalidate_table(self, table_id):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM tables WHERE table_id = ?", (table_id,))
+
+    def fetch_all(self, table, view=None, fields=None):
+        """Cached table.all(view=, fields=). Returns (records, changed) where `changed`
+        says whether the records were re-downloaded in this call."""
+        options = {key_: value for key_, value in (("view", view), ("fields", fields)) if value}
+        if table.id in PERSONAL_DATA_TABLES and not self.personal_data:
+            return table.all(**options), True
+        key = f"{table.id}:{view or ''}:{','.join(fields or [])}"
+        cached = self.get_table(key)
+        if cached is not None:
+            records, checked_at, watermark, renewals = cached
+            if time.time() - checked_at < self.ttl_for(table.id):
+                self.hits += 1
+                return records, False
+            if not self._changed_since(table, watermark, fields):
+                if renewals + 1 < MAX_PROBE_RENEWALS:
+                    self.touch_table(key, renewals + 1)
+                    self.hits += 1
+                    return records, False
+                if not self._ids_changed(table, view, fields, records):
+                    self.touch_table(key)
+                    self.hits += 1
+                    return records, False
+
+        # Taken before the download so edits made while it runs show up in the next probe
+        watermark = _utc_iso(datetime.now(timezone.utc) - timedelta(seconds=CLOCK_SKEW_SECONDS))
+        records = table.all(**options)
+        self.downloads += 1
+        self.put_table(key, table.id, records, watermark)
+        logger.info(f"Cached {len(records)} records of {table.id} (view {view or '-'})")
+        return records, True
+
+    @staticmethod
+    def _probe_field(table, fields):
+        # The table's probe field, else the first field of the cached projection
+        return PROBE_FIELDS.get(table.id) or (fields[0] if fields else None)
+
+    def _changed_since(self, table, watermark, fields=None):
+        # Airtable can't sort by LAST_MODIFIED_TIME() without a dedicated field, so the
+        # probe filters on it instead: any record at all means the cache is stale.
+        probe_field = self._probe_field(table, fields)
+        if probe_field is None:
+            # Without a field to project, the probe would cost a full record; re-download
+            return True
+        self.probes += 1
+        formula = f"IS_AFTER(LAST_MODIFIED_TIME(), DATETIME_PARSE('{watermark}'))"
+        try:
+            return bool(table.all(formula=formula, max_records=1, fields=[probe_field]))
+        except Exception as e:
+            logger.warning(f"Freshness probe failed for {table.id}, refetching: {str(e)}")
+            return True
+
+    def _ids_changed(self, table, view, fields, records):
+        # Deleted (or added without a later edit) records change the id set
+        probe_field = self._probe_field(table, fields)
+        if probe_field is None:
+            return True
+        self.sweeps += 1
+        options = {"view": view} if view else {}
+        try:
+            ids = {record["id"] for record in table.all(fields=[probe_field], **options)}
+        except Exception as e:
+            logger.warning(f"Id sweep failed for {table.id}, refetching: {str(e)}")
+            return True
+        return ids != {record["id"] for record in records}
+
+    # Mirrors (see table_mirror.TableMirror) -----------------------------------------
+
+    def get_mirror_state(self, key):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT watermark, synced_at, swept_at, resynced_at FROM mirrors WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("watermark", "synced_at", "swept_at", "resynced_at"), row))
+
+    def read_mirror(self, key):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT record FROM mirror_records WHERE key = ? ORDER BY position", (key,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def mirror_ids(self, key):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT record_id FROM mirror_records WHERE key = ?", (key,)).fetchall()
+        return {row[0] for row in rows}
+
+    def replace_mirror(self, key, table_id, view, records, watermark):
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM mirror_records WHERE key = ?", (key,))
+            conn.executemany(
+                "INSERT INTO mirror_records (key, record_id, position, record) VALUES (?, ?, ?, ?)",
+                [(key, r["id"], i, json.dumps(r)) for i, r in enumerate(records)],
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO mirrors (key, table_id, view, watermark, synced_at, swept_at, resynced_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, table_id, view, watermark, now, now, now),
+            )
+
+    def apply_mirror_delta(self, key, upserts, removed_ids=(), watermark=None, order=None):
+        """Upsert changed records (new ones go to the end), drop removed ids and, when
+        `order` (the full id list of a sweep) is given, re-number positions to match it."""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            next_position = conn.execute(
+                "SELECT COALESCE(MAX(position), -1) + 1 FROM mirror_records WHERE key = ?", (key,)
+            ).fetchone()[0]
+            for record in upserts:
+                updated = conn.execute(
+                    "UPDATE mirror_records SET record = ? WHERE key = ? AND record_id = ?",
+                    (json.dumps(record), key, record["id"]),
+                ).rowcount
+                if not updated:
+                    conn.execute(
+                        "INSERT INTO mirror_records (key, record_id, position, record) VALUES (?, ?, ?, ?)",
+                        (key, record["id"], next_position, json.dumps(record)),
+                    )
+                    next_position += 1
+            conn.executemany(
+                "DELETE FROM mirror_records WHERE key = ? AND record_id = ?",
+                [(key, record_id) for record_id in removed_ids],
+            )
+            if order is not None:
+                conn.executemany(
+                    "UPDATE mirror_records SET position = ? WHERE key = ? AND record_id = ?",
+                    [(i, key, record_id) for i, record_id in enumerate(order)],
+                )
+                conn.execute("UPDATE mirrors SET swept_at = ? WHERE key = ?", (now, key))
+            if watermark is not None:
+                conn.execute("UPDATE mirrors SET watermark = ? WHERE key = ?", (watermark, key))
+            conn.execute("UPDATE mirrors SET synced_at = ? WHERE key = ?", (now, key))
+
+    def delete_mirror_records(self, table_id, record_ids):
+        """Drop records deleted through this app from every mirror of the table."""
+        with self._lock, self._connect() as conn:
+            keys = [row[0] for row in conn.execute("SELECT key FROM mirrors WHERE table_id = ?", (table_id,))]
+            conn.executemany(
+                "DELETE FROM mirror_records WHERE key = ? AND record_id = ?",
+                [(key, record_id) for key in keys for record_id in record_ids],
+            )
+
+    def invalidate_mirrors(self, table_id=None):
+        with self._lock, self._connect() as conn:
+            if table_id is None:
+                conn.execute("DELETE FROM mirror_records")
+                conn.execute("DELETE FROM mirrors")
+            else:
+                conn.execute(
+                    "DELETE FROM mirror_records WHERE key IN (SELECT key FROM mirrors WHERE table_id = ?)",
+                    (table_id,),
+                )
+                conn.execute("DELETE FROM mirrors WHERE table_id = ?", (table_id,))
+
+    # Key/value ----------------------------------------------------------------
+
+    def get_value(self, namespace, key, default=None):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value FROM kv WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    def load_namespace(self, namespace, max_age=None):
+        """Every value of the namespace, or only those stored in the last `max_age` seconds."""
+        since = time.time() - max_age if max_age is not None else 0
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT key, value FROM kv WHERE namespace = ? AND updated_at >= ?", (namespace, since)
+            ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def put_value(self, namespace, key, value):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), time.time()),
+            )
+
+    def clear_namespace(self, namespace):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM kv WHERE namespace = ?", (namespace,))
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM tables")
+            conn.execute("DELETE FROM kv")
+            conn.execute("DELETE FROM mirror_records")
+            conn.execute("DELETE FROM mirrors")
+
+    def stats(self):
+        with self._connect() as conn:
+            tables = conn.execute("SELECT key, record_count, checked_at FROM tables").fetchall()
+        return {
+            "hits": self.hits,
+            "probes": self.probes,
+            "downloads": self.downloads,
+            "sweeps": self.sweeps,
+            "tables": {key: {"records": count, "age_seconds": round(time.time() - checked_at)}
+                       for key, count, checked_at in tables},
+        }
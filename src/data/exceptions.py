@@ -2,6 +2,11 @@ class AirtableDataError(Exception):
     """Exception raised for errors in Airtable data structure or content."""
     pass
 
+class AirtableFetchError(AirtableDataError):
+    """Raised when records could not be fetched (network or HTTP error), as opposed to
+    fetched records being invalid; worth retrying."""
+    pass
+
 class PortioningError(Exception):
     """Exception raised for errors during the portioning process."""
     pass 
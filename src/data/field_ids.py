@@ -0,0 +1,41 @@
+"""
+Airtable field ids used for projected reads (`fields=`). Requesting by id keeps a
+projection working when a field is renamed in Airtable; records still come back
+keyed by field name.
+
+Only ids already in use elsewhere in this codebase are listed here. Consumers
+name any other field they need directly in their field lists.
+"""
+
+# Open Orders (tblxT3Pg9Qh0BVZhM)
+OPEN_ORDERS_INDEX = 'flddofDLsRpVLe14s'                 # #
+OPEN_ORDERS_SHOPIFY_ID = 'fldXVHeLiy8npzVnb'
+OPEN_ORDERS_DELETIONS = 'fldwgVkboOme5380s'
+OPEN_ORDERS_QUANTITY = 'fldvkwFMlBOW5um2y'
+OPEN_ORDERS_SELECTED_PROTEIN = 'fldL1BpT5B6dPdh32'
+OPEN_ORDERS_FINAL_INGREDIENTS = 'fldZhqltOLU0tiEWI'
+OPEN_ORDERS_CLIENT = 'fldjEgeRh2bGxajXT'                # To_Match_Client_Nutrition
+OPEN_ORDERS_DISH_ID = 'fldLOvWuvg6X9Odvw'
+OPEN_ORDERS_PORTION_RESULT = 'fldadHgYOukaCrC6v'
+OPEN_ORDERS_SKIP_PORTIONING = 'fldIKtQS5bIEr1iNU'
+OPEN_ORDERS_MEAL_STICKER = 'fldYZYDRjScz6ig5a'
+OPEN_ORDERS_DELIVERY_DAY = 'flddRJziNBdEtrpmG'
+OPEN_ORDERS_PORTIONS = 'fldE0fWRfUnoHznqC'
+OPEN_ORDERS_SHIPPING_NAME = 'fldIEhlbz7JzbpTOK'
+OPEN_ORDERS_SHIPPING_ADDRESS_1 = 'flddnU6Y02iIHp16G'
+OPEN_ORDERS_SHIPPING_ADDRESS_2 = 'fldRUUiFRRYQ52k0W'
+OPEN_ORDERS_SHIPPING_CITY = 'fldBIgt7ce5fEYLDG'
+OPEN_ORDERS_SHIPPING_PROVINCE = 'fldGeLuYoGKiw227Y'
+OPEN_ORDERS_SHIPPING_COUNTRY = 'fldnP3H74kAXKaIhN'
+OPEN_ORDERS_SHIPPING_POSTAL_CODE = 'fldwqwf7WSbiP0hJg'
+OPEN_ORDERS_CUSTOMER_NAME = 'fldWYJStYSpX72pG3'
+OPEN_ORDERS_PARTS = 'fldebKYuTeuQfauil'                 # # of Parts
+OPEN_ORDERS_ZONE_NUMBER = 'fldbL18Ixas6ong0j'           # Zone Number (from Delivery Zone)
+OPEN_ORDERS_MEAL_TYPE_FROM_PROFILE = 'fldGqQtz9zyJmMDq9'
+
+# Client Servings (tblVwpvUmsTS2Se51)
+CLIENTSERVINGS_DISH_ID = 'fldhrw7U0pV4D9Cad'
+
+# Dishes (tblvTGgCq6k5iQBnL), one row per ingredient of a dish
+DISHES_DISH_ID = 'fldQbBplmx4oOHhR4'
+DISHES_INGREDIENT = 'fldaaMEjUKH2bCtEj'
@@ -0,0 +1,275 @@
+import contextvars
+import functools
+import inspect
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import unquote, urlparse
+
+# Latency samples kept per metric; beyond this a uniform reservoir sample is kept
+MAX_SAMPLES = 5000
+
+# Outermost instrumented AirTable method on this call path; HTTP requests are charged to it
+_current_method = contextvars.ContextVar("airtable_method", default=None)
+
+
+def current_method():
+    return _current_method.get()
+
+
+@contextmanager
+def charged_to(method):
+    """Charge requests made in this block to `method`, e.g. in a worker thread started by it."""
+    token = _current_method.set(method)
+    try:
+        yield
+    finally:
+        _current_method.reset(token)
+
+
+def table_from_url(url):
+    """Table id (or 'meta') from an Airtable API URL: /v0/{base}/{table}/..."""
+    parts = [unquote(p) for p in urlparse(url).path.strip("/").split("/")]
+    if len(parts) >= 2 and parts[1] == "meta":
+        return "meta"
+    return parts[2] if len(parts) >= 3 else "-"
+
+
+class _Latencies:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(seconds)
+        else:
+            slot = random.randrange(self.count)
+            if slot < MAX_SAMPLES:
+                self.samples[slot] = seconds
+
+    def summary(self):
+        ordered = sorted(self.samples)
+
+        def percentile(p):
+            if not ordered:
+                return 0.0
+            return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 1)
+
+        return {
+            "p50_ms": percentile(50),
+            "p95_ms": percentile(95),
+            "p99_ms": percentile(99),
+            "max_ms": round(self.max * 1000, 1),
+            "total_seconds": round(self.total, 3),
+        }
+
+
+class AirtableMetrics:
+    """Counters and latency percentiles for AirTable method calls and the HTTP requests
+    they make, keyed by method and table id.
+
+    A method call is recorded under its own name; its requests are charged to the
+    outermost instrumented method on the call path, so a get_many issued by
+    get_client_details counts against get_client_details.
+    """
+
+    def __init__(self, name="process"):
+        self.name = name
+        self.started_at = time.time()
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._methods = {}
+
+    def _method(self, method):
+        # Caller holds self._lock
+        entry = self._methods.get(method)
+        if entry is None:
+            entry = self._methods[method] = {"calls": 0, "errors": 0, "latency": _Latencies(), "tables": {}}
+        return entry
+
+    def record_call(self, method, seconds, error=False):
+        with self._lock:
+            entry = self._method(method)
+            entry["calls"] += 1
+            entry["errors"] += int(error)
+            entry["latency"].add(seconds)
+
+    def record_request(self, method, table, seconds, bytes_received=0, retries=0, throttle_seconds=0.0, error=False):
+        with self._lock:
+            tables = self._method(method or "(direct)")["tables"]
+            entry = tables.get(table)
+            if entry is None:
+                entry = tables[table] = {"requests": 0, "errors": 0, "bytes_received": 0, "retries": 0,
+                                         "throttle_seconds": 0.0, "latency": _Latencies()}
+            entry["requests"] += 1
+            entry["errors"] += int(error)
+            entry["bytes_received"] += bytes_received
+            entry["retries"] += retries
+            entry["throttle_seconds"] += throttle_seconds
+            entry["latency"].add(seconds)
+
+    def summary(self):
+        """JSON-serialisable per-method summary. Methods whose requests took longest come
+        first; helpers that only run inside other methods sort by their own wall time."""
+        with self._lock:
+            methods = {}
+            for method, entry in self._methods.items():
+                tables = {}
+                for table, stats in entry["tables"].items():
+                    tables[table] = {
+                        "requests": stats["requests"],
+                        "errors": stats["errors"],
+                        "bytes_received": stats["bytes_received"],
+                        "retries": stats["retries"],
+                        "throttle_seconds": round(stats["throttle_seconds"], 3),
+                        **stats["latency"].summary(),
+                    }
+                methods[method] = {"calls": entry["calls"], "errors": entry["errors"],
+                                   **entry["latency"].summary(), "tables": tables}
+        end = self.finished_at or time.time()
+        return {
+            "job": self.name,
+            "started_at": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+            "elapsed_seconds": round(end - self.started_at, 3),
+            "requests": sum(t["requests"] for m in methods.values() for t in m["tables"].values()),
+            "methods": dict(sorted(methods.items(), key=lambda item: (
+                -sum(t["total_seconds"] for t in item[1]["tables"].values()), -item[1]["total_seconds"]))),
+        }
+
+
+_process_metrics = AirtableMetrics()
+_active_jobs = set()
+_jobs_lock = threading.Lock()
+
+
+def _collectors():
+    with _jobs_lock:
+        return [_process_metrics, *_active_jobs]
+
+
+def start_job(name):
+    """Start collecting a per-job summary. Jobs that overlap in time see each other's traffic."""
+    job = AirtableMetrics(name)
+    with _jobs_lock:
+        _active_jobs.add(job)
+    return job
+
+
+def finish_job(job):
+    with _jobs_lock:
+        _active_jobs.discard(job)
+    job.finished_at = time.time()
+    return job.summary()
+
+
+def get_process_metrics():
+    return _process_metrics
+
+
+def record_call(method, seconds, error=False):
+    for metrics in _collectors():
+        metrics.record_call(method, seconds, error)
+
+
+def record_request(table, seconds, bytes_received=0, retries=0, throttle_seconds=0.0, error=False):
+    method = _current_method.get()
+    for metrics in _collectors():
+        metrics.record_request(method, table, seconds, bytes_received, retries, throttle_seconds, error)
+
+
+def _instrument(name, fn):
+    def enter():
+        return _current_method.set(name) if _current_method.get() is None else None
+
+    def leave(token):
+        if token is not None:
+            _current_method.reset(token)
+
+    if inspect.isasyncgenfunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            # As for generators below: the context is set only while fetching the next item
+            start, error = time.perf_counter(), False
+            generator = fn(*args, **kwargs)
+            try:
+                while True:
+                    token = enter()
+                    try:
+                        item = await generator.__anext__()
+                    except StopAsyncIteration:
+                        return
+                    finally:
+                        leave(token)
+                    yield item
+            except Exception:
+                error = True
+                raise
+            finally:
+                await generator.aclose()
+                record_call(name, time.perf_counter() - start, error)
+    elif inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start, error = time.perf_counter(), False
+            token = enter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                leave(token)
+                record_call(name, time.perf_counter() - start, error)
+    elif inspect.isgeneratorfunction(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            # The context is set only while the generator runs, not while the caller holds a page
+            start, error = time.perf_counter(), False
+            generator = fn(*args, **kwargs)
+            try:
+                while True:
+                    token = enter()
+                    try:
+                        item = next(generator)
+                    except StopIteration:
+                        return
+                    finally:
+                        leave(token)
+                    yield item
+            except Exception:
+                error = True
+                raise
+            finally:
+                generator.close()
+                record_call(name, time.perf_counter() - start, error)
+    else:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start, error = time.perf_counter(), False
+            token = enter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                leave(token)
+                record_call(name, time.perf_counter() - start, error)
+    return wrapper
+
+
+def instrument_methods(cls):
+    """Class decorator: record every public method's calls and latency (see AirtableMetrics)."""
+    for name, attr in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.isfunction(attr):
+            continue
+        setattr(cls, name, _instrument(name, attr))
+    return cls
@@ -0,0 +1,211 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from requests import Session
+
+from src.data.instrumentation import record_request, table_from_url
+
+logger = logging.getLogger(__name__)
+
+# Airtable allows 5 requests per second per base
+AIRTABLE_REQUESTS_PER_SECOND = 5
+INTERACTIVE = "interactive"
+BULK = "bulk"
+RETRIABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+RATE_LIMITED = 429
+
+
+def is_retriable(method, url, status_code):
+    """429 means the request was refused, so any request can be sent again. A 5xx write
+    may still have been applied, so only reads (GET and POST listRecords) retry those."""
+    if status_code == RATE_LIMITED:
+        return True
+    if status_code not in RETRIABLE_STATUS_CODES:
+        return False
+    return method.upper() == "GET" or str(url).split("?", 1)[0].rstrip("/").endswith("/listRecords")
+
+
+class AirtableScheduler:
+    """Process-wide token bucket that every Airtable request waits on.
+
+    Interactive callers (e.g. a bag scan) are served before bulk callers
+    (portioning, sticker generation) whenever both are waiting. A 429 or 5xx
+    pauses the whole bucket for the backoff delay, not only the caller that hit it.
+    """
+
+    def __init__(self, rate=AIRTABLE_REQUESTS_PER_SECOND, burst=AIRTABLE_REQUESTS_PER_SECOND,
+                 max_retries=6, base_backoff=0.5, max_backoff=30.0):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._cond = threading.Condition()
+        self._tokens = self.burst
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._waiting = {INTERACTIVE: 0, BULK: 0}
+        self._local = threading.local()
+
+        self._requests = 0
+        self._retries = 0
+        self._throttle_seconds = 0.0
+        self._backoff_seconds = 0.0
+        self._max_queue_depth = 0
+
+    @contextmanager
+    def priority(self, level):
+        """Run the enclosed Airtable calls from this thread at the given priority."""
+        previous = getattr(self._local, "priority", BULK)
+        self._local.priority = level
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def current_priority(self):
+        return getattr(self._local, "priority", BULK)
+
+    def acquire(self, priority=None):
+        """Block until a request may be sent. Returns the seconds spent waiting."""
+        priority = priority or self.current_priority()
+        start = time.monotonic()
+        with self._cond:
+            self._waiting[priority] += 1
+            self._max_queue_depth = max(self._max_queue_depth, sum(self._waiting.values()))
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    blocked_for = self._blocked_until - now
+                    yield_to_interactive = priority == BULK and self._waiting[INTERACTIVE] > 0
+                    if blocked_for <= 0 and self._tokens >= 1 and not yield_to_interactive:
+                        self._tokens -= 1
+                        break
+                    if blocked_for > 0:
+                        wait = blocked_for
+                    elif self._tokens < 1:
+                        wait = (1 - self._tokens) / self.rate
+                    else:
+                        wait = 1 / self.rate
+                    self._cond.wait(wait)
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+
+            waited = time.monotonic() - start
+            self._requests += 1
+            self._throttle_seconds += waited
+        return waited
+
+    def try_acquire(self, priority=BULK):
+        """Non-blocking acquire for event-loop callers (see async_store_access). Returns 0
+        when a request may be sent now, otherwise the seconds to wait before trying again."""
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            blocked_for = self._blocked_until - now
+            if blocked_for > 0:
+                return blocked_for
+            if priority == BULK and self._waiting[INTERACTIVE] > 0:
+                return 1 / self.rate
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+            self._tokens -= 1
+            self._requests += 1
+            return 0.0
+
+    def record_wait(self, seconds):
+        """Count time an event-loop caller spent waiting for try_acquire as throttle time."""
+        with self._cond:
+            self._throttle_seconds += seconds
+
+    def backoff(self, attempt, retry_after=None):
+        """Pause all traffic after a 429/5xx; exponential with full jitter. Returns the delay."""
+        delay = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+        delay = random.uniform(delay / 2, delay)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        with self._cond:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+            self._retries += 1
+            self._backoff_seconds += delay
+            self._cond.notify_all()
+        return delay
+
+    def queue_depth(self):
+        with self._cond:
+            return dict(self._waiting)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "requests": self._requests,
+                "retries": self._retries,
+                "throttle_seconds": round(self._throttle_seconds, 2),
+                "backoff_seconds": round(self._backoff_seconds, 2),
+                "queue_depth": sum(self._waiting.values()),
+                "interactive_waiting": self._waiting[INTERACTIVE],
+                "bulk_waiting": self._waiting[BULK],
+                "max_queue_depth": self._max_queue_depth,
+            }
+
+    def _refill(self, now):
+        # Caller holds self._cond
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+
+class ScheduledSession(Session):
+    """requests.Session that waits on the shared scheduler and retries 429 responses,
+    and 5xx responses to reads (see is_retriable)."""
+
+    def __init__(self, scheduler):
+        super().__init__()
+        self.scheduler = scheduler
+
+    def request(self, method, url, *args, **kwargs):
+        attempt = 0
+        throttled = 0.0
+        start = time.perf_counter()
+        while True:
+            throttled += self.scheduler.acquire()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except Exception:
+                record_request(table_from_url(url), time.perf_counter() - start, retries=attempt,
+                               throttle_seconds=throttled, error=True)
+                raise
+            if not is_retriable(method, url, response.status_code) or attempt >= self.scheduler.max_retries:
+                record_request(table_from_url(url), time.perf_counter() - start, len(response.content),
+                               retries=attempt, throttle_seconds=throttled, error=not response.ok)
+                return response
+            delay = self.scheduler.backoff(attempt, _retry_after_seconds(response))
+            logger.warning(f"Airtable returned {response.status_code} for {method} {url}; retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+
+def _retry_after_seconds(response):
+    value = response.headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """The scheduler shared by every AirTable instance in this process."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = AirtableScheduler()
+        return _scheduler
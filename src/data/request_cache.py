@@ -0,0 +1,131 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Seconds a looked-up record is reused; portioning runs also clear the cache when they start
+DEFAULT_TTL = 1800
+DEFAULT_MAX_ENTRIES = 1024
+TABLE_MAX_ENTRIES = {
+    "tblvTGgCq6k5iQBnL": 512,    # dishes (one entry per dish id, all of its lines)
+    "tbl63hIXZYUYY774v": 4096,   # clients
+    "tbl3jZNKowrO1IPAm": 256,    # portion algo constraints
+    "tblPhcO06ce4VcAPD": 2048,   # ingredients
+}
+
+
+def _caches_error(cache_errors, error):
+    return cache_errors(error) if callable(cache_errors) else bool(cache_errors)
+
+
+class SingleFlightCache:
+    """Coalesces concurrent identical lookups and keeps their results in a bounded LRU.
+
+    The first caller for a (table id, key) runs the fetch; callers that arrive while
+    it is in flight wait for it and get the same result, or the same exception.
+    Results are kept in one LRU per table, so a burst of lookups against one table
+    can't evict another table's entries. Every caller gets a deep copy, since callers
+    edit what they get back. Errors are only cached when asked for: `cache_errors` is
+    True for fetches that can't fail transiently, or a predicate picking the errors
+    worth keeping.
+    """
+
+    def __init__(self, max_entries=None, ttl=DEFAULT_TTL):
+        self.max_entries = {**TABLE_MAX_ENTRIES, **(max_entries or {})}
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}    # table id -> OrderedDict(key -> (stored_at, value, is_error))
+        self._in_flight = {}  # (table id, key) -> Future
+        self._generation = 0  # bumped by invalidate() so fetches started before it aren't stored
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, table_id, key, fetch, cache_errors=False):
+        """Cached or shared result of fetch() for this table and key."""
+        flight_key = (table_id, key)
+        with self._lock:
+            cached = self._fresh_entry(table_id, key)
+            if cached is not None:
+                self.hits += 1
+                if cached[2]:
+                    raise cached[1]
+                return copy.deepcopy(cached[1])
+            future = self._in_flight.get(flight_key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[flight_key] = Future()
+                generation = self._generation
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return copy.deepcopy(future.result())
+
+        try:
+            value = fetch()
+        except BaseException as e:
+            with self._lock:
+                self._in_flight.pop(flight_key, None)
+                if isinstance(e, Exception) and _caches_error(cache_errors, e) and generation == self._generation:
+                    self._store(table_id, key, e, is_error=True)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._in_flight.pop(flight_key, None)
+            if generation == self._generation:
+                self._store(table_id, key, copy.deepcopy(value))
+        future.set_result(value)
+        return copy.deepcopy(value)
+
+    def put(self, table_id, key, value):
+        """Store a value fetched elsewhere, e.g. by a bulk prefetch."""
+        with self._lock:
+            self._store(table_id, key, copy.deepcopy(value))
+
+    def contains(self, table_id, key):
+        with self._lock:
+            return self._fresh_entry(table_id, key) is not None
+
+    def _fresh_entry(self, table_id, key):
+        # Caller holds self._lock
+        entries = self._entries.get(table_id)
+        cached = entries.get(key) if entries else None
+        if cached is None or time.monotonic() - cached[0] >= self.ttl:
+            return None
+        entries.move_to_end(key)
+        return cached
+
+    def _store(self, table_id, key, value, is_error=False):
+        # Caller holds self._lock
+        entries = self._entries.setdefault(table_id, OrderedDict())
+        entries[key] = (time.monotonic(), value, is_error)
+        entries.move_to_end(key)
+        limit = self.max_entries.get(table_id, DEFAULT_MAX_ENTRIES)
+        while len(entries) > limit:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, table_ids=None):
+        """Forget cached results for these tables (default all)."""
+        with self._lock:
+            self._generation += 1
+            if table_ids is None:
+                self._entries.clear()
+            else:
+                for table_id in table_ids:
+                    self._entries.pop(table_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "entries": {table_id: len(entries) for table_id, entries in self._entries.items() if entries},
+            }
@@ -0,0 +1,122 @@
+import copy
+import logging
+import threading
+import time
+from datetime import datetime
+
+from src.portioning.nutrient_matrix import NutrientMatrix
+
+logger = logging.getLogger(__name__)
+
+
+class ReferenceSnapshot:
+    """In-memory copy of the weekly reference tables used by portioning.
+
+    Pulls Ingredients, Clients, Portion Algo Constraints and Variants Rule once
+    (through the AirTable disk cache) and answers lookups from dict indexes instead of one Airtable
+    request per call. Ingredients also get a NutrientMatrix for dish nutrition math.
+    Data stays as-is until `refresh()` is called again.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.loaded_at = None
+        self._lock = threading.Lock()
+
+        self.ingredients_by_id = {}
+        self.ingredients_by_ingredient_id = {}
+        self.clients_by_id = {}
+        self.constraints_by_id = {}
+        self.protein_type_map = {}
+        self.nutrient_matrix = None
+
+    def refresh(self):
+        """Re-download all reference tables and rebuild the indexes."""
+        with self._lock:
+            start = time.time()
+            # Served from the disk cache when the tables haven't changed since the last download
+            ingredients = self.db.cached_all(self.db.ingredients_table)
+            clients = self.db.cached_all(self.db.client_table)
+            constraints = self.db.cached_all(self.db.portion_algo_constraints_table)
+            variants = self.db.cached_all(self.db.variants_rule_table)
+
+            ingredients_by_id = {}
+            ingredients_by_ingredient_id = {}
+            for record in ingredients:
+                ingredients_by_id[record['id']] = record
+                ingredient_id = record.get('fields', {}).get('Ingredient ID')
+                if ingredient_id:
+                    # Keep the first match, same as records[0] on a formula lookup
+                    ingredients_by_ingredient_id.setdefault(str(ingredient_id).strip(), record)
+
+            # Build new indexes first, then swap, so readers never see a half-built snapshot
+            self.ingredients_by_id = ingredients_by_id
+            self.ingredients_by_ingredient_id = ingredients_by_ingredient_id
+            self.clients_by_id = {record['id']: record for record in clients}
+            self.constraints_by_id = {record['id']: record for record in constraints}
+            self.protein_type_map = build_protein_type_map(variants)
+            self.nutrient_matrix = NutrientMatrix.from_records(ingredients)
+            self.loaded_at = datetime.now()
+
+            logger.info(
+                "Reference snapshot loaded in %.1fs: %d ingredients, %d clients, %d constraints, %d protein variants",
+                time.time() - start, len(ingredients_by_id), len(self.clients_by_id),
+                len(self.constraints_by_id), len(self.protein_type_map),
+            )
+        return self
+
+    def is_loaded(self):
+        return self.loaded_at is not None
+
+    def age_seconds(self):
+        if self.loaded_at is None:
+            return None
+        return (datetime.now() - self.loaded_at).total_seconds()
+
+    def summary(self):
+        """Counts and load time, for display in the UI."""
+        return {
+            "loaded_at": self.loaded_at,
+            "ingredients": len(self.ingredients_by_id),
+            "clients": len(self.clients_by_id),
+            "constraints": len(self.constraints_by_id),
+            "protein_variants": len(self.protein_type_map),
+        }
+
+    # Lookups return deep copies: callers mutate the dicts they get back
+    def get_ingredient(self, record_id):
+        record = self.ingredients_by_id.get(record_id)
+        return copy.deepcopy(record) if record is not None else None
+
+    def get_ingredient_by_ingredient_id(self, ingredient_id):
+        record = self.ingredients_by_ingredient_id.get(str(ingredient_id).strip())
+        return copy.deepcopy(record) if record is not None else None
+
+    def get_client(self, record_id):
+        record = self.clients_by_id.get(record_id)
+        return copy.deepcopy(record) if record is not None else None
+
+    def get_constraint(self, record_id):
+        record = self.constraints_by_id.get(record_id)
+        return copy.deepcopy(record) if record is not None else None
+
+    def get_protein_type_map(self):
+        return dict(self.protein_type_map)
+
+
+def build_protein_type_map(records):
+    """Map ingredient record id -> final protein type from Variants Rule records."""
+    protein_type_map = {}
+    for record in records:
+        fields = record.get('fields', {})
+
+        # Check if this record has both required fields
+        if 'Ingredient' in fields and 'Final Protein Type (portioning)' in fields:
+            ingredients = fields['Ingredient']
+            protein_type = fields['Final Protein Type (portioning)'].lower()
+
+            # Add each ingredient to the map
+            if isinstance(ingredients, list):
+                for ingredient_id in ingredients:
+                    protein_type_map[ingredient_id] = protein_type
+    return protein_type_map
@@ -1,48 +1,337 @@
+from pyairtable import Api
 from pyairtable.api.table import Table  # Use direct table import
 from pyairtable.formulas import match
 import os
 from dotenv import load_dotenv
 from functools import cache
 import streamlit as st
-from src.data.exceptions import AirTableError, AirtableDataError
+from src.data.exceptions import AirTableError, AirtableDataError, AirtableFetchError
+from src.data.snapshot import ReferenceSnapshot, build_protein_type_map
+from src.data.clientservings_writer import ClientServingsWriter
+from src.data.disk_cache import CACHE_DIR_ENV, TABLE_TTLS, DiskCache
+from src.data.table_mirror import TableMirror
+from src.data.field_ids import DISHES_DISH_ID
+from src.data.request_cache import SingleFlightCache
+from src.data.instrumentation import charged_to, current_method, get_process_metrics, instrument_methods
+from src.portioning.nutrient_matrix import NutrientMatrix, line_nutrients
+import re
+import requests
+import sqlite3
+import time
+from src.data.rate_limiter import AIRTABLE_REQUESTS_PER_SECOND, INTERACTIVE, ScheduledSession, get_scheduler
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
 import logging
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# get_many() keeps each GET under Airtable's 16k URL limit and within one 100-record page
+MAX_URL_LENGTH = 15000
+GET_MANY_CHUNK_SIZE = 100
+
+INGREDIENTS_TABLE_ID = 'tblPhcO06ce4VcAPD'
+
+# Cheap field per mirrored table for id-only sweeps (see TableMirror)
+MIRROR_SWEEP_FIELDS = {
+    'tblxT3Pg9Qh0BVZhM': 'flddofDLsRpVLe14s',  # Open Orders: #
+    'tblVwpvUmsTS2Se51': '#',                  # Client Servings
+}
+CLIENTSERVINGS_EXPORT_VIEW = 'viwgt50kLisz8jx7b'
+
+CLIENT_DETAIL_FIELDS = ['identifier', 'First_Name', 'Last_Name', 'goal_calories', 'goal_carbs(g)',
+                        'goal_fiber(g)', 'goal_fat(g)', 'goal_protein(g)', 'Portion Algo Constraints', 'Meal',
+                        '# of snacks per day', 'Customization Tags']
+
+# Projected fields Airtable rejected as unknown, per table id; left out of later requests
+_unknown_fields = {}
+
+# Bag Tracking columns written per bag; the optional ones may not exist in every base
+BAG_CORE_FIELDS = ["#", "Included Dish", "Ice Pack Required", "Status"]
+BAG_OPTIONAL_FIELDS = ["Shipping Name", "Zone", "Household Members"]
+# Airtable omits empty values from records; what they compare equal to when diffing bags
+_BAG_EMPTY = {"Included Dish": [], "Ice Pack Required": False, "Household Members": ""}
+
+# Client Servings rows are keyed on the order item they portion (see upsert_clientservings)
+CLIENTSERVINGS_MERGE_FIELD = 'Linked OrderItem'
+# Table ids where Airtable refused performUpsert on the merge field; later upserts resolve and update instead
+_upsert_unsupported = set()
+
 class AirTableError(Exception):
     """Custom exception for AirTable operations"""
     pass
 
+@instrument_methods
 class AirTable():
-    def __init__(self, ex_api_key=None):
+    def __init__(self, ex_api_key=None, endpoint_url=None, cache_dir=None):
         # Load environment variables from the .env file
         load_dotenv()
-        self.conversion_cache = {}
-        self.sub_breakdown_cache = {}
+        # On-disk cache of reference tables shared across sessions; AIRTABLE_CACHE_DIR=off disables it
+        self.disk_cache = self._open_disk_cache(cache_dir)
+        self._load_ingredient_values()
+        # Optional in-memory copy of reference tables, see load_snapshot()
+        self.snapshot = None
+        self._mirrors = {}
+        # Concurrent lookups of the same dish/client/constraint share one request and result
+        self.request_cache = SingleFlightCache()
         
         # Get the API key from environment variables or the passed argument
         self.api_key = ex_api_key or st.secrets["AIRTABLE_API_KEY"]
         self.base_id = "appEe646yuQexwHJo"
+
+        # All tables share one session that waits on the process-wide rate limiter
+        self.scheduler = get_scheduler()
+        # endpoint_url / AIRTABLE_ENDPOINT_URL point the client at a local stand-in (src/benchmarks)
+        self.endpoint_url = endpoint_url or os.getenv("AIRTABLE_ENDPOINT_URL") or "https://api.airtable.com"
+        self.api = Api(self.api_key, retry_strategy=None, endpoint_url=self.endpoint_url)
+        self.api.session = ScheduledSession(self.scheduler)
+        self.api.api_key = self.api_key  # re-applies the auth header to the new session
         
         # Initialize tables
-        self.ingredients_table = Table(self.api_key, self.base_id, 'tblPhcO06ce4VcAPD')
-        self.client_table = Table(self.api_key, self.base_id, 'tbl63hIXZYUYY774v')
-        self.subscription_table = Table(self.api_key, self.base_id, 'tblk2MjS25RBH6r9F')
-        self.allergies_diet_table = Table(self.api_key, self.base_id, 'tblaR6iBdiGPVEEkL')
-        self.dishes_table = Table(self.api_key, self.base_id, 'tblvTGgCq6k5iQBnL')
-        self.variants_rule_table = Table(self.api_key, self.base_id, 'tblfdLImqSdAfHYI7')
-        self.open_orders_table = Table(self.api_key, self.base_id, 'tblxT3Pg9Qh0BVZhM')
-        self.clientserving_table = Table(self.api_key, self.base_id, 'tblVwpvUmsTS2Se51')
-        self.grocery_table = Table(self.api_key, self.base_id, 'tblVndbQyR3yHwoL5')
-        self.portion_algo_constraints_table = Table(self.api_key, self.base_id, 'tbl3jZNKowrO1IPAm')
-        self.shopify_product_table = Table(self.api_key, self.base_id, 'tblZqBM26nx9QW1mN')
-        self.shopify_variants_table = Table(self.api_key, self.base_id, 'tblonWG8wVPVA9w82')
-        self.bag_tracking_table = Table(self.api_key, self.base_id, 'tblI7GQIwoGRrPQwz')
+        self.ingredients_table = self.api.table(self.base_id, INGREDIENTS_TABLE_ID)
+        self.client_table = self.api.table(self.base_id, 'tbl63hIXZYUYY774v')
+        self.subscription_table = self.api.table(self.base_id, 'tblk2MjS25RBH6r9F')
+        self.allergies_diet_table = self.api.table(self.base_id, 'tblaR6iBdiGPVEEkL')
+        self.dishes_table = self.api.table(self.base_id, 'tblvTGgCq6k5iQBnL')
+        self.variants_rule_table = self.api.table(self.base_id, 'tblfdLImqSdAfHYI7')
+        self.open_orders_table = self.api.table(self.base_id, 'tblxT3Pg9Qh0BVZhM')
+        self.clientserving_table = self.api.table(self.base_id, 'tblVwpvUmsTS2Se51')
+        self.grocery_table = self.api.table(self.base_id, 'tblVndbQyR3yHwoL5')
+        self.portion_algo_constraints_table = self.api.table(self.base_id, 'tbl3jZNKowrO1IPAm')
+        self.shopify_product_table = self.api.table(self.base_id, 'tblZqBM26nx9QW1mN')
+        self.shopify_variants_table = self.api.table(self.base_id, 'tblonWG8wVPVA9w82')
+        self.bag_tracking_table = self.api.table(self.base_id, 'tblI7GQIwoGRrPQwz')
+
+    @staticmethod
+    def _open_disk_cache(cache_dir):
+        if (cache_dir or os.getenv(CACHE_DIR_ENV, "")).lower() == "off":
+            return None
+        try:
+            return DiskCache(cache_dir)
+        except Exception as e:
+            logger.warning(f"Disk cache unavailable, reading Airtable directly: {str(e)}")
+            return None
+
+    def _ingredient_values_ttl(self):
+        if self.disk_cache is None:
+            return TABLE_TTLS[INGREDIENTS_TABLE_ID]
+        return self.disk_cache.ttl_for(INGREDIENTS_TABLE_ID)
+
+    def _load_ingredient_values(self):
+        """Conversion factors and sub-ingredient breakdowns stored within the Ingredients TTL."""
+        self.conversion_cache = self._load_cached_values('conversion_factor', self._ingredient_values_ttl())
+        self.sub_breakdown_cache = self._load_cached_values('sub_breakdown', self._ingredient_values_ttl())
+        self._ingredient_values_loaded_at = time.time()
+
+    def _expire_ingredient_values(self):
+        # Values derived from Ingredients records age out like the cached table itself
+        if time.time() - self._ingredient_values_loaded_at >= self._ingredient_values_ttl():
+            self._load_ingredient_values()
+
+    def _load_cached_values(self, namespace, max_age=None):
+        if self.disk_cache is None:
+            return {}
+        try:
+            return self.disk_cache.load_namespace(namespace, max_age)
+        except Exception as e:
+            logger.warning(f"Could not load cached {namespace} values: {str(e)}")
+            return {}
+
+    def _persist_cached_value(self, namespace, key, value):
+        if self.disk_cache is not None:
+            try:
+                self.disk_cache.put_value(namespace, key, value)
+            except Exception as e:
+                logger.warning(f"Could not persist {namespace} for '{key}': {str(e)}")
+
+    def cached_all(self, table, view=None, fields=None):
+        """
+        table.all(view=, fields=) answered from the disk cache while the table is within
+        its TTL or unchanged in Airtable since it was downloaded.
+        """
+        if self.disk_cache is None:
+            options = {key: value for key, value in (("view", view), ("fields", fields)) if value}
+            return table.all(**options)
+        records, changed = self.disk_cache.fetch_all(table, view=view, fields=fields)
+        if changed and table.id == self.ingredients_table.id:
+            # Derived per-ingredient values may be stale now
+            self.clear_ingredient_caches()
+        return records
+
+    def clear_ingredient_caches(self):
+        self.conversion_cache = {}
+        self.sub_breakdown_cache = {}
+        if self.disk_cache is not None:
+            self.disk_cache.clear_namespace('conversion_factor')
+            self.disk_cache.clear_namespace('sub_breakdown')
+
+    def invalidate_disk_cache(self, tables=None):
+        """Force the next read of these tables (default: all) to go to Airtable."""
+        self.request_cache.invalidate([table.id for table in tables] if tables is not None else None)
+        if self.disk_cache is None:
+            return
+        if tables is None:
+            self.disk_cache.clear()
+            self.conversion_cache = {}
+            self.sub_breakdown_cache = {}
+            return
+        for table in tables:
+            self.disk_cache.invalidate_table(table.id)
+            if table.id == self.ingredients_table.id:
+                self.clear_ingredient_caches()
+
+    def mirrored_all(self, table, view, fields=None):
+        """
+        Records of an Open Orders / Client Servings view from the local mirror, synced
+        incrementally. Each field list gets its own mirror. Falls back to reading
+        Airtable directly when there is no disk cache.
+        """
+        options = {"view": view} if view else {}
+        if self.disk_cache is None or not view or table.id not in MIRROR_SWEEP_FIELDS:
+            return self.all_records(table, fields=fields, **options)
+        key = (table.id, view, tuple(fields or ()))
+        if key not in self._mirrors:
+            self._mirrors[key] = TableMirror(self, table, view, MIRROR_SWEEP_FIELDS[table.id], fields=fields)
+        try:
+            return self._mirrors[key].records()
+        except sqlite3.Error as e:
+            logger.warning(f"Mirror of {table.id} view {view} unavailable, reading Airtable: {str(e)}")
+            return self.all_records(table, fields=fields, **options)
+
+    def resync_mirrors(self, table=None):
+        """Drop the local mirrors (of one table, default all) so the next read re-downloads."""
+        if self.disk_cache is not None:
+            self.disk_cache.invalidate_mirrors(table.id if table is not None else None)
+
+    def load_snapshot(self):
+        """
+        Load the reference-data snapshot (Ingredients, Clients, Portion Algo Constraints,
+        Variants Rule), or refresh it if an earlier run loaded it. Called at the start of
+        each run: the tables come through the disk cache, so unchanged tables only cost
+        their freshness probes. Lookup methods answer from memory afterwards.
+        """
+        if self.snapshot is None:
+            self.snapshot = ReferenceSnapshot(self)
+        return self.snapshot.refresh()
+
+    def refresh_snapshot(self):
+        """Re-download the reference-data snapshot, bypassing the disk cache."""
+        self.invalidate_disk_cache([self.ingredients_table, self.client_table,
+                                    self.portion_algo_constraints_table, self.variants_rule_table])
+        if self.snapshot is None:
+            self.snapshot = ReferenceSnapshot(self)
+        return self.snapshot.refresh()
+
+    def drop_snapshot(self):
+        """Go back to answering every lookup from Airtable."""
+        self.snapshot = None
+
+    def _snapshot_record(self, getter_name, record_id):
+        """Look a record up in the snapshot; None when there's no snapshot or no such record."""
+        if self.snapshot is None or not self.snapshot.is_loaded():
+            return None
+        return getattr(self.snapshot, getter_name)(record_id)
+
+    def all_records(self, table, fields=None, **options):
+        """
+        table.all(fields=fields, **options). A projected field that Airtable doesn't know
+        (renamed or deleted) is dropped and the request retried, so a stale field list
+        degrades to a wider read instead of failing the artifact.
+        """
+        if fields:
+            fields = [f for f in fields if f not in _unknown_fields.get(table.id, ())]
+        while True:
+            try:
+                return table.all(fields=fields, **options) if fields else table.all(**options)
+            except requests.HTTPError as e:
+                unknown = _unknown_field_name(e)
+                if not fields or unknown not in fields:
+                    raise
+                logger.warning(f"Field '{unknown}' no longer exists in {table.id}; leaving it out of projected reads")
+                _unknown_fields.setdefault(table.id, set()).add(unknown)
+                fields = [f for f in fields if f != unknown]
+
+    def get_many(self, table, record_ids, fields=None):
+        """
+        Fetch many records by id with chunked OR(RECORD_ID()=...) formulas instead of
+        one .get() per id. Chunks run concurrently; the shared scheduler keeps them within
+        the rate budget. Returns {record_id: record}; ids that don't exist are left out.
+        """
+        unique_ids = list(dict.fromkeys(rid for rid in record_ids if rid))
+        if not unique_ids:
+            return {}
+        chunks = self._record_id_chunks(unique_ids, fields)
+        priority = self.scheduler.current_priority()
+        method = current_method()
+
+        def fetch(formula):
+            with self.scheduler.priority(priority), charged_to(method):
+                return self.all_records(table, fields=fields, formula=formula)
+
+        try:
+            if len(chunks) == 1:
+                results = [fetch(chunks[0])]
+            else:
+                with ThreadPoolExecutor(max_workers=min(len(chunks), AIRTABLE_REQUESTS_PER_SECOND)) as executor:
+                    results = list(executor.map(fetch, chunks))
+        except Exception as e:
+            raise AirTableError(f"Failed to fetch {len(unique_ids)} records from {table.id}: {str(e)}")
+
+        records = {record['id']: record for result in results for record in result}
+        logger.debug(f"get_many: {len(records)}/{len(unique_ids)} records from {table.id} in {len(chunks)} requests")
+        return records
+
+    @staticmethod
+    def _record_id_chunks(record_ids, fields=None):
+        """Split ids into OR(RECORD_ID()=...) formulas whose encoded URL stays under MAX_URL_LENGTH."""
+        return AirTable._formula_chunks([f"RECORD_ID()='{record_id}'" for record_id in record_ids], fields)
+
+    @staticmethod
+    def _formula_chunks(all_terms, fields=None):
+        """Join formula terms into OR(...) formulas whose encoded URL stays under MAX_URL_LENGTH."""
+        # Rough fixed cost of the base URL, table id and fields[] params
+        overhead = 200 + sum(len(quote(f"fields[]={field}")) + 1 for field in (fields or []))
+        chunks, terms, length = [], [], overhead
+        for term in all_terms:
+            term_length = len(quote(term + ", "))
+            if terms and (len(terms) >= GET_MANY_CHUNK_SIZE or length + term_length > MAX_URL_LENGTH):
+                chunks.append(f"OR({', '.join(terms)})")
+                terms, length = [], overhead
+            terms.append(term)
+            length += term_length
+        chunks.append(f"OR({', '.join(terms)})")
+        return chunks
+
+    def _get_ingredient_records(self, rec_ids):
+        """{rec_id: ingredient record} from the snapshot when loaded, else one get_many."""
+        records = {}
+        missing = []
+        for rec_id in dict.fromkeys(rec_ids):
+            record = self._snapshot_record('get_ingredient', rec_id)
+            if record is not None:
+                records[rec_id] = record
+            else:
+                missing.append(rec_id)
+        if missing:
+            records.update(self.get_many(self.ingredients_table, missing))
+        return records
+
+    def nutrient_matrix(self, fields_by_id):
+        """NutrientMatrix covering these ingredients ({rec_id: fields}): the snapshot's when it
+        has them all, else one built from the given fields."""
+        if self.snapshot is not None and self.snapshot.is_loaded():
+            matrix = self.snapshot.nutrient_matrix
+            if matrix is not None and matrix.covers(fields_by_id):
+                return matrix
+        return NutrientMatrix.from_fields(fields_by_id)
 
     def get_ingredient_details_by_rcd_id(self, id):
-        ingredient = self.ingredients_table.get(id)['fields']
+        record = self._snapshot_record('get_ingredient', id)
+        if record is not None:
+            return record['fields']
+        ingredient = self.request_cache.get(self.ingredients_table.id, id,
+                                            lambda: self.ingredients_table.get(id))['fields']
         return ingredient
 
     def get_ingredient_details_by_name(self, ingredient_id, component):
@@ -65,8 +354,9 @@ class AirTable():
         fields_to_return = ['Ingredient ID', 'Ingredient Name',
                             'Component', 'Grams', 'Energy (kcal)', 
                             'Carbohydrate, total (g)', 'Protein (g)', 
-                            'Fat, Total (g)', 'Dietary Fiber (g)','Sodium (mg)','Calcium (mg)', 'Phosphorus, P (mg)','Fatty acids, total saturated (g)']
-        ingredients = self.ingredients_table.get(recId)
+                            'Fat, Total (g)', 'Dietary Fiber (g)','Sodium (mg)','Calcium (mg)', 'Phosphorus, P (mg)','Fatty acids, total saturated (g)',
+                            'Energy (Atwater General Factors) (kcal)']
+        ingredients = self._snapshot_record('get_ingredient', recId) or self.ingredients_table.get(recId)
         if ingredients:
             for field in fields_to_return:
                 result[field] = ingredients['fields'].get(field,0)
@@ -74,6 +364,24 @@ class AirTable():
         else:
             return None
 
+    def get_ingredients_details_by_recIds(self, recIds, records=None):
+        """Bulk get_ingredient_details_by_recId: {recId: details}. Raises if any id is missing.
+        `records` ({rec_id: ingredient record}) skips the lookup, e.g. from get_order_source_records."""
+        fields_to_return = ['Ingredient ID', 'Ingredient Name',
+                            'Component', 'Grams', 'Energy (kcal)', 
+                            'Carbohydrate, total (g)', 'Protein (g)', 
+                            'Fat, Total (g)', 'Dietary Fiber (g)','Sodium (mg)','Calcium (mg)', 'Phosphorus, P (mg)','Fatty acids, total saturated (g)',
+                            'Energy (Atwater General Factors) (kcal)']
+        if records is None:
+            records = self._get_ingredient_records(recIds)
+        missing = [recId for recId in recIds if recId not in records]
+        if missing:
+            raise AirtableDataError(f"Ingredients not found: {', '.join(missing)}")
+        return {
+            recId: {field: records[recId]['fields'].get(field, 0) for field in fields_to_return}
+            for recId in dict.fromkeys(recIds)
+        }
+
     def get_allergy_by_id(self, record_id):
         try:
             record = self.allergies_diet_table.get(record_id)
@@ -100,7 +408,15 @@ class AirTable():
     # #changed
     # @cache
 
-    def get_all_open_orders_for_portioning(self):
+    def get_all_open_orders_for_portioning(self, include_portioned=False):
+        return self.open_orders_table.all(**self._portioning_open_orders_query(include_portioned))
+
+    def iterate_open_orders_for_portioning(self, page_size=100, include_portioned=False):
+        """Same records as get_all_open_orders_for_portioning, yielded one page at a time as they arrive."""
+        yield from self.open_orders_table.iterate(page_size=page_size, **self._portioning_open_orders_query(include_portioned))
+
+    def _portioning_open_orders_query(self, include_portioned=False):
+        # include_portioned: also orders that already have a Portion Result, for a re-run that upserts
         SHOPIFY_ID = 'fldXVHeLiy8npzVnb'
         DELETIONS = 'fldwgVkboOme5380s'
         QUANTITY = 'fldvkwFMlBOW5um2y'
@@ -108,11 +424,11 @@ class AirTable():
         FINAL_INGREDIENTS = 'fldZhqltOLU0tiEWI'
         TO_MATCH_CLIENT_NUTRITION = 'fldjEgeRh2bGxajXT'
         DISH_ID = 'fldLOvWuvg6X9Odvw'
-        PORITON_RESULT = 'fldadHgYOukaCrC6v',
-        SKIP_PORTION = "fldIKtQS5bIEr1iNU",
+        PORITON_RESULT = 'fldadHgYOukaCrC6v'
+        SKIP_PORTION = "fldIKtQS5bIEr1iNU"
         INDEX = 'flddofDLsRpVLe14s'
         
-        open_orders = self.open_orders_table.all(
+        query = dict(
             view='viwrZHgdsYWnAMhtX',
             fields=[INDEX,
                     TO_MATCH_CLIENT_NUTRITION,
@@ -126,8 +442,9 @@ class AirTable():
                     SKIP_PORTION],
                     formula="{Portion Result (in ClientServings)} = BLANK()"
                     )
-        
-        return open_orders
+        if include_portioned:
+            del query['formula']
+        return query
 
     # Subscription Orders (Intermediary Table)
     # @cache
@@ -149,13 +466,16 @@ class AirTable():
         """
         return self._get_dish_ids_by_meals_value("Breakfast")
 
+    def get_weekly_menu_dish_ids(self):
+        """Internal Dish IDs of every row in the weekly menu table, whatever its Meals value."""
+        return self._get_dish_ids_by_meals_value(None)
+
     def _get_dish_ids_by_meals_value(self, meals_value):
-        formula = match({"Meals": meals_value})
         try:
-            records = self.shopify_product_table.all(
-                fields=["Internal Dish ID", "Meals"],
-                formula=formula,
-            )
+            records = [
+                record for record in self.cached_all(self.shopify_product_table, fields=["Internal Dish ID", "Meals"])
+                if meals_value is None or _meals_matches(record.get("fields", {}).get("Meals"), meals_value)
+            ]
         except Exception as e:
             logger.warning("Could not fetch dishes for Meals=%s from weekly menu table: %s", meals_value, e)
             return set()
@@ -194,39 +514,95 @@ class AirTable():
         # Define field IDs for variants table
         INGREDIENT_FIELD = 'fldSh0BApXpOMKYb5'  # Replace with actual field ID for Ingredient
         PROTEIN_TYPE_FIELD = 'fldnDXrKI4vXeSm7Q'  # Replace with actual field ID for Final Protein Type
+        if self.snapshot is not None and self.snapshot.is_loaded():
+            return self.snapshot.get_protein_type_map()
         records = self.variants_rule_table.all()
-        protein_type_map = {}
-    
-        for record in records:
-            fields = record.get('fields', {})
-            
-            # Check if this record has both required fields
-            if 'Ingredient' in fields and 'Final Protein Type (portioning)' in fields:
-                ingredients = fields['Ingredient']
-                protein_type = fields['Final Protein Type (portioning)'].lower()
-                
-                # Add each ingredient to the map
-                if isinstance(ingredients, list):
-                    for ingredient_id in ingredients:
-                        protein_type_map[ingredient_id] = protein_type
-
-        return protein_type_map
+        return build_protein_type_map(records)
 
 
     def get_dish_calc_nutritions_by_dishId(self, dish_id):
         try:
-            DISH_FIELDS = {
-                'DISH_ID': 'fldQbBplmx4oOHhR4',
-                'INGREDIENT': 'fldaaMEjUKH2bCtEj'
-            }
-
-            formula = f"{DISH_FIELDS['DISH_ID']}={dish_id}"
-
-            dish_all_ingrdts = self.dishes_table.all(formula=formula)
+            dish_all_ingrdts = self.get_dish_lines(dish_id)
+            self._load_line_ingredients(dish_all_ingrdts)
+        except Exception as e:
+            raise AirtableFetchError(f"Unexpected error processing dish {dish_id}: {str(e)}")
+        # Built and validated once per dish, validation errors included (a failed ingredient
+        # fetch is retried by the next caller); each caller gets its own copy
+        return self.request_cache.get(self.dishes_table.id, _dish_key(dish_id),
+                                      lambda: self.build_dish_calc_nutritions(dish_id, dish_all_ingrdts),
+                                      cache_errors=lambda e: not isinstance(e, AirtableFetchError))
+
+    def get_dish_lines(self, dish_id):
+        """Dishes rows (one per ingredient) of a dish, from prefetch_dish_lines when it ran."""
+        dish_id = _dish_key(dish_id)
+        return self.request_cache.get(self.dishes_table.id, ('lines', dish_id),
+                                      lambda: self.dishes_table.all(formula=dish_lines_formula(dish_id)))
+
+    def get_order_source_records(self, dish_id, ingredient_ids):
+        """
+        The records an order's dish and final ingredients are built from: the dish's Dishes
+        rows and {rec_id: Ingredients record} for its lines plus `ingredient_ids`. Answered
+        from memory once the dish lines are prefetched and the snapshot is loaded.
+        """
+        lines = self.get_dish_lines(dish_id)
+        line_ids = [line['fields']['Ingredient'][0] for line in lines if line['fields'].get('Ingredient')]
+        records = self._get_ingredient_records(line_ids + list(ingredient_ids))
+        if self.snapshot is None or not self.snapshot.is_loaded():
+            # Building the dish looks its line ingredients up through the request cache
+            for rec_id in line_ids:
+                if rec_id in records:
+                    self.request_cache.put(self.ingredients_table.id, rec_id, records[rec_id])
+        return lines, records
+
+    def has_dish_lines(self, dish_id):
+        return self.request_cache.contains(self.dishes_table.id, ('lines', _dish_key(dish_id)))
+
+    def prefetch_dish_lines(self, dish_ids):
+        """
+        Load the Dishes rows of many dishes with chunked OR(Dish ID=...) queries, plus the
+        ingredients they use, so get_dish_calc_nutritions_by_dishId and the Excel export
+        answer from memory. Dishes already loaded are skipped. Returns the number loaded.
+        A failed prefetch is logged and leaves each dish to be fetched on first use.
+        """
+        wanted = [dish_id for dish_id in dict.fromkeys(_dish_key(d) for d in dish_ids)
+                  if dish_id is not None and not self.has_dish_lines(dish_id)]
+        if not wanted:
+            return 0
+        lines = {dish_id: [] for dish_id in wanted}
+        try:
+            for formula in self._formula_chunks([dish_lines_formula(dish_id) for dish_id in wanted]):
+                for record in self.dishes_table.all(formula=formula):
+                    dish_id = _dish_key(record['fields'].get('Dish ID'))
+                    if dish_id in lines:
+                        lines[dish_id].append(record)
+        except Exception as e:
+            logger.warning(f"Could not prefetch dish lines for {len(wanted)} dishes: {str(e)}")
+            return 0
+        for dish_id, records in lines.items():
+            self.request_cache.put(self.dishes_table.id, ('lines', dish_id), records)
+        try:
+            self._load_line_ingredients([record for records in lines.values() for record in records])
+        except Exception as e:
+            logger.warning(f"Could not prefetch ingredients of the dish lines: {str(e)}")
+        logger.info(f"Prefetched {sum(len(r) for r in lines.values())} dish lines for {len(wanted)} dishes")
+        return len(wanted)
+
+    def _load_line_ingredients(self, dish_lines):
+        """Bulk-load the ingredients of these dish lines that neither the snapshot nor the cache has."""
+        if self.snapshot is not None and self.snapshot.is_loaded():
+            return
+        missing = [line['fields']['Ingredient'][0] for line in dish_lines if line['fields'].get('Ingredient')]
+        missing = [rec_id for rec_id in missing if not self.request_cache.contains(self.ingredients_table.id, rec_id)]
+        for rec_id, record in self.get_many(self.ingredients_table, missing).items():
+            self.request_cache.put(self.ingredients_table.id, rec_id, record)
+
+    def build_dish_calc_nutritions(self, dish_id, dish_all_ingrdts):
+        """Scale the dish lines of one dish by their ingredients' nutrition (from the snapshot when loaded)."""
+        try:
             if not dish_all_ingrdts:
                 raise AirtableDataError(f"No dish found with ID {dish_id}")
 
-            dishes_information = []
+            lines = []
             for dish_ingrdt in dish_all_ingrdts:
                 crt_ingrdt = dish_ingrdt['fields']
 
@@ -241,10 +617,10 @@ class AirTable():
                 try:
                     crt_ingrdt_nutrition = self.get_ingredient_details_by_rcd_id(
                         crt_ingrdt['Ingredient'][0])
-                    if not crt_ingrdt_nutrition:
-                        raise AirtableDataError(f"Could not find nutrition details for ingredient {crt_ingrdt['Ingredient'][0]} in dish {dish_id}")
                 except Exception as e:
-                    raise AirtableDataError(f"Error fetching ingredient details: {str(e)}")
+                    raise AirtableFetchError(f"Error fetching ingredient details: {str(e)}")
+                if not crt_ingrdt_nutrition:
+                    raise AirtableDataError(f"Error fetching ingredient details: Could not find nutrition details for ingredient {crt_ingrdt['Ingredient'][0]} in dish {dish_id}")
 
                 # Check for required nutrition fields
                 required_fields = ['Grams', 'Energy (kcal)', 'Protein (g)', 'Fat, Total (g)', 
@@ -252,34 +628,23 @@ class AirTable():
                 missing_fields = [field for field in required_fields if field not in crt_ingrdt_nutrition]
                 if missing_fields:
                     raise AirtableDataError(f"Missing nutrition fields {missing_fields} for ingredient {crt_ingrdt_nutrition.get('Ingredient Name')} in dish {dish_id}")
+                lines.append((crt_ingrdt, crt_ingrdt_nutrition))
+
+            # Scale every line at once: rate = line grams / ingredient base grams
+            rec_ids = [crt_ingrdt['Ingredient'][0] for crt_ingrdt, _ in lines]
+            matrix = self.nutrient_matrix({rec_id: nutrition for rec_id, (_, nutrition) in zip(rec_ids, lines)})
+            rates = matrix.rates(rec_ids, [crt_ingrdt['Grams'] for crt_ingrdt, _ in lines])
+            for rec_id, base_grams, calculate_rate in zip(rec_ids, matrix.base_grams[matrix.rows(rec_ids)], rates):
+                if base_grams == 0:
+                    raise AirtableDataError(f"Zero division error when calculating rate for ingredient {rec_id} in dish {dish_id}")
+                if calculate_rate <= 0:
+                    raise AirtableDataError(f"Invalid calculation rate ({calculate_rate}) for ingredient {rec_id} in dish {dish_id}")
+            nutrients = matrix.scale(rec_ids, rates)
 
-                crt_ingrdt_nutrition["(g)"] = crt_ingrdt_nutrition.pop("Grams")
-                merged_dish_ingrdt = {'id': crt_ingrdt['Dish ID'], **
-                                    dish_ingrdt['fields'], **crt_ingrdt_nutrition}
-
-                try:
-                    calculate_rate = crt_ingrdt['Grams']/crt_ingrdt_nutrition['(g)']
-                    if calculate_rate <= 0:
-                        raise AirtableDataError(f"Invalid calculation rate ({calculate_rate}) for ingredient {crt_ingrdt['Ingredient'][0]} in dish {dish_id}")
-                except ZeroDivisionError:
-                    raise AirtableDataError(f"Zero division error when calculating rate for ingredient {crt_ingrdt['Ingredient'][0]} in dish {dish_id}")
-
-                merged_dish_ingrdt['id'] = crt_ingrdt['Ingredient'][0]
-                merged_dish_ingrdt['energy'] = calculate_rate * (
-                    merged_dish_ingrdt['Energy (kcal)'] if merged_dish_ingrdt['Energy (kcal)'] > 0 else
-                    merged_dish_ingrdt['Energy (Atwater General Factors) (kcal)'] if merged_dish_ingrdt['Energy (Atwater General Factors) (kcal)'] > 0 else
-                    0
-                )
-                merged_dish_ingrdt['Kcal'] = merged_dish_ingrdt['energy']
-                merged_dish_ingrdt['Protein (g)'] = calculate_rate * merged_dish_ingrdt['Protein (g)']
-                merged_dish_ingrdt['Fat, Total (g)'] = calculate_rate * merged_dish_ingrdt['Fat, Total (g)']
-                merged_dish_ingrdt['Dietary Fiber (g)'] = calculate_rate * merged_dish_ingrdt['Dietary Fiber (g)']
-                merged_dish_ingrdt['Carbohydrate, total (g)'] = calculate_rate * merged_dish_ingrdt['Carbohydrate, total (g)']
-                merged_dish_ingrdt['Sodium (mg)'] = calculate_rate * merged_dish_ingrdt.get('Sodium (mg)', 0)
-                merged_dish_ingrdt['Calcium (mg)'] = calculate_rate * merged_dish_ingrdt.get('Calcium (mg)', 0)
-                merged_dish_ingrdt['Phosphorus, P (mg)'] = calculate_rate * merged_dish_ingrdt.get('Phosphorus, P (mg)', 0)
-                merged_dish_ingrdt['Fatty acids, total saturated (g)'] = calculate_rate * merged_dish_ingrdt.get('Fatty acids, total saturated (g)', 0)
-
+            dishes_information = []
+            for (crt_ingrdt, crt_ingrdt_nutrition), rec_id, row in zip(lines, rec_ids, nutrients):
+                merged_dish_ingrdt = {**crt_ingrdt, **crt_ingrdt_nutrition, 'id': rec_id, 'Grams': crt_ingrdt['Grams']}
+                merged_dish_ingrdt.update(line_nutrients(row))
                 new_dish_ingrdt = {key: merged_dish_ingrdt[key] for key in [
                     'id', 'Airtable Dish Name', 'Component (from Ingredient)', 'Ingredient ID', 'NDB', 
                     'Ingredient Name', 'Grams', 'Kcal', 'Protein (g)', 'Fat, Total (g)', 
@@ -300,30 +665,21 @@ class AirTable():
     def get_client_email(self, id):
         try:
             # Direct access assuming 'Email' is the key
-            email = self.client_table.get(id)['fields']['TypeForm_Email']
+            client = self._snapshot_record('get_client', id) or self.client_table.get(id)
+            email = client['fields']['TypeForm_Email']
             return email
         except KeyError:
             return None
 
     def get_client_details(self, recId):
-        formula = dict()
-        result = dict()
-        formula['id'] = recId
-        fields_to_return = ['identifier', 'First_Name', 'Last_Name', 'goal_calories', 'goal_carbs(g)',
-                            'goal_fiber(g)', 'goal_fat(g)', 'goal_protein(g)', 'Portion Algo Constraints', 'Meal','# of snacks per day','Customization Tags']
-        ingredients = self.client_table.get(recId)
-        if ingredients:
-            for field in fields_to_return:
-                result[field] = ingredients['fields'].get(field, None)
-            return result
-        else:
-            return None
-    def get_all_clients(self,view=None):
-        if view:
-            records = self.client_table.all(view=view)
-        else:
-            records = self.client_table.all()
-        return records
+        # Single-record GETs can't be projected; a one-id formula query can
+        ingredients = self._snapshot_record('get_client', recId) or self.request_cache.get(
+            self.client_table.id, recId,
+            lambda: self.get_many(self.client_table, [recId], fields=CLIENT_DETAIL_FIELDS).get(recId))
+        return client_details_from_record(ingredients)
+    def get_all_clients(self,view=None, fields=None):
+        options = {"view": view} if view else {}
+        return self.all_records(self.client_table, fields=fields, **options)
 
     # method name changed
     # def get_sku(self,id):
@@ -337,11 +693,7 @@ class AirTable():
             return None
     def get_weekly_products(self,view = None):
         try:
-            if view:
-                records = self.shopify_product_table.all(view=view)
-            else:
-                records = self.shopify_product_table.all()
-            return records
+            return self.cached_all(self.shopify_product_table, view=view)
         except Exception as e:
             raise AirTableError(f"Failed to get weekly products data: {str(e)}")
 
@@ -349,7 +701,8 @@ class AirTable():
     def get_identifier(self, id):
         try:
             # Direct access assuming 'Email' is the key
-            identifier = self.client_table.get(id)['fields']['Name']
+            client = self._snapshot_record('get_client', id) or self.client_table.get(id)
+            identifier = client['fields']['Name']
             return identifier
         except KeyError:
             return None
@@ -365,7 +718,8 @@ class AirTable():
 
     # Return constraints information
     def get_constraints_details_by_rcdId(self, id):
-        fields_here = self.portion_algo_constraints_table.get(id)
+        fields_here = self._snapshot_record('get_constraint', id) or self.request_cache.get(
+            self.portion_algo_constraints_table.id, id, lambda: self.portion_algo_constraints_table.get(id))
         return fields_here
 
     def get_allergies_details_by_rcdId(self, id):
@@ -377,6 +731,8 @@ class AirTable():
         all_records = self.clientserving_table.all(fields=['#'])
         id_list = [x["id"] for x in all_records]
         self.clientserving_table.batch_delete(id_list)
+        if self.disk_cache is not None:
+            self.disk_cache.delete_mirror_records(self.clientserving_table.id, id_list)
 
     def get_rcdid_by_shopify_orderlineitem(self, shopify_orderlineitem):
         SHOPIFY_INTERNAL_ID = 'flddofDLsRpVLe14s'
@@ -386,8 +742,80 @@ class AirTable():
         open_orders = self.open_orders_table.all(formula=formula)
         return open_orders[0]['id']
 
-    def output_clientservings(self, portion_recommendations):
-        
+    def output_clientservings(self, portion_recommendations, upsert=False):
+        prepared_row = self.prepare_clientservings_row(portion_recommendations)
+
+        if upsert:
+            # Replace this order item's row, if it has one
+            self.upsert_clientservings([prepared_row])
+            return
+
+        # Create the record in Airtable
+        self.clientserving_table.create(prepared_row)
+
+        return
+
+    def create_clientservings(self, prepared_rows):
+        """Create up to 10 prepared Client Servings rows in a single request."""
+        return self.clientserving_table.batch_create(prepared_rows)
+
+    def upsert_clientservings(self, prepared_rows, existing_ids=None):
+        """
+        Create or update up to 10 prepared Client Servings rows keyed on Linked OrderItem, so
+        re-portioning an order replaces its row in place: one performUpsert request.
+
+        Airtable only merges on some field types. If it refuses the linked field, the rows are
+        matched against existing_ids ({order item record id: Client Servings record id}, or a
+        callable returning it, see clientservings_ids_by_order), then updated or created.
+        Rows created that way are added to existing_ids.
+        """
+        table = self.clientserving_table
+        if table.id not in _upsert_unsupported:
+            try:
+                result = table.batch_upsert([{'fields': row} for row in prepared_rows],
+                                            key_fields=[CLIENTSERVINGS_MERGE_FIELD])
+                return result['records']
+            except requests.HTTPError as e:
+                if not _merge_field_rejected(e):
+                    raise
+                logger.warning(f"Airtable can't merge {table.id} on '{CLIENTSERVINGS_MERGE_FIELD}': {str(e)}; "
+                               f"updating existing rows by record id instead")
+                _upsert_unsupported.add(table.id)
+
+        if callable(existing_ids):
+            existing_ids = existing_ids()
+        elif existing_ids is None:
+            existing_ids = self.clientservings_ids_by_order()
+        updates, creates = [], []
+        for row in prepared_rows:
+            record_id = existing_ids.get(_first(row.get(CLIENTSERVINGS_MERGE_FIELD)))
+            if record_id is not None:
+                updates.append({'id': record_id, 'fields': row})
+            else:
+                creates.append(row)
+        records = table.batch_update(updates) if updates else []
+        if creates:
+            created = table.batch_create(creates)
+            for row, record in zip(creates, created):
+                existing_ids[_first(row.get(CLIENTSERVINGS_MERGE_FIELD))] = record['id']
+            records += created
+        return records
+
+    def clientservings_ids_by_order(self):
+        """{order item record id: Client Servings record id} from one projected read of the table."""
+        ids = {}
+        for record in self.all_records(self.clientserving_table, fields=[CLIENTSERVINGS_MERGE_FIELD]):
+            order_id = _first(record['fields'].get(CLIENTSERVINGS_MERGE_FIELD))
+            if order_id is not None:
+                ids.setdefault(order_id, record['id'])
+        return ids
+
+    def new_clientservings_writer(self, **kwargs):
+        """Buffered writer that batches output_clientservings() calls, see ClientServingsWriter."""
+        return ClientServingsWriter(self, **kwargs)
+
+    def prepare_clientservings_row(self, portion_recommendations):
+        """Flatten a recommendation summary into the Client Servings field layout."""
         # Flatten and prepare the data for Airtable
         prepared_row = {}
         prepared_row['Linked OrderItem'] = [
@@ -424,10 +852,7 @@ class AirTable():
         prepared_row['Fiber %'] = nutrition_info['Fiber %']/100
         prepared_row['Carbs %'] = nutrition_info['Carbs %']/100
 
-        # Create the record in Airtable
-        self.clientserving_table.create(prepared_row)
-
-        return
+        return prepared_row
 
     def get_subscription_details_by_client_identifier(self, client_identifier):
         CLIENT_IDENTIFIER_FIELD = 'fld0igiHWQd8Sgh7S'
@@ -437,19 +862,16 @@ class AirTable():
         subscription_details = self.subscription_table.all(formula=formula)
         return subscription_details
 
-    def get_clientservings_data(self,view):
+    def get_clientservings_data(self,view, fields=None):
         try:
-            if view:
-                records = self.clientserving_table.all(view=view)
-            else:
-                records = self.clientserving_table.all()
-            return records
+            return self.mirrored_all(self.clientserving_table, view, fields=fields)
         except Exception as e:
             raise AirTableError(f"Failed to get client servings data: {str(e)}")
 
     def get_ingredient_conversion_factor(self, ingredient_name):
         """Get the raw/cooked conversion factor for an ingredient by name with caching"""
         # Check cache first
+        self._expire_ingredient_values()
         if ingredient_name in self.conversion_cache:
             return self.conversion_cache[ingredient_name]
             
@@ -461,8 +883,8 @@ class AirTable():
             formula = dict()
             formula[INGREDIENT_ID] = ingredient_name
             formula = match(formula)
-            # Search for ingredient by name
-            records = self.ingredients_table.all(formula=formula)
+            # Search for ingredient by name, from the snapshot when it's loaded
+            records = self._ingredient_records_by_name(ingredient_name, formula)
             
             if records:
                 conversion_factor = records[0]['fields'].get("Cooked/Raw Conversion", 1.0)
@@ -474,6 +896,7 @@ class AirTable():
             
             # Cache the result
             self.conversion_cache[ingredient_name] = result
+            self._persist_cached_value('conversion_factor', ingredient_name, result)
             return result
                 
         except Exception as e:
@@ -481,15 +904,24 @@ class AirTable():
             self.conversion_cache[ingredient_name] = 1.0
             raise AirTableError(f"Error getting conversion factor for '{ingredient_name}': {str(e)}")
 
+    def _ingredient_records_by_name(self, ingredient_name, formula):
+        """Ingredients matching an Ingredient ID, from the snapshot when it's loaded."""
+        snapshot_record = self._snapshot_record('get_ingredient_by_ingredient_id', ingredient_name)
+        if snapshot_record:
+            return [snapshot_record]
+        return self.request_cache.get(self.ingredients_table.id, ('by_name', ingredient_name),
+                                      lambda: self.ingredients_table.all(formula=formula))
+
     def get_ingredient_sub_breakdown(self, ingredient_name):
         """Get parsed Sub-ingredients Breakdown list for a composed SF ingredient, with caching."""
+        self._expire_ingredient_values()
         if ingredient_name in self.sub_breakdown_cache:
             return self.sub_breakdown_cache[ingredient_name]
 
         try:
             INGREDIENT_ID = 'flduR79GRxTbyfyKe'
             formula = match({INGREDIENT_ID: ingredient_name})
-            records = self.ingredients_table.all(formula=formula)
+            records = self._ingredient_records_by_name(ingredient_name, formula)
 
             result = None
             if records:
@@ -499,6 +931,7 @@ class AirTable():
                     result = json.loads(breakdown_raw) if isinstance(breakdown_raw, str) else breakdown_raw
 
             self.sub_breakdown_cache[ingredient_name] = result
+            self._persist_cached_value('sub_breakdown', ingredient_name, result)
             return result
 
         except Exception as e:
@@ -509,10 +942,16 @@ class AirTable():
     def get_clientservings_one_dish(self, dish_id):
         """Get all client servings for a specific dish"""
         try:
+            if self.disk_cache is not None:
+                # Filter the mirrored export view locally; same field as DISH_ID below
+                return [
+                    record for record in self.mirrored_all(self.clientserving_table, CLIENTSERVINGS_EXPORT_VIEW)
+                    if _first(record['fields'].get('Dish ID (from Linked OrderItem)')) == dish_id
+                ]
             DISH_ID = 'fldhrw7U0pV4D9Cad'
             filter_fields = {DISH_ID: dish_id}
             formula = match(filter_fields)
-            return self.clientserving_table.all(formula=formula,view='viwgt50kLisz8jx7b')
+            return self.clientserving_table.all(formula=formula,view=CLIENTSERVINGS_EXPORT_VIEW)
         except Exception as e:
             logger.error(f"Failed to get client servings for dish ID {dish_id}: {str(e)}")
             raise AirTableError(f"Failed to get client servings for dish ID {dish_id}: {str(e)}")
@@ -520,11 +959,7 @@ class AirTable():
     def get_dish_squarespace_name(self, dish_id):
         """Get default ingredients for a specific dish"""
         try:
-            DISH_ID = 'fldQbBplmx4oOHhR4'
-            filter_fields = {DISH_ID: dish_id}
-            formula = match(filter_fields)
-            
-            dish_ingredients_records = self.dishes_table.all(formula=formula)
+            dish_ingredients_records = self.get_dish_lines(dish_id)
             name = ''
             
             for dish_ingredient in dish_ingredients_records:
@@ -539,11 +974,7 @@ class AirTable():
     def get_dish_default_ingredients(self, dish_id):
             """Get default ingredients for a specific dish"""
             try:
-                DISH_ID = 'fldQbBplmx4oOHhR4'
-                filter_fields = {DISH_ID: dish_id}
-                formula = match(filter_fields)
-                
-                dish_ingredients_records = self.dishes_table.all(formula=formula)
+                dish_ingredients_records = self.get_dish_lines(dish_id)
                 dish_all_ingredients = []
                 
                 for dish_ingredient in dish_ingredients_records:
@@ -561,7 +992,7 @@ class AirTable():
         result = {}
         
         try:
-            ingredient = self.ingredients_table.get(rec_id)
+            ingredient = self._snapshot_record('get_ingredient', rec_id) or self.ingredients_table.get(rec_id)
             for field in fields_to_return:
                 result[field] = ingredient['fields'][field]
             return result
@@ -569,11 +1000,26 @@ class AirTable():
             logger.warning(f"Ingredient not found with ID {rec_id}: {str(e)}")
             return None
 
-    def get_all_open_orders(self,view=None):
-        if view:
-            return self.open_orders_table.all(view=view)
-        else:
-            return self.open_orders_table.all()
+    def get_ingredients_details_by_rec_ids(self, rec_ids):
+        """Bulk get_ingredient_details_by_rec_id: {rec_id: details or None}."""
+        records = self._get_ingredient_records([rec_id for rec_id in rec_ids if rec_id])
+        result = {}
+        for rec_id in rec_ids:
+            record = records.get(rec_id)
+            if record is None:
+                logger.warning(f"Ingredient not found with ID {rec_id}")
+                result[rec_id] = None
+                continue
+            try:
+                result[rec_id] = {field: record['fields'][field] for field in ('Ingredient Name', 'Component')}
+            except KeyError as e:
+                logger.warning(f"Ingredient {rec_id} is missing field {str(e)}")
+                result[rec_id] = None
+        return result
+
+    def get_all_open_orders(self,view=None, fields=None):
+        """Open orders, optionally only the given fields (ids or names) to keep payloads small."""
+        return self.mirrored_all(self.open_orders_table, view, fields=fields)
 
     def upsert_bag_record(
         self,
@@ -588,32 +1034,14 @@ class AirTable():
         Create or update a row in the Bag Tracking table (tblI7GQIwoGRrPQwz).
         dish_record_ids: Client Servings Airtable record ids (rec…) for linked field Included Dish.
         Optional text fields Shipping Name / Zone / Household Members if those columns exist in the base.
+        For a whole run of bags use batch_upsert_bags.
         """
         from pyairtable.formulas import match as at_match
 
-        linked = [
-            str(rid).strip()
-            for rid in (dish_record_ids if isinstance(dish_record_ids, list) else [dish_record_ids])
-            if str(rid).strip().startswith("rec")
-        ]
-
         formula = at_match({"#": bag_barcode})
         existing = self.bag_tracking_table.all(formula=formula)
-        fields = {
-            "#": bag_barcode,
-            "Included Dish": linked,
-            "Ice Pack Required": bool(ice_pack_required),
-            "Status": "Pending",
-        }
-        if shipping_name is not None and str(shipping_name).strip():
-            fields["Shipping Name"] = str(shipping_name).strip()
-        if zone is not None and str(zone).strip():
-            fields["Zone"] = str(zone).strip()
-        if household_members is not None:
-            if isinstance(household_members, list):
-                fields["Household Members"] = "\n".join(str(x) for x in household_members if str(x).strip())
-            else:
-                fields["Household Members"] = str(household_members)
+        fields = bag_tracking_fields(bag_barcode, dish_record_ids, ice_pack_required,
+                                     shipping_name, zone, household_members)
 
         try:
             if existing:
@@ -622,12 +1050,7 @@ class AirTable():
                 self.bag_tracking_table.create(fields)
         except Exception as e:
             # If optional columns are missing in Airtable, retry with core fields only.
-            core = {
-                "#": bag_barcode,
-                "Included Dish": linked,
-                "Ice Pack Required": bool(ice_pack_required),
-                "Status": "Pending",
-            }
+            core = {field: fields[field] for field in BAG_CORE_FIELDS}
             if existing:
                 self.bag_tracking_table.update(existing[0]["id"], core)
             else:
@@ -635,19 +1058,79 @@ class AirTable():
             if "UNKNOWN_FIELD_NAME" not in str(e) and "Unknown field" not in str(e):
                 raise
 
+    def batch_upsert_bags(self, bags):
+        """
+        Write a run of bags to Bag Tracking. bags: dicts with the upsert_bag_record arguments.
+
+        Reads the existing rows for these barcodes once (chunked OR formulas), compares field
+        values, and writes only new or changed bags with batch_upsert keyed on #, 10 per request.
+        An optional column missing from the base is left out and the write retried.
+        Returns {"created": n, "updated": n, "unchanged": n}.
+        """
+        from pyairtable.formulas import match as at_match
+
+        table = self.bag_tracking_table
+        wanted = {}
+        for bag in bags:
+            fields = bag_tracking_fields(**bag)
+            wanted[str(fields["#"])] = fields  # a barcode listed twice keeps its last values
+        counts = {"created": 0, "updated": 0, "unchanged": 0}
+        if not wanted:
+            return counts
+
+        projection = [field for field in BAG_CORE_FIELDS + BAG_OPTIONAL_FIELDS
+                      if field not in _unknown_fields.get(table.id, ())]
+        existing = {}
+        terms = [str(at_match({"#": fields["#"]})) for fields in wanted.values()]
+        for formula in self._formula_chunks(terms, fields=projection):
+            for record in self.all_records(table, fields=projection, formula=formula):
+                existing.setdefault(str(record["fields"].get("#")), record)
+
+        changed = []
+        for barcode, fields in wanted.items():
+            fields = {k: v for k, v in fields.items() if k not in _unknown_fields.get(table.id, ())}
+            record = existing.get(barcode)
+            if record is None:
+                counts["created"] += 1
+            elif any(record["fields"].get(k, _BAG_EMPTY.get(k)) != v for k, v in fields.items()):
+                counts["updated"] += 1
+            else:
+                counts["unchanged"] += 1
+                continue
+            changed.append(fields)
+
+        while changed:
+            try:
+                table.batch_upsert([{"fields": fields} for fields in changed], key_fields=["#"])
+                break
+            except requests.HTTPError as e:
+                unknown = _unknown_field_name(e)
+                if unknown not in BAG_OPTIONAL_FIELDS:
+                    raise
+                logger.warning(f"Bag Tracking has no '{unknown}' column; writing bags without it")
+                _unknown_fields.setdefault(table.id, set()).add(unknown)
+                changed = [{k: v for k, v in fields.items() if k != unknown} for fields in changed]
+
+        logger.info(f"Bag Tracking: {counts['created']} created, {counts['updated']} updated, "
+                    f"{counts['unchanged']} unchanged")
+        return counts
+
     def update_bag_status(self, bag_barcode, status):
         """Update Status on a bag tracking record."""
         from pyairtable.formulas import match as at_match
         formula = at_match({"#": bag_barcode})
-        existing = self.bag_tracking_table.all(formula=formula)
-        if existing:
-            self.bag_tracking_table.update(existing[0]["id"], {"Status": status})
+        # Bag scans are interactive: served ahead of bulk traffic such as portioning
+        with self.scheduler.priority(INTERACTIVE):
+            existing = self.bag_tracking_table.all(formula=formula)
+            if existing:
+                self.bag_tracking_table.update(existing[0]["id"], {"Status": status})
 
     def get_bag_record(self, bag_barcode):
         """Fetch a bag tracking record by bag barcode (#)."""
         from pyairtable.formulas import match as at_match
         formula = at_match({"#": bag_barcode})
-        records = self.bag_tracking_table.all(formula=formula)
+        with self.scheduler.priority(INTERACTIVE):
+            records = self.bag_tracking_table.all(formula=formula)
         if not records:
             return None
         fields = records[0].get("fields", {})
@@ -655,10 +1138,117 @@ class AirTable():
         return fields
 
 
+def client_details_from_record(record):
+    """The CLIENT_DETAIL_FIELDS of a client record as a new dict, None without a record."""
+    if not record:
+        return None
+    return {field: record['fields'].get(field, None) for field in CLIENT_DETAIL_FIELDS}
+
+
+def _dish_key(dish_id):
+    """Dish ids as used for cache keys: lookup lists unwrapped, numbers as int."""
+    if isinstance(dish_id, list):
+        dish_id = dish_id[0] if dish_id else None
+    if dish_id is None or dish_id == "":
+        return None
+    try:
+        return int(float(dish_id))
+    except (TypeError, ValueError):
+        return str(dish_id).strip()
+
+
+def dish_lines_formula(dish_id):
+    """Formula selecting the Dishes rows (one per ingredient) of a dish."""
+    return f"{DISHES_DISH_ID}={dish_id}"
+
+
+def _unknown_field_name(error):
+    """The field name from a 422 UNKNOWN_FIELD_NAME response, else None."""
+    response = getattr(error, "response", None)
+    if response is None or response.status_code != 422:
+        return None
+    try:
+        details = response.json().get("error", {})
+    except ValueError:
+        return None
+    if not isinstance(details, dict) or details.get("type") != "UNKNOWN_FIELD_NAME":
+        return None
+    found = re.search(r'"(.+)"', details.get("message", ""))
+    return found.group(1) if found else None
+
+
+def bag_tracking_fields(bag_barcode, dish_record_ids, ice_pack_required, shipping_name=None, zone=None,
+                        household_members=None):
+    """Bag Tracking fields for one bag; see AirTable.upsert_bag_record."""
+    linked = [
+        str(rid).strip()
+        for rid in (dish_record_ids if isinstance(dish_record_ids, list) else [dish_record_ids])
+        if str(rid).strip().startswith("rec")
+    ]
+    fields = {
+        "#": bag_barcode,
+        "Included Dish": linked,
+        "Ice Pack Required": bool(ice_pack_required),
+        "Status": "Pending",
+    }
+    if shipping_name is not None and str(shipping_name).strip():
+        fields["Shipping Name"] = str(shipping_name).strip()
+    if zone is not None and str(zone).strip():
+        fields["Zone"] = str(zone).strip()
+    if household_members is not None:
+        if isinstance(household_members, list):
+            fields["Household Members"] = "\n".join(str(x) for x in household_members if str(x).strip())
+        else:
+            fields["Household Members"] = str(household_members)
+    return fields
+
+
+def _merge_field_rejected(error):
+    """Whether an HTTP error is Airtable refusing the performUpsert fieldsToMergeOn (requests or httpx)."""
+    response = getattr(error, 'response', None)
+    if response is None or response.status_code != 422:
+        return False
+    try:
+        details = response.json().get("error", {})
+    except ValueError:
+        return False
+    if not isinstance(details, dict):
+        details = {"type": str(details)}
+    return "merge" in f"{details.get('type', '')} {details.get('message', '')}".lower()
+
+
+def _first(value):
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+def _meals_matches(value, meals_value):
+    # Same comparison as match({"Meals": ...}): multi-selects compare as their joined text
+    if isinstance(value, list):
+        value = ", ".join(str(v) for v in value)
+    return value == meals_value
+
+
 def new_database_access():
     return AirTable()
 
 
+def get_airtable_traffic_stats():
+    """Queue depth, retries and time spent throttled for all Airtable traffic in this process."""
+    return get_scheduler().stats()
+
+
+def get_request_cache_stats(db):
+    """Hits, coalesced waits and evictions of an AirTable's single-flight lookup cache."""
+    return db.request_cache.stats()
+
+
+def get_airtable_method_stats():
+    """Per-method, per-table call counts and latency percentiles since the process started."""
+    return get_process_metrics().summary()
+
+
 # AirTableAccessObject = default_store_access()
 if __name__ == "__main__":
     ac = new_database_access()
@@ -0,0 +1,109 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from src.data.disk_cache import CLOCK_SKEW_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# A read within this many seconds of the last sync is served without asking Airtable
+MIN_SYNC_INTERVAL = 15
+# Id-only sweep that catches deletions and records entering/leaving the view unmodified
+SWEEP_INTERVAL = 300
+# LAST_MODIFIED_TIME() ignores lookup/formula fields, so re-read everything this often
+RESYNC_INTERVAL = 1800
+
+_sync_locks = {}
+_sync_locks_guard = threading.Lock()
+
+
+def _sync_lock(key):
+    with _sync_locks_guard:
+        return _sync_locks.setdefault(key, threading.Lock())
+
+
+def _utc_iso(dt):
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+class TableMirror:
+    """Local copy of one Airtable view kept current with incremental syncs.
+
+    The first read downloads the view. Later reads fetch only records created or
+    modified since the last sync watermark, plus the ids of all records modified
+    since then (so records edited out of the view are dropped). Every
+    `sweep_interval` seconds an id-only pass over the view removes deleted records
+    and restores view order; every `resync_interval` seconds the view is re-read in
+    full, because edits to computed fields don't move LAST_MODIFIED_TIME().
+
+    State lives in the SQLite DiskCache, so every AirTable instance and session
+    on the machine shares the same mirror. A mirror can be limited to `fields`.
+    """
+
+    def __init__(self, db, table, view, sweep_field, fields=None, min_sync_interval=MIN_SYNC_INTERVAL,
+                 sweep_interval=SWEEP_INTERVAL, resync_interval=RESYNC_INTERVAL):
+        self.db = db
+        self.table = table
+        self.view = view
+        self.sweep_field = sweep_field
+        self.fields = list(fields) if fields else None
+        self.min_sync_interval = min_sync_interval
+        self.sweep_interval = sweep_interval
+        self.resync_interval = resync_interval
+        self.cache = db.disk_cache
+        self.key = f"{table.id}:{view}:{','.join(sorted(self.fields or []))}"
+
+    def records(self):
+        """All records of the view, in view order, after syncing if due."""
+        self.sync()
+        return self.cache.read_mirror(self.key)
+
+    def sync(self, force=False):
+        with _sync_lock(self.key):
+            state = self.cache.get_mirror_state(self.key)
+            now = time.time()
+            if state is None or now - state["resynced_at"] >= self.resync_interval:
+                return self._full_sync()
+            if not force and now - state["synced_at"] < self.min_sync_interval:
+                return
+            self._delta_sync(state["watermark"], sweep=force or now - state["swept_at"] >= self.sweep_interval)
+
+    def invalidate(self):
+        self.cache.invalidate_mirrors(self.table.id)
+
+    def _new_watermark(self):
+        # Taken before querying so edits made during the sync are seen by the next one
+        return _utc_iso(datetime.now(timezone.utc) - timedelta(seconds=CLOCK_SKEW_SECONDS))
+
+    def _full_sync(self):
+        watermark = self._new_watermark()
+        records = self.db.all_records(self.table, fields=self.fields, view=self.view)
+        self.cache.replace_mirror(self.key, self.table.id, self.view, records, watermark)
+        logger.info(f"Mirrored {len(records)} records of {self.table.id} view {self.view}")
+
+    def _delta_sync(self, watermark, sweep=False):
+        new_watermark = self._new_watermark()
+        since = f"DATETIME_PARSE('{watermark}')"
+        changed_formula = f"OR(IS_AFTER(LAST_MODIFIED_TIME(), {since}), IS_AFTER(CREATED_TIME(), {since}))"
+
+        changed = self.db.all_records(self.table, fields=self.fields, view=self.view, formula=changed_formula)
+        changed_ids = {record["id"] for record in changed}
+        # Modified anywhere in the table but no longer in the view
+        touched = self.table.all(formula=changed_formula, fields=[self.sweep_field])
+        removed = [record["id"] for record in touched if record["id"] not in changed_ids]
+
+        order = None
+        if sweep:
+            order = [record["id"] for record in self.table.all(view=self.view, fields=[self.sweep_field])]
+            in_view = set(order)
+            known = self.cache.mirror_ids(self.key) | changed_ids
+            removed += [record_id for record_id in known if record_id not in in_view]
+            # Entered the view without being edited, e.g. through a lookup
+            missing = [record_id for record_id in order if record_id not in known]
+            if missing:
+                changed += list(self.db.get_many(self.table, missing, fields=self.fields).values())
+
+        self.cache.apply_mirror_delta(self.key, changed, removed, watermark=new_watermark, order=order)
+        if changed or removed:
+            logger.info(f"Synced {self.table.id} view {self.view}: {len(changed)} changed, {len(removed)} removed")
@@ -11,8 +11,12 @@ from src.data.store_access import new_database_access
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def format_output_order_ingredients(db, deleted_ingredients, new_ingredients, final_ingredients_not_in_recommend,tags):
-    """Format output for ordered ingredients with deletions and additions"""
+def format_output_order_ingredients(db, deleted_ingredients, new_ingredients, final_ingredients_not_in_recommend,tags, ingredient_details=None):
+    """Format output for ordered ingredients with deletions and additions.
+
+    ingredient_details: optional {rec_id: {'Ingredient Name', 'Component'}} already fetched
+    with db.get_ingredients_details_by_rec_ids; looked up in one request otherwise.
+    """
     components_output = {
         "Meat": [], 
         "Sauce": [],
@@ -25,12 +29,15 @@ def format_output_order_ingredients(db, deleted_ingredients, new_ingredients, fi
         return components_output
         
     try:
+        if ingredient_details is None:
+            ingredient_details = db.get_ingredients_details_by_rec_ids(list(deleted_ingredients) + list(new_ingredients))
+
         # Process deleted ingredients
         for ingredient in deleted_ingredients:
-            ingredient_details = db.get_ingredient_details_by_rec_id(ingredient)
-            if ingredient_details:
-                ingredient_name = ingredient_details['Ingredient Name']
-                ingredient_component = ingredient_details['Component']
+            details = ingredient_details.get(ingredient)
+            if details:
+                ingredient_name = details['Ingredient Name']
+                ingredient_component = details['Component']
                 if ingredient_component in components_output:
                     if (ingredient_component == 'Sauce' and 'No Sauce' in tags):
                         components_output[ingredient_component].append("NO SAUCE")
@@ -47,10 +54,10 @@ def format_output_order_ingredients(db, deleted_ingredients, new_ingredients, fi
                     
         # Process new ingredients
         for ingredient in new_ingredients:
-            ingredient_details = db.get_ingredient_details_by_rec_id(ingredient)
-            if ingredient_details:
-                ingredient_name = ingredient_details['Ingredient Name']
-                ingredient_component = ingredient_details['Component']
+            details = ingredient_details.get(ingredient)
+            if details:
+                ingredient_name = details['Ingredient Name']
+                ingredient_component = details['Component']
                 if ingredient_component in components_output:
                     if ingredient in final_ingredients_not_in_recommend:
                         components_output[ingredient_component].append(ingredient_name.upper()+"(✩)")
@@ -62,7 +69,7 @@ def format_output_order_ingredients(db, deleted_ingredients, new_ingredients, fi
         logger.error(f"Error formatting output for ordered ingredients: {str(e)}")
         raise AirTableError(f"Error formatting output for ordered ingredients: {str(e)}")
 
-def format_output_default_ingredients(db, default_ingredients):
+def format_output_default_ingredients(db, default_ingredients, ingredient_details=None):
     """Format output for default ingredients"""
     components_output = {
         "Meat": [], 
@@ -73,14 +80,17 @@ def format_output_default_ingredients(db, default_ingredients):
     }
 
     try:
+        if ingredient_details is None:
+            ingredient_details = db.get_ingredients_details_by_rec_ids([i for i in default_ingredients if i])
+
         for ingredient in default_ingredients:
             if not ingredient:
                 continue
                 
-            ingredient_details = db.get_ingredient_details_by_rec_id(ingredient)
-            if ingredient_details:
-                ingredient_name = ingredient_details['Ingredient Name']
-                ingredient_component = ingredient_details['Component']
+            details = ingredient_details.get(ingredient)
+            if details:
+                ingredient_name = details['Ingredient Name']
+                ingredient_component = details['Component']
                 if ingredient_component in components_output:
                     components_output[ingredient_component].append(ingredient_name)
                     
@@ -96,8 +106,15 @@ def one_dish_output(db, dish_id):
         default_ingredients = db.get_dish_default_ingredients(dish_id)
         dish_product_name = db.get_dish_squarespace_name(dish_id)
         ordered_clientservings = db.get_clientservings_one_dish(dish_id)
+
+        # Resolve every ingredient this dish's servings mention in one bulk lookup
+        all_ingredient_ids = [i for i in default_ingredients if i]
+        for client_serving in ordered_clientservings:
+            all_ingredient_ids += client_serving['fields'].get('Original Ingredients (from Linked OrderItem)', [])
+            all_ingredient_ids += client_serving['fields'].get('Final Ingredients with User Edits (from Linked OrderItem)', [])
+        ingredient_details = db.get_ingredients_details_by_rec_ids(all_ingredient_ids)
         
-        default_ingredients_formatted = format_output_default_ingredients(db, default_ingredients)
+        default_ingredients_formatted = format_output_default_ingredients(db, default_ingredients, ingredient_details)
         default_ingredients_formatted[' '] = dish_id
         default_ingredients_formatted['Position'] = dish_product_name
         
@@ -112,16 +129,16 @@ def one_dish_output(db, dish_id):
             original_ingredients = client_serving['fields'].get('Original Ingredients (from Linked OrderItem)', [])
 
             # Calculate deletions: in original but not in final, excluding meat/protein components
-            deleted_ingredients = [ingredient for ingredient in original_ingredients if ingredient not in final_ingredients_with_user_edits and db.get_ingredient_details_by_recId(ingredient)['Component'] not in ['Meat', 'Protein']]
+            deleted_ingredients = [ingredient for ingredient in original_ingredients if ingredient not in final_ingredients_with_user_edits and (ingredient_details.get(ingredient) or {}).get('Component') not in ['Meat', 'Protein']]
             #Calculate new ingredients: in final but not in original
             new_ingredients = [ingredient for ingredient in final_ingredients_with_user_edits if ingredient not in original_ingredients]
 
             # Get deleted ingredient names
             deleted_ingredients_names = []
             for ingredient_id in deleted_ingredients:
-                ingredient_details = db.get_ingredient_details_by_rec_id(ingredient_id)
-                if ingredient_details:
-                    deleted_ingredients_names.append(ingredient_details['Ingredient Name'])
+                details = ingredient_details.get(ingredient_id)
+                if details:
+                    deleted_ingredients_names.append(details['Ingredient Name'])
 
             # Get ingredients in final ingredients but not in ingredients to recommend
             final_ingredients_not_in_recommend = []
@@ -145,7 +162,7 @@ def one_dish_output(db, dish_id):
             }
             
             # Get components output
-            components_output = format_output_order_ingredients(db, deleted_ingredients, new_ingredients, final_ingredients_not_in_recommend,tags)
+            components_output = format_output_order_ingredients(db, deleted_ingredients, new_ingredients, final_ingredients_not_in_recommend,tags, ingredient_details)
             
             # Add component amounts
             components_output['Meat'].append(
@@ -198,10 +215,8 @@ def generate_formatted_clientservings_onedish(clientservings):
 def consolidated_all_dishes_output(db, progress=None):
     """Consolidate output for all dishes"""
     try:
-        all_clientservings = db.clientserving_table.all(
-            fields=['Dish ID (from Linked OrderItem)', 'MealType from Profile (from Linked OrderItem)'],
-            view='viwgt50kLisz8jx7b'
-        )
+        # Full records from the local mirror; one_dish_output reads the same view per dish
+        all_clientservings = db.get_clientservings_data(view='viwgt50kLisz8jx7b')
         if len(all_clientservings) == 0:
             raise AirTableError("No clientservings found in the source view. Please check the view and try again.")
         all_output = pd.DataFrame()
@@ -239,6 +254,8 @@ def consolidated_all_dishes_output(db, progress=None):
         if progress is not None:
             progress["total"] = len(all_dishes)
             progress["done"] = 0
+        # Dish lines of every dish in one bulk load instead of two queries per dish
+        db.prefetch_dish_lines(all_dishes)
         # Process each dish
         for idx, dish_id in enumerate(all_dishes, start=1):
             result = one_dish_output(db, dish_id)
@@ -15,6 +15,16 @@ from lxml import etree
 from pptx.oxml import parse_xml
 from src.data.store_access import new_database_access
 ICE_PACK_TAG = 'Ice Pack'
+# Columns process_data needs, requested by name next to the field ids declared below
+ONE_PAGER_ORDER_COLUMNS = [
+    'Delivery Date', 'Meal Sticker', 'Meal Portion', 'To_Match_Client_Nutrition',
+    'Shipping Address 1', 'Shipping Address 2', 'Shipping City',
+    'Shipping Province', 'Shipping Postal Code', 'Customer Name','# of Parts','Zone Number (from Delivery Zone)','Shipping Name','Meal Type from Profile',
+]
+ONE_PAGER_CLIENT_COLUMNS = [
+    'identifier', 'First_Name', 'Last_Name', 'goal_calories', 'goal_carbs(g)',
+    'goal_protein(g)', 'goal_fat(g)', 'goal_fiber(g)', 'Customization Tags',
+]
 
 def get_open_orders(db):
     open_orders_fields = {
@@ -34,7 +44,9 @@ def get_open_orders(db):
         'SHIPPING_NAME': 'fldIEhlbz7JzbpTOK',
         'MEAL_TYPE_FROM_PROFILE': 'fldGqQtz9zyJmMDq9',
     }
-    data = db.get_all_open_orders(view='viwuVy9aN2LLZrcPF')
+    # Only the declared fields plus the columns process_data reads by name
+    data = db.get_all_open_orders(view='viwuVy9aN2LLZrcPF',
+                                  fields=list(open_orders_fields.values()) + ONE_PAGER_ORDER_COLUMNS)
     # Create DataFrame and map column names
     df = pd.DataFrame([record['fields'] for record in data])
     column_mapping = {v.replace('fld', ''): k for k, v in open_orders_fields.items()}
@@ -54,7 +66,7 @@ def get_clients_info(db):
         'CLIENT_LNAME': 'fldIq6giA1dDcut8T',
         'TAGS':'fldKdacQ9GMB070cD'
     }
-    data = db.get_all_clients()  # Replace with actual view ID 
+    data = db.get_all_clients(fields=list(clients_fields.values()) + ONE_PAGER_CLIENT_COLUMNS)
     # Create DataFrame and map column names
     df = pd.DataFrame([{**record['fields'], 'id': record['id']} for record in data])
     column_mapping = {v.replace('fld', ''): k for k, v in clients_fields.items()}
@@ -70,11 +82,7 @@ def process_data(db):
     # Clean column names and values
     df_orders.columns = [col.strip() for col in df_orders.columns]
     df_clients.columns = [col.strip() for col in df_clients.columns]
-    required_cols = [
-        'Delivery Date', 'Meal Sticker', 'Meal Portion', 'To_Match_Client_Nutrition',
-        'Shipping Address 1', 'Shipping Address 2', 'Shipping City', 
-        'Shipping Province', 'Shipping Postal Code', 'Customer Name','# of Parts','Zone Number (from Delivery Zone)','Shipping Name','Meal Type from Profile',
-    ]
+    required_cols = list(ONE_PAGER_ORDER_COLUMNS)
 
     # Ensure all required columns exist (missing ones will be created and filled with "")
     df_orders = df_orders.reindex(columns=required_cols, fill_value="")
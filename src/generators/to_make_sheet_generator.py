@@ -8,7 +8,6 @@ from io import BytesIO
 import logging
 import ast
 import json
-from openai import OpenAI
 import os
 
 # Initialize OpenAI client lazily to avoid issues when running outside Streamlit
@@ -27,6 +26,8 @@ def get_openai_client():
         if not api_key:
             api_key = os.getenv("OPENAI_API_KEY")
         if api_key:
+            # Imported here: openai is slow to import and only needed once a sheet is generated
+            from openai import OpenAI
             _openai_client = OpenAI(api_key=api_key)
     return _openai_client
 
@@ -35,6 +36,11 @@ from src.data.exceptions import AirTableError
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 VIEW = "viw4WN1XsjMnHwMkt"
+# Client Servings fields read by group_ingredients_by_component
+CLIENT_SERVING_FIELDS = [
+    'MealType from Profile (from Linked OrderItem)', 'Dish', 'Modified Recipe Details',
+    'Starch', 'Meat', 'Sauce', 'Garnish', 'Veggies',
+]
 
 def parse_sauce_multiplier(sauce_field):
     """Parse sauce multiplier from sauce field (e.g., 'Tomato Sauce (2 x sauce)' -> 2)"""
@@ -921,7 +927,7 @@ def generate_to_make_sheet(db):
     try:
         logger.info("Starting to-make sheet generation")
         # Get client servings data
-        client_servings = db.get_clientservings_data(view=VIEW)
+        client_servings = db.get_clientservings_data(view=VIEW, fields=CLIENT_SERVING_FIELDS)
         if not client_servings:
             raise AirTableError("No client servings data found")
 
@@ -1,6 +1,9 @@
 import numpy as np
 import random
 import math
+from types import SimpleNamespace
+
+from src.portioning.qp_solver import solve_qp, solve_qp_batch
 
 SPECIAL_YOGURT_PROTEIN_ITEM_KEYWORDS = ["overnight oats", "yogurt", "yoghurt","parfait"]
 MAX_SPECIAL_YOGURT_PROTEIN_GRAM = 400
@@ -12,12 +15,84 @@ MAX_VEGGIES_GRAM = 300
 MAX_STARCH_GRAM = 280
 MIN_STARCH_GRAM = 50
 MAX_PROTEIN_PER_TYPE = {"meat": 200, "fish": 220, "tofu": 250, "vegan": 200}
+# "rules": the sequential rule-based solver; "qp": one constrained least-squares solve over component scalers
+SOLVER_MODES = ("rules", "qp")
+# Smallest scaler either solver gives a component
+MIN_SCALER = 0.1
+# Pull of each component scaler towards 1 in "qp" mode; keeps the problem strictly convex
+# when a component moves none of the weighted nutrients
+QP_SCALER_RIDGE = 1e-3
+
+
+def _running_total(rows):
+    """Column totals of a (lines x nutrients) array, added line by line in recipe order like
+    the `totals[nutrient] += ...` loop it replaces (np.sum adds pairwise, which can differ in
+    the last bit and move a value across a 0.1 rounding boundary)."""
+    if not len(rows):
+        return np.zeros(rows.shape[1:])
+    return 0.0 + np.add.accumulate(rows, axis=0)[-1]
+
+
+def _ordered_sum(values):
+    """Builtin sum() over a vector, so gram and scaler totals add up exactly as the list
+    code they replace."""
+    return sum(values.tolist())
+
+
+class RecipeArrays:
+    """A recipe as arrays: per-base-gram nutrient matrix, base grams and component masks.
+
+    Built once per solve; the solver's state is then just a scaler vector. Nutrient totals
+    are one masked product over the matrix and component grams a masked sum of
+    base grams x scalers.
+    """
+
+    def __init__(self, recipe, per_base_keys=()):
+        self.recipe = recipe
+        self.components = [ing['component'] for ing in recipe]
+        self.base_grams = np.array([ing['baseGrams'] for ing in recipe], dtype=float)
+        self.values = np.zeros((len(recipe), len(per_base_keys)))
+        for row, ingredient in enumerate(recipe):
+            for col, key in enumerate(per_base_keys):
+                value = ingredient.get(key, 0)
+                if value is None:
+                    continue
+                try:
+                    self.values[row, col] = float(value)
+                except (ValueError, TypeError) as e:
+                    # As before, the ingredient's remaining nutrients don't count
+                    print(f"Warning: Error processing {ingredient.get('ingredientName', 'unknown')}: {str(e)}")
+                    break
+        components = np.array(self.components, dtype=object)
+        self.masks = {component: components == component for component in set(self.components)}
+        self.meat_mask = np.array(['protein' in component for component in self.components], dtype=bool)
+        self._indices = {component: np.flatnonzero(mask).tolist() for component, mask in self.masks.items()}
+        self._no_rows = np.zeros(len(recipe), dtype=bool)
+
+    def mask(self, component):
+        return self.masks.get(component, self._no_rows)
+
+    def indices(self, component):
+        return self._indices.get(component, [])
+
+    def scalers(self, recipe=None):
+        return np.array([ing.get('scaler', 1.0) for ing in (self.recipe if recipe is None else recipe)], dtype=float)
+
+    def with_scalers(self, scalers):
+        """Copies of the recipe's ingredient dicts carrying these scalers. Unchanged scalers keep
+        their original value, so a doubled sauce still reads "(2 x sauce)"."""
+        return [
+            {**ing, 'scaler': ing['scaler'] if 'scaler' in ing and ing['scaler'] == scaler else scaler}
+            for ing, scaler in zip(self.recipe, scalers.tolist())
+        ]
+
 
 class NewDishOptimizer:
     def __init__(self, grouped_ingredients, customer_requirements, nutrients, nutrient_constraints,
                  garnish_grams=None, double_sauce=False, veggie_ge_starch=True, 
                  min_meat_per_100_cal=None, max_meal_grams_per_100_cal=None, dish=None,
-                 fixed_protein_grams=None, fixed_starch_grams=None, fixed_veggies_grams=None):
+                 fixed_protein_grams=None, fixed_starch_grams=None, fixed_veggies_grams=None, solver="rules",
+                 initial_scalers=None):
         """ print(f"Initialized Dish Optimizer with {len(grouped_ingredients)} ingredients/n")
         print(f"grouped_ingredients: {grouped_ingredients}\n")
         print(f"Customer Requirements: {customer_requirements}\n")
@@ -47,6 +122,15 @@ class NewDishOptimizer:
         self.fixed_protein_grams = fixed_protein_grams
         self.fixed_starch_grams = fixed_starch_grams
         self.fixed_veggies_grams = fixed_veggies_grams
+        if solver not in SOLVER_MODES:
+            raise ValueError(f"Unknown solver {solver!r}; expected one of {SOLVER_MODES}")
+        self.solver = solver
+        # Warm start: one scaler per dish ingredient to start the search from, e.g. the
+        # client's previous portions of this dish (see PortionHistory)
+        self.initial_scalers = initial_scalers
+        self.warm_started = False
+        # Iterations the last solve() took: rule passes, or QP dual steps + active-set changes
+        self.iterations = None
         # Simplified base weights - only keep essential ones
         # Modified base weights - increased protein priority and fat penalty
         self.nutrient_weights = {
@@ -56,7 +140,13 @@ class NewDishOptimizer:
             'dietaryFiber(g)': 4,
             'fat(g)': 1       # Balanced fat priority
         }
-
+        # Compiled on first use: constraint matches per nutrient and the bound vectors built from them
+        self._per_base_keys = [f'{nutrient}PerBaseGrams' for nutrient in nutrients]
+        self._kcal_col = nutrients.index('kcal') if 'kcal' in nutrients else None
+        self._constraint_matches = {}
+        self._deviation_bounds = None
+        self._ratio_bounds = None
+        self._range_bounds = None
         
     def get_bound_based_ratio(self, nutrient, current_value):
         """
@@ -72,12 +162,7 @@ class NewDishOptimizer:
             return 1.0
 
         # Get constraints
-        normalized_nutrient = self.normalize_nutrient_name(nutrient)
-        constraint = next(
-            (bounds for k, bounds in self.nutrient_constraints.items() 
-            if self.normalize_nutrient_name(k) == normalized_nutrient),
-            None
-        )
+        constraint = self._constraint_for(nutrient)
 
         if not constraint:
             return 1.0
@@ -107,19 +192,107 @@ class NewDishOptimizer:
         else:
             return 1.0
 
-    def _get_diff_ratios(self, current_nutrition):
-        """Calculate basic ratios based on bounds"""
-        ratios = {}
-        for nutrient in self.nutrients:
-            if nutrient in self.customer_requirements:
-                ratios[nutrient] = self.get_bound_based_ratio(nutrient, current_nutrition[nutrient])
-        return ratios
+    def _get_diff_ratios(self, totals):
+        """Bound-based ratio (see get_bound_based_ratio) of every required nutrient in a totals vector"""
+        bounds = self._get_ratio_bounds()
+        values = totals[bounds.cols]
+        above = bounds.active & (values > bounds.upper)
+        below = bounds.active & ~above & (values < bounds.lower)
+        if bounds.zero_bound and ((above & (bounds.upper == 0)) | (below & (bounds.lower == 0))).any():
+            raise ZeroDivisionError("float division by zero")
+        ratios = np.divide(values, bounds.upper, out=np.ones_like(values), where=above)
+        np.divide(values, bounds.lower, out=ratios, where=below)
+        return dict(zip(bounds.names, ratios.tolist()))
 
-    
     def normalize_nutrient_name(self, nutrient):
         """Normalize nutrient names to handle different formats."""
         return nutrient.lower().replace('(g)', '').replace('total', '').replace(' ', '').replace(',', '')
 
+    def _matching_constraints(self, nutrient):
+        """(key, bounds) of every nutrient constraint whose normalized name matches the nutrient's."""
+        matches = self._constraint_matches.get(nutrient)
+        if matches is None:
+            normalized_nutrient = self.normalize_nutrient_name(nutrient)
+            matches = self._constraint_matches[nutrient] = [
+                (k, v) for k, v in self.nutrient_constraints.items()
+                if self.normalize_nutrient_name(k) == normalized_nutrient
+            ]
+        return matches
+
+    def _constraint_for(self, nutrient):
+        """Bounds of the first matching constraint, or None."""
+        matches = self._matching_constraints(nutrient)
+        return matches[0][1] if matches else None
+
+    def _compile_deviation_bounds(self, nutrients, target):
+        """calculate_weighted_deviation's weights and bounds for the nutrients with a positive target."""
+        cols, weights, targets, constrained, lower, upper, lower_missing = [], [], [], [], [], [], []
+        for col, nutrient in enumerate(nutrients):
+            if nutrient not in target or not target[nutrient] > 0:
+                continue
+            constraint = self._constraint_for(nutrient)
+            lb = constraint.get('lb', 1.0) if constraint else 1.0
+            ub = constraint.get('ub', 1.0) if constraint else 1.0
+            cols.append(col)
+            weights.append(self.nutrient_weights.get(nutrient, 1.0))
+            targets.append(target[nutrient])
+            constrained.append(bool(constraint))
+            # A constraint with lb None can't be scored; _deviation raises TypeError as the dict code did
+            lower_missing.append(bool(constraint) and lb is None)
+            lower.append(np.nan if lb is None else lb * target[nutrient])
+            upper.append(float('inf') if ub is None else ub * target[nutrient])
+        lower, upper = np.array(lower, dtype=float), np.array(upper, dtype=float)
+        return SimpleNamespace(
+            cols=np.array(cols, dtype=np.intp), weights=weights, targets=np.array(targets, dtype=float),
+            constrained=np.array(constrained, dtype=bool), unconstrained=~np.array(constrained, dtype=bool),
+            lower=lower, upper=upper, lower_missing=any(lower_missing),
+            zero_bound=bool((lower == 0).any() or (upper == 0).any()),
+        )
+
+    def _get_deviation_bounds(self):
+        if self._deviation_bounds is None:
+            self._deviation_bounds = self._compile_deviation_bounds(self.nutrients, self.customer_requirements)
+        return self._deviation_bounds
+
+    def _get_ratio_bounds(self):
+        """get_bound_based_ratio's bounds for every required nutrient."""
+        if self._ratio_bounds is None:
+            names, cols, active, lower, upper = [], [], [], [], []
+            for col, nutrient in enumerate(self.nutrients):
+                if nutrient not in self.customer_requirements:
+                    continue
+                target = self.customer_requirements.get(nutrient, 0)
+                constraint = self._constraint_for(nutrient) if target > 0 else None
+                names.append(nutrient)
+                cols.append(col)
+                active.append(bool(constraint))
+                ub = constraint.get('ub') if constraint else None
+                lb = constraint.get('lb') if constraint else None
+                upper.append(float('inf') if ub is None else ub * target)
+                lower.append(0.00000000000001 if lb is None else lb * target)
+            lower, upper = np.array(lower, dtype=float), np.array(upper, dtype=float)
+            self._ratio_bounds = SimpleNamespace(
+                names=names, cols=np.array(cols, dtype=np.intp), active=np.array(active, dtype=bool),
+                lower=lower, upper=upper, zero_bound=bool((lower == 0).any() or (upper == 0).any()),
+            )
+        return self._ratio_bounds
+
+    def _get_range_bounds(self):
+        """is_within_nutrition_range's rounded limits, for the nutrients that have any."""
+        if self._range_bounds is None:
+            lower = np.full(len(self.nutrients), -np.inf)
+            upper = np.full(len(self.nutrients), np.inf)
+            for col, nutrient in enumerate(self.nutrients):
+                for constraint_key, bounds in self._matching_constraints(nutrient):
+                    target = self.customer_requirements[nutrient]
+                    if bounds.get('lb'):
+                        lower[col] = max(lower[col], round(bounds['lb'] * target, 1))
+                    if bounds.get('ub'):
+                        upper[col] = min(upper[col], round(bounds['ub'] * target, 1))
+            cols = np.flatnonzero((lower > -np.inf) | (upper < np.inf))
+            self._range_bounds = SimpleNamespace(cols=cols, lower=lower[cols], upper=upper[cols])
+        return self._range_bounds
+
     def _initialize_recipe(self, dish):
         """Initialize recipe with default scalers."""
         if not dish or 'ingredients' not in dish:
@@ -156,157 +329,139 @@ class NewDishOptimizer:
 
     def calculate_total_nutrition(self, recipe):
         """Calculate total nutrition values for the recipe."""
-        totals = {nutrient: 0 for nutrient in self.nutrients}
-        
-        for ingredient in recipe:
-            try:
-                effective_grams = self.get_effective_grams(ingredient)
-                if effective_grams <= 0:
-                    continue
-                    
-                for nutrient in self.nutrients:
-                    nutrient_value = ingredient.get(f'{nutrient}PerBaseGrams', 0)
-                    if nutrient_value is not None:
-                        totals[nutrient] += float(nutrient_value) * ingredient.get('scaler', 1.0)
-                        
-            except (ValueError, TypeError) as e:
-                print(f"Warning: Error processing {ingredient.get('ingredientName', 'unknown')}: {str(e)}")
-                
-        return totals
+        arrays = RecipeArrays(recipe, self._per_base_keys)
+        return self._nutrition_dict(self._nutrition_vector(arrays, arrays.scalers()))
+
+    def _nutrition_vector(self, arrays, scalers):
+        """Nutrient totals (in self.nutrients order) of the recipe at these scalers."""
+        lines = arrays.values * scalers[:, None]
+        # Ingredients scaled to no grams don't count
+        skipped = arrays.base_grams * scalers <= 0
+        if skipped.any():
+            lines[skipped] = 0.0
+        return _running_total(lines)
+
+    def _nutrition_dict(self, totals):
+        return dict(zip(self.nutrients, totals.tolist()))
 
     def calculate_weighted_deviation(self, current, target, recipe=None):
         """Calculate weighted deviation with bound-based comparisons"""
+        nutrients = list(current)
+        if nutrients == self.nutrients and target is self.customer_requirements:
+            bounds = self._get_deviation_bounds()
+        else:
+            bounds = self._compile_deviation_bounds(nutrients, target)
+        scalers = np.array([ing.get('scaler', 1.0) for ing in recipe], dtype=float) if recipe else None
+        return self._deviation(np.array(list(current.values()), dtype=float), scalers, bounds)
+
+    def _deviation(self, totals, scalers=None, bounds=None):
+        """Weighted deviation of a totals vector from the targets, plus the scaler penalty."""
+        bounds = bounds or self._get_deviation_bounds()
+        if bounds.lower_missing:
+            raise TypeError("unsupported operand type(s) for *: 'NoneType' and 'float'")
+        values = totals[bounds.cols]
+        # Over target compares with the upper bound, under target with the lower bound;
+        # nutrients without a constraint compare with the target itself
+        over = values > bounds.targets
+        above = bounds.constrained & over & (values > bounds.upper)
+        below = bounds.constrained & ~over & (values < bounds.lower)
+        if bounds.zero_bound and ((above & (bounds.upper == 0)) | (below & (bounds.lower == 0))).any():
+            raise ZeroDivisionError("float division by zero")
+        relative = np.divide(values - bounds.targets, bounds.targets, out=np.zeros_like(values), where=bounds.unconstrained)
+        np.divide(values - bounds.upper, bounds.upper, out=relative, where=above)
+        np.divide(values - bounds.lower, bounds.lower, out=relative, where=below)
+
+        # Squared with Python's float pow: NumPy's can differ in the last bit
         total_deviation = 0
-        
-        # Calculate nutrition deviation
-        for nutrient, value in current.items():
-            if nutrient in target and target[nutrient] > 0:
-                weight = self.nutrient_weights.get(nutrient, 1.0)
-                
-                # Find matching constraint
-                normalized_nutrient = self.normalize_nutrient_name(nutrient)
-                constraint = next(
-                    (bounds for k, bounds in self.nutrient_constraints.items() 
-                    if self.normalize_nutrient_name(k) == normalized_nutrient),
-                    None
-                )
-                
-                if constraint:
-                    # Get bounds
-                    lower_bound = constraint.get('lb', 1.0) * target[nutrient]
-                    upper_bound = constraint.get('ub', 1.0)
-                    if upper_bound is None:
-                        upper_bound = float('inf')
-                    upper_bound *= target[nutrient]
-                    
-                    # Calculate deviation based on which bound is violated
-                    if value > target[nutrient]:
-                        # If over target, compare with upper bound
-                        relative_dev = (value - upper_bound) / upper_bound if value > upper_bound else 0
-                    else:
-                        # If under target, compare with lower bound
-                        relative_dev = (value - lower_bound) / lower_bound if value < lower_bound else 0
-                else:
-                    # If no constraint, use target directly
-                    relative_dev = (value - target[nutrient]) / target[nutrient]
-                    
-                total_deviation += weight * relative_dev ** 2
+        for weight, relative_dev in zip(bounds.weights, relative.tolist()):
+            total_deviation += weight * relative_dev ** 2
 
         # Add penalty for sum of scalers
-        if recipe:
-            total_scaler = sum(abs(ing.get('scaler', 1.0) - 1.0) for ing in recipe)
-            total_deviation += self.scaler_penalty_weight * total_scaler
+        if scalers is not None and len(scalers):
+            total_deviation += self.scaler_penalty_weight * _ordered_sum(np.abs(scalers - 1.0))
 
         return total_deviation
 
-
     def check_recipe_constraints(self, recipe):
         """
         Check if recipe meets all additional constraints.
         Returns True if all constraints are met, False otherwise.
         """
+        arrays = RecipeArrays(recipe, self._per_base_keys)
+        return self._check_constraints(arrays, arrays.scalers())
+
+    def _check_constraints(self, arrays, scalers, totals=None):
+        """check_recipe_constraints on a scaler vector; `totals` are its nutrient totals if known."""
         try:
-            # Check sauce constraint
-            """ if self.sauce_grams is not None:
-                sauce_total = sum(self.get_effective_grams(i) for i in recipe if i['component'] == 'sauce')
-                if sauce_total != self.sauce_grams:
-                    # print(f"Sauce constraint violation: {sauce_total:.1f}g vs required {self.sauce_grams}g")
-                    return False """
+            grams = arrays.base_grams * scalers
 
             # Check veggie >= starch constraint
             if self.veggie_ge_starch:
-                veggies_total = sum(self.get_effective_grams(i) for i in recipe if i['component'] == 'veggies')
-                starch_total = sum(self.get_effective_grams(i) for i in recipe if i['component'] == 'starch')
+                veggies_total = _ordered_sum(grams[arrays.mask('veggies')])
+                starch_total = _ordered_sum(grams[arrays.mask('starch')])
                 if veggies_total < starch_total or veggies_total > MAX_VEGGIES_GRAM or starch_total > MAX_STARCH_GRAM:
-                    # print(f"Veggie-starch constraint violation: veggies={veggies_total:.1f}g, starch={starch_total:.1f}g")
                     return False
 
             # Check minimum meat per 100 cal constraint
             if self.min_meat_per_100_cal:
-                nutrition = self.calculate_total_nutrition(recipe)
-                total_kcal = nutrition['kcal']
+                if totals is None:
+                    totals = self._nutrition_vector(arrays, scalers)
+                total_kcal = float(totals[self._kcal_col])
                 if total_kcal > 0:
-                    total_meat = sum(self.get_effective_grams(i) for i in recipe if 'protein' in i['component'])
+                    total_meat = _ordered_sum(grams[arrays.meat_mask])
                     meat_per_100_cal = (total_meat / total_kcal) * 100
                     if meat_per_100_cal < self.min_meat_per_100_cal:
-                        # print(f"Meat per 100 cal constraint violation: {meat_per_100_cal:.1f} < {self.min_meat_per_100_cal}")
                         return False
 
             if self.is_special_yogurt_protein:
-                total_grams = sum(self.get_effective_grams(i) for i in recipe)
+                total_grams = _ordered_sum(grams)
+                # total_kcal is only set when min_meat_per_100_cal is; otherwise the NameError
+                # is caught below and the recipe rejected, as it always has been
                 if total_kcal > 0:
                     if total_grams > MAX_SPECIAL_YOGURT_PROTEIN_ITEM_TOTAL_MEAL:
                         return False
             # Check maximum meal grams per 100 cal constraint
             elif self.max_meal_grams_per_100_cal:
-                total_grams = sum(self.get_effective_grams(i) for i in recipe)
-                nutrition = self.calculate_total_nutrition(recipe)
-                total_kcal = nutrition['kcal']
+                total_grams = _ordered_sum(grams)
+                if totals is None:
+                    totals = self._nutrition_vector(arrays, scalers)
+                total_kcal = float(totals[self._kcal_col])
                 if total_kcal > 0:
                     grams_per_100_cal = (total_grams / total_kcal) * 100
                     if grams_per_100_cal > self.max_meal_grams_per_100_cal:
-                        # print(f"Grams per 100 cal constraint violation: {grams_per_100_cal:.1f} > {self.max_meal_grams_per_100_cal}")
                         return False
-            
+
             return True  # All constraints met
-            
+
         except Exception as e:
             print(f"Error in checking constraints: {str(e)}")
-            return False 
+            return False
 
     def is_within_nutrition_range(self, recipe, nutrition_totals):
         """Check if recipe meets all nutritional constraints."""
-        for nutrient, value in nutrition_totals.items():
-            value = round(value, 1)
-            normalized_nutrient = self.normalize_nutrient_name(nutrient)
-            
-            matching_constraints = [
-                (k, v) for k, v in self.nutrient_constraints.items() 
-                if self.normalize_nutrient_name(k) == normalized_nutrient
-            ]
-            
-            for constraint_key, bounds in matching_constraints:
-                target = self.customer_requirements[nutrient]
-                
-                if bounds.get('lb') and value < round(bounds['lb'] * target, 1):
-                    # print(f"Constraint violation - {nutrient} too low: {value:.1f} < {bounds['lb'] * target:.1f}")
-                    return False
-                    
-                if bounds.get('ub') and value > round(bounds['ub'] * target, 1):
-                    # print(f"Constraint violation - {nutrient} too high: {value:.1f} > {bounds['ub'] * target:.1f}")
-                    return False
-        
-        if self.max_meal_grams_per_100_cal and nutrition_totals['kcal'] > 0:
-            total_grams = sum(self.get_effective_grams(i) for i in recipe)
-            grams_per_100_cal = (total_grams / nutrition_totals['kcal']) * 100
+        arrays = RecipeArrays(recipe)
+        totals = np.array([nutrition_totals[nutrient] for nutrient in self.nutrients], dtype=float)
+        return self._within_range(arrays, arrays.scalers(), totals)
+
+    def _within_range(self, arrays, scalers, totals):
+        """is_within_nutrition_range on a scaler vector and its nutrient totals."""
+        bounds = self._get_range_bounds()
+        # Rounded with Python's round(), which rounds exact halves differently from np.round
+        rounded = np.array([round(value, 1) for value in totals[bounds.cols].tolist()], dtype=float)
+        if (rounded < bounds.lower).any() or (rounded > bounds.upper).any():
+            return False
+
+        grams = arrays.base_grams * scalers
+        total_kcal = float(totals[self._kcal_col])
+        if self.max_meal_grams_per_100_cal and total_kcal > 0:
+            grams_per_100_cal = (_ordered_sum(grams) / total_kcal) * 100
             if grams_per_100_cal > self.max_meal_grams_per_100_cal:
-                # print(f"Constraint violation - grams per 100 cal too high: {grams_per_100_cal:.1f} > {self.max_meal_grams_per_100_cal}")
                 return False
-        
+
         # check total grams of starch
-        if sum(self.get_effective_grams(i) for i in recipe if i['component'] == 'starch') < MAX_STARCH_GRAM:
+        if _ordered_sum(grams[arrays.mask('starch')]) < MAX_STARCH_GRAM:
             return False
-        
+
         return True
 
     def _calculate_ingredient_contributions(self, recipe):
@@ -385,12 +540,10 @@ class NewDishOptimizer:
         # Check each nutrient constraint
         for nutrient, value in nutrition_totals.items():
             value = round(value, 1)
-            normalized_nutrient = self.normalize_nutrient_name(nutrient)
-            constraint_key = next((k for k in self.nutrient_constraints.keys() 
-                                if self.normalize_nutrient_name(k) == normalized_nutrient), None)
+            matches = self._matching_constraints(nutrient)
             
-            if constraint_key:
-                bounds = self.nutrient_constraints[constraint_key]
+            if matches:
+                constraint_key, bounds = matches[0]
                 target = self.customer_requirements[nutrient]
                 # print(f"Checking {nutrient} with value {value} and target {target} and bounds {bounds}")
 
@@ -446,9 +599,25 @@ class NewDishOptimizer:
                     recipe[idx]['scaler'] *= increase_factor
         return recipe
     
-    def _is_valid_adjustment(self, recipe, idx, new_scaler):
+    def _limit_component(self, arrays, scalers, component, max_grams):
+        """adjust_component_within_limit on a scaler vector (in place)."""
+        mask = arrays.mask(component)
+        total_grams = _ordered_sum(arrays.base_grams[mask] * scalers[mask])
+        if total_grams > max_grams:
+            scalers[mask] *= max_grams / total_grams
+        return scalers
+
+    def _raise_component(self, arrays, scalers, component, min_grams):
+        """adjust_component_above_minimum on a scaler vector (in place)."""
+        mask = arrays.mask(component)
+        total_grams = _ordered_sum(arrays.base_grams[mask] * scalers[mask])
+        if total_grams < min_grams:
+            scalers[mask] *= min_grams / total_grams
+        return scalers
+
+    def _is_valid_adjustment(self, arrays, scalers, idx, new_scaler):
         """New helper function to check if adjustment maintains constraints"""
-        component = recipe[idx]['component']
+        component = arrays.components[idx]
 
         # If this component has fixed grams, don't allow any adjustment
         if component == 'veggies' and self.fixed_veggies_grams is not None:
@@ -458,11 +627,12 @@ class NewDishOptimizer:
         if component == 'protein' and self.fixed_protein_grams is not None:
             return True
 
+        if component in ('veggies', 'starch'):
+            grams = arrays.base_grams * scalers
+            grams[idx] = arrays.base_grams[idx] * new_scaler
+            potential_grams = _ordered_sum(grams[arrays.mask(component)])
+
         if component == 'veggies':
-            potential_grams = sum(
-                self.get_effective_grams(x) if i != idx else x['baseGrams'] * new_scaler
-                for i, x in enumerate(recipe) if x['component'] == 'veggies'
-            )
             if self.is_special_yogurt_protein:
                 if potential_grams > MAX_SPECIAL_YOGURT_VEGGIES_GRAM:
                     return False
@@ -473,15 +643,11 @@ class NewDishOptimizer:
                 return False
 
         elif component == 'starch':
-            potential_grams = sum(
-                self.get_effective_grams(x) if i != idx else x['baseGrams'] * new_scaler
-                for i, x in enumerate(recipe) if x['component'] == 'starch'
-            )
             if potential_grams > MAX_STARCH_GRAM:
                 return False
 
         elif component == 'protein' and self.is_special_yogurt_protein:
-            potential_grams = recipe[idx]['baseGrams'] * new_scaler
+            potential_grams = float(arrays.base_grams[idx]) * new_scaler
             if potential_grams > MAX_SPECIAL_YOGURT_PROTEIN_GRAM:
                 return False
 
@@ -588,84 +754,72 @@ class NewDishOptimizer:
         # Add small randomization to prevent getting stuck in local optima
         return adj
     
-    def _adjust_ingredients_sequentially(self, recipe, initial_nutrition,fixed_protein_grams = None,fixed_starch_grams = None,fixed_veggies_grams = None):
-        """Adjust ingredients one at a time following manual optimization steps"""
-        adjusted_recipe = [{**ing} for ing in recipe]
-        current_nutrition = initial_nutrition.copy()
-        
-        # Define adjustment sequence based on manual steps
-        component_sequence = [
-            # Step 1: Protein first
-            [(i, ing) for i, ing in enumerate(recipe) if ing['component'] == 'protein'],
-            # Step 2: Veggies for fiber
-            [(i, ing) for i, ing in enumerate(recipe) if ing['component'] == 'veggies'],
-            # Step 3-6: Starch for calorie management
-            [(i, ing) for i, ing in enumerate(recipe) if ing['component'] == 'starch']
-        ]
-        
-        # Process each component group in sequence
-        for component_group in component_sequence:
-            # Skip empty component groups (e.g., no starch in parfait)
-            if not component_group:
-                continue
-            if fixed_protein_grams and component_group[0][1]['component'] == 'protein':
-                continue
-            if fixed_starch_grams and component_group[0][1]['component'] == 'starch':
+    def _adjust_ingredients_sequentially(self, arrays, scalers, initial_totals, contributions):
+        """Adjust ingredients one at a time following manual optimization steps.
+        Returns the adjusted scaler vector; `scalers` is left as it was."""
+        adjusted_scalers = scalers.copy()
+        current_totals = initial_totals
+        ratios = None
+
+        # Protein first, then veggies for fiber, then starch for calorie management
+        for component, fixed_grams in (('protein', self.fixed_protein_grams),
+                                       ('veggies', self.fixed_veggies_grams),
+                                       ('starch', self.fixed_starch_grams)):
+            if fixed_grams:
                 continue
-            if fixed_veggies_grams and component_group[0][1]['component'] == 'veggies':
-                continue
-            for idx, ingredient in component_group:
-                # Calculate current nutrient gaps
-                nutrient_gaps = {
-                    nutrient: (self.customer_requirements[nutrient] - current_nutrition[nutrient]) / self.customer_requirements[nutrient] if self.customer_requirements[nutrient] != 0 else 0
-                    for nutrient in self.nutrients if nutrient in self.customer_requirements
-                }
-                
+            # Empty for a component the dish doesn't have (e.g. no starch in parfait)
+            for idx in arrays.indices(component):
                 # Calculate adjustment for single ingredient
-                adjustment = self._calculate_single_adjustment(adjusted_recipe[idx], nutrient_gaps, current_nutrition)
-                
+                if arrays.base_grams[idx] <= 0 or not contributions[idx]:
+                    continue
+                if ratios is None:
+                    ratios = self._get_diff_ratios(current_totals)
+                adjustment = self._get_ingredient_adjustment(component, ratios, contributions[idx])
+
                 if adjustment != 0:
                     # Apply adjustment
-                    current_scaler = adjusted_recipe[idx].get('scaler', 1.0)
+                    current_scaler = float(adjusted_scalers[idx])
                     new_scaler = max(0.1, current_scaler * (1.0 + adjustment))
-                    
-                    if self._is_valid_adjustment(adjusted_recipe, idx, new_scaler):
+
+                    if self._is_valid_adjustment(arrays, adjusted_scalers, idx, new_scaler):
                         # Update scaler and recalculate nutrition
-                        adjusted_recipe[idx]['scaler'] = math.ceil(new_scaler * 100)/100
-                        current_nutrition = self.calculate_total_nutrition(adjusted_recipe)
-        
-        return adjusted_recipe
+                        adjusted_scalers[idx] = math.ceil(new_scaler * 100)/100
+                        current_totals = self._nutrition_vector(arrays, adjusted_scalers)
+                        ratios = None
 
-    def _calculate_single_adjustment(self, ingredient, nutrient_gaps, current_nutrition):
-        """Calculate adjustment for a single ingredient based on current nutritional state"""
-        component = ingredient['component']
-        
-        if component in ['sauce', 'garnish'] or ingredient['baseGrams'] <= 0:
-            return 0
-            
-        # Calculate nutrient contributions
-        contributions = {
-            nutrient: ingredient.get(f'{nutrient}PerBaseGrams', 0) / ingredient['baseGrams']
-            for nutrient in nutrient_gaps.keys()
-            if ingredient.get(f'{nutrient}PerBaseGrams', 0) > 0
-        }
-        
-        if not contributions:
-            return 0
-            
-        nutrient_ratios = self._get_diff_ratios(current_nutrition)
-        
-        # Use existing adjustment logic but for single ingredient
-        base_adjustment = self._get_ingredient_adjustment(component, nutrient_ratios, contributions)
-        return base_adjustment
-
-    def _recipes_are_similar(self, recipe1, recipe2, threshold=0.01):
-        """Check if two recipes are similar enough to consider converged"""
-        for ing1, ing2 in zip(recipe1, recipe2):
-            if abs(ing1.get('scaler', 1.0) - ing2.get('scaler', 1.0)) > threshold:
-                return False
-        return True
+        return adjusted_scalers
+
+    def _ingredient_contributions(self, arrays):
+        """Per ingredient, {nutrient: amount per gram} of the required nutrients it contains."""
+        cols = [col for col, nutrient in enumerate(self.nutrients) if nutrient in self.customer_requirements]
+        contributions = []
+        for values, base_grams in zip(arrays.values.tolist(), arrays.base_grams.tolist()):
+            contributions.append({
+                self.nutrients[col]: values[col] / base_grams
+                for col in cols
+                if values[col] > 0
+            } if base_grams > 0 else {})
+        return contributions
+
+    def _recipes_are_similar(self, scalers1, scalers2, threshold=0.01):
+        """Check if two scaler vectors are similar enough to consider converged"""
+        return not (np.abs(scalers1 - scalers2) > threshold).any()
     
+    def _warm_scalers(self, arrays, scalers):
+        """`scalers` with the free components (not sauce, garnish or fixed grams) taken from
+        initial_scalers, when those fit the dish."""
+        if self.initial_scalers is None or len(self.initial_scalers) != len(scalers):
+            return scalers
+        fixed = {'sauce', 'garnish'}
+        fixed.update(component for component, grams in (('protein', self.fixed_protein_grams), ('starch', self.fixed_starch_grams),
+                                                        ('veggies', self.fixed_veggies_grams)) if grams is not None)
+        free = np.array([component not in fixed for component in arrays.components], dtype=bool)
+        initial = np.asarray(self.initial_scalers, dtype=float)
+        if not free.any() or not np.isfinite(initial[free]).all() or (initial[free] <= 0).any():
+            return scalers
+        self.warm_started = True
+        return np.where(free, initial, scalers)
+
     def _final_adjustment(self, formatted_result, final_recipe, final_nutrition):
         notes = formatted_result['results']['notes']
         
@@ -1023,16 +1177,25 @@ class NewDishOptimizer:
    
    
    
-    def solve(self, max_iterations=1000):
-        """Modified solver with sequential ingredient adjustment strategy"""
+    def solve(self, max_iterations=1000, initial_scalers=None):
+        """Portion the dish with the selected solver (see SOLVER_MODES). initial_scalers
+        (one per dish ingredient) overrides the ones the optimizer was built with."""
+        if initial_scalers is not None:
+            self.initial_scalers = initial_scalers
+        self.warm_started = False
+        self.iterations = 0
         if not self.dish:
             return None, None
+        if self.solver == "qp":
+            return self._solve_qp(max_iterations)
+        return self._solve_rules(max_iterations)
+
+    def _solve_rules(self, max_iterations=1000):
+        """Modified solver with sequential ingredient adjustment strategy"""
 
         recipe = self.dish['ingredients']
         dish_name = self.dish['dishName']
-        best_recipe = None
         best_deviation = float('inf')
-        best_nutrition = None
         
         # Check if any protein items are special protein items
         self.is_special_yogurt_protein = any(
@@ -1126,54 +1289,260 @@ class NewDishOptimizer:
                 recipe = self.adjust_component_within_limit(recipe, 'veggies', MAX_SPECIAL_FRUIT_SNACK_DISH_VEGGIES_GRAM)
         
 
+        # The loop works on a scaler vector over the recipe's nutrient matrix
+        arrays = RecipeArrays(recipe, self._per_base_keys)
+        contributions = self._ingredient_contributions(arrays)
+        scalers = self._warm_scalers(arrays, arrays.scalers())
+        best_scalers = None
+
         for iteration in range(max_iterations):
+            self.iterations = iteration + 1
             if self.is_special_yogurt_protein:
                 if self.fixed_protein_grams is None:
-                    recipe = self.adjust_component_within_limit(recipe, 'protein', MAX_SPECIAL_YOGURT_PROTEIN_GRAM)
+                    self._limit_component(arrays, scalers, 'protein', MAX_SPECIAL_YOGURT_PROTEIN_GRAM)
                 if self.fixed_veggies_grams is None:
-                    recipe = self.adjust_component_within_limit(recipe, 'veggies', MAX_SPECIAL_YOGURT_VEGGIES_GRAM)
+                    self._limit_component(arrays, scalers, 'veggies', MAX_SPECIAL_YOGURT_VEGGIES_GRAM)
             elif not self.is_special_fruit_snack:
                 # Only apply limits to components that don't have fixed grams
                 if self.fixed_starch_grams is None:
-                    recipe = self.adjust_component_within_limit(recipe, 'starch', MAX_STARCH_GRAM)
-                    recipe = self.adjust_component_above_minimum(recipe, 'starch', MIN_STARCH_GRAM)
+                    self._limit_component(arrays, scalers, 'starch', MAX_STARCH_GRAM)
+                    self._raise_component(arrays, scalers, 'starch', MIN_STARCH_GRAM)
                 if self.fixed_protein_grams is None:
-                    recipe = self.adjust_component_within_limit(recipe, 'protein', self.protein_max)
+                    self._limit_component(arrays, scalers, 'protein', self.protein_max)
                 if self.fixed_veggies_grams is None:
-                    recipe = self.adjust_component_within_limit(recipe, 'veggies', veggies_limit)
+                    self._limit_component(arrays, scalers, 'veggies', veggies_limit)
             else:
                 if self.fixed_starch_grams is None:
-                    recipe = self.adjust_component_within_limit(recipe, 'starch', MAX_STARCH_GRAM)
-                    recipe = self.adjust_component_above_minimum(recipe, 'starch', MIN_STARCH_GRAM)
+                    self._limit_component(arrays, scalers, 'starch', MAX_STARCH_GRAM)
+                    self._raise_component(arrays, scalers, 'starch', MIN_STARCH_GRAM)
                 if self.fixed_protein_grams is None:
-                    recipe = self.adjust_component_within_limit(recipe, 'protein', self.protein_max)
+                    self._limit_component(arrays, scalers, 'protein', self.protein_max)
                 if self.fixed_veggies_grams is None:
-                    recipe = self.adjust_component_within_limit(recipe, 'veggies', veggies_limit)
+                    self._limit_component(arrays, scalers, 'veggies', veggies_limit)
             # Get current state
-            current_nutrition = self.calculate_total_nutrition(recipe)
-            current_deviation = self.calculate_weighted_deviation(current_nutrition, self.customer_requirements, recipe)
+            current_totals = self._nutrition_vector(arrays, scalers)
+            current_deviation = self._deviation(current_totals, scalers)
 
             # Update best solution if current is better
-            if current_deviation < best_deviation and self.check_recipe_constraints(recipe):
+            if current_deviation < best_deviation and self._check_constraints(arrays, scalers, current_totals):
                 best_deviation = current_deviation
-                best_recipe = [{**ing} for ing in recipe]
-                best_nutrition = current_nutrition.copy()
+                best_scalers = scalers.copy()
+                best_totals = current_totals
 
             # Check if solution meets requirements
-            if self.is_within_nutrition_range(recipe, current_nutrition) and self.check_recipe_constraints(recipe):
-                return self.format_result(recipe, current_nutrition)
+            if self._within_range(arrays, scalers, current_totals) and self._check_constraints(arrays, scalers, current_totals):
+                return self.format_result(arrays.with_scalers(scalers), self._nutrition_dict(current_totals))
 
             # Sequential ingredient adjustment
-            adjusted_recipe = self._adjust_ingredients_sequentially(recipe, current_nutrition,self.fixed_protein_grams,self.fixed_starch_grams,self.fixed_veggies_grams)
+            adjusted_scalers = self._adjust_ingredients_sequentially(arrays, scalers, current_totals, contributions)
             
             # If no meaningful changes were made, break
-            if self._recipes_are_similar(recipe, adjusted_recipe):
+            if self._recipes_are_similar(scalers, adjusted_scalers):
                 break
             
-            recipe = adjusted_recipe
-        tmp_result = self.format_result(best_recipe or recipe, best_nutrition or current_nutrition)
+            scalers = adjusted_scalers
+
+        if best_scalers is not None:
+            best_recipe, best_nutrition = arrays.with_scalers(best_scalers), self._nutrition_dict(best_totals)
+        else:
+            best_recipe, best_nutrition = arrays.with_scalers(scalers), self._nutrition_dict(current_totals)
+        tmp_result = self.format_result(best_recipe, best_nutrition)
         if tmp_result['results']['review_needed']:
-            final_recipe, final_nutrition = self._final_adjustment(tmp_result, best_recipe or recipe, best_nutrition or current_nutrition)
+            final_recipe, final_nutrition = self._final_adjustment(tmp_result, best_recipe, best_nutrition)
             return self.format_result(final_recipe, final_nutrition)
         else:
-            return self.format_result(best_recipe or recipe, best_nutrition or current_nutrition)
+            return self.format_result(best_recipe, best_nutrition)
+
+    def _solve_qp(self, max_iterations=1000):
+        """Portion the dish as one convex QP over component scalers.
+
+        Every component other than sauce and garnish gets one scaler (its ingredients scale
+        together), unless its grams are fixed. The objective is the nutrient_weights-weighted
+        squared relative deviation of the macros from their targets; the portioning rules
+        (component gram limits, veggie >= starch, meat per 100 kcal, meal grams per 100 kcal)
+        are linear in the scalers and become the constraints. Dishes whose rules can't all
+        be met fall back to the rule-based solver.
+        """
+        problem = self._qp_problem()
+        if problem.H is None:
+            return self._qp_result(problem.recipe, problem.arrays, problem.base_scalers)
+        return self._finish_qp(problem, solve_qp(problem.H, problem.f, problem.C, problem.d, x0=self._warm_x(problem)), max_iterations)
+
+    def _warm_x(self, problem):
+        # initial_scalers as QP variables: the mean scaler of each free component
+        if self.initial_scalers is None or len(self.initial_scalers) != len(problem.recipe):
+            return None
+        initial = np.asarray(self.initial_scalers, dtype=float)
+        if not np.isfinite(initial).all():
+            return None
+        self.warm_started = True
+        return (problem.E.T @ initial) / problem.E.sum(axis=0)
+
+    def _qp_problem(self, arrays=None):
+        """The dish's QP as a namespace: H, f, C, d, and the scalers as base_scalers + E @ x.
+        H is None when no component is free to scale. `arrays` may be shared between
+        optimizers portioning the same dish (see solve_batch)."""
+        recipe = self.dish['ingredients']
+        dish_name = self.dish['dishName']
+        if arrays is None:
+            arrays = RecipeArrays(recipe, self._per_base_keys)
+        # Dish type, as _solve_rules detects it
+        is_special_yogurt_protein = any(
+            any(item.lower() in ing['ingredientName'].lower() for item in SPECIAL_YOGURT_PROTEIN_ITEM_KEYWORDS)
+            for ing in recipe if ing['component'] == 'protein'
+        )
+        is_special_fruit_snack = any(keyword in dish_name.lower() for keyword in SPECIAL_FRUIT_SNACK_DISH_KEYWORDS)
+        protein_max = next((MAX_PROTEIN_PER_TYPE.get(i.get('protein_type', '').lower(), 500) for i in recipe if i.get('component') == 'protein' and i.get('protein_type', '').lower() != 'ignore'), 500)
+
+        # Scalers are s0 + E @ x: sauce, garnish and fixed-gram components are constant in s0,
+        # component v of x scales the ingredients in column v of E
+        fixed_grams = {'protein': self.fixed_protein_grams, 'starch': self.fixed_starch_grams, 'veggies': self.fixed_veggies_grams}
+        base_scalers = np.zeros(len(recipe))
+        components = []
+        for component in dict.fromkeys(arrays.components):
+            mask = arrays.mask(component)
+            component_grams = _ordered_sum(arrays.base_grams[mask])
+            if component == 'sauce':
+                base_scalers[mask] = 2 if self.double_sauce else 1.0
+            elif component == 'garnish':
+                base_scalers[mask] = 1.0
+            elif fixed_grams.get(component) is not None and component_grams > 0:
+                base_scalers[mask] = fixed_grams[component] / component_grams
+            else:
+                components.append(component)
+        problem = SimpleNamespace(recipe=recipe, dish_name=dish_name, arrays=arrays, base_scalers=base_scalers,
+                                  components=components, E=None, H=None, f=None, C=None, d=None)
+        if not components:
+            return problem
+        E = np.stack([arrays.mask(component) for component in components], axis=1).astype(float)
+
+        def affine(weights):
+            # weights . scalers as (coefficients over x, constant)
+            return weights @ E, float(weights @ base_scalers)
+
+        # Objective: sum_j w_j ((a_j.x + c_j - t_j) / t_j)^2 + ridge * |x - 1|^2
+        H = 2 * QP_SCALER_RIDGE * np.eye(len(components))
+        f = -2 * QP_SCALER_RIDGE * np.ones(len(components))
+        for col, nutrient in enumerate(self.nutrients):
+            target = self.customer_requirements.get(nutrient, 0)
+            if nutrient not in self.nutrient_weights or target <= 0:
+                continue
+            coefficients, constant = affine(arrays.values[:, col])
+            weight = self.nutrient_weights[nutrient] / target ** 2
+            H += 2 * weight * np.outer(coefficients, coefficients)
+            f += 2 * weight * coefficients * (constant - target)
+
+        rows, limits = [], []
+
+        def at_most(expression, limit):
+            coefficients, constant = expression
+            if np.any(np.abs(coefficients) > 1e-12):
+                rows.append(coefficients)
+                limits.append(limit - constant)
+
+        def grams(*component_names):
+            return affine(arrays.base_grams * np.any([arrays.mask(c) for c in component_names], axis=0))
+
+        for v in range(len(components)):
+            at_most((-np.eye(len(components))[v], 0.0), -MIN_SCALER)
+        has = set(arrays.components)
+        if is_special_yogurt_protein:
+            at_most(grams('protein'), MAX_SPECIAL_YOGURT_PROTEIN_GRAM)
+            at_most(grams('veggies'), MAX_SPECIAL_YOGURT_VEGGIES_GRAM)
+            at_most(affine(arrays.base_grams), MAX_SPECIAL_YOGURT_PROTEIN_ITEM_TOTAL_MEAL)
+        else:
+            at_most(grams('protein'), protein_max)
+            at_most(grams('veggies'), MAX_SPECIAL_FRUIT_SNACK_DISH_VEGGIES_GRAM if is_special_fruit_snack else MAX_VEGGIES_GRAM)
+            if 'starch' in has:
+                starch_coefficients, starch_constant = grams('starch')
+                at_most((-starch_coefficients, -starch_constant), -MIN_STARCH_GRAM)
+        at_most(grams('starch'), MAX_STARCH_GRAM)
+        if self.veggie_ge_starch and {'veggies', 'starch'} <= has:
+            at_most(affine(arrays.base_grams * (arrays.mask('starch').astype(float) - arrays.mask('veggies'))), 0.0)
+        kcal_weights = arrays.values[:, self._kcal_col]
+        if self.min_meat_per_100_cal and arrays.meat_mask.any():
+            # meat / kcal * 100 >= m  <=>  m * kcal - 100 * meat <= 0
+            at_most(affine(self.min_meat_per_100_cal * kcal_weights - 100 * arrays.base_grams * arrays.meat_mask), 0.0)
+        if not is_special_yogurt_protein and self.max_meal_grams_per_100_cal:
+            at_most(affine(100 * arrays.base_grams - self.max_meal_grams_per_100_cal * kcal_weights), 0.0)
+
+        problem.E, problem.H, problem.f = E, H, f
+        problem.C, problem.d = np.array(rows).reshape(-1, len(components)), np.array(limits, dtype=float)
+        return problem
+
+    def _finish_qp(self, problem, result, max_iterations=1000):
+        self.iterations = result.iterations
+        if not result.feasible:
+            print(f"QP portioning infeasible for {problem.dish_name}; using the rule-based solver")
+            return self._solve_rules(max_iterations)
+        return self._qp_result(problem.recipe, problem.arrays, problem.base_scalers + problem.E @ result.x)
+
+    def _qp_result(self, recipe, arrays, scalers):
+        portioned = []
+        for ing, scaler in zip(recipe, scalers.tolist()):
+            if ing['component'] == 'sauce':
+                # Same scaler values as the rule-based solver, so the name reads "(2 x sauce)"
+                scaler = 2 if self.double_sauce else 1.0
+            portioned.append({**ing, 'scaler': scaler})
+        return self.format_result(portioned, self._nutrition_dict(self._nutrition_vector(arrays, arrays.scalers(portioned))))
+
+
+def _line_signature(recipe, per_base_keys):
+    # Everything RecipeArrays reads from the lines, in order
+    return tuple(
+        (ing.get('ingredientId'), ing['component'], ing['baseGrams'], tuple(repr(ing.get(key, 0)) for key in per_base_keys))
+        for ing in recipe
+    )
+
+
+def solve_batch(optimizers, max_iterations=1000):
+    """Solve many optimizers built for the same dish (same ingredient lines), one per client.
+
+    In "qp" mode the dish's nutrient matrix is built once per line order, and the clients whose portion
+    limits give the same constraints are solved as one stacked QP (their targets differ
+    only in H and f). Clients the stack finds infeasible fall back to the rule-based
+    solver one by one, as solve() does. "rules" optimizers are iterative and solve one
+    by one, and so do warm-started ones, which converge in a few steps on their own. Returns the results in order; an optimizer that raises has its exception in
+    its place instead of a result.
+    """
+    results = [None] * len(optimizers)
+    stacks = {}
+    # Nutrient matrices by exact line sequence: callers may pass the same lines in another order
+    arrays_by_lines = {}
+    for position, optimizer in enumerate(optimizers):
+        try:
+            if optimizer.solver != "qp" or not optimizer.dish or optimizer.initial_scalers is not None:
+                results[position] = optimizer.solve(max_iterations)
+                continue
+            lines = _line_signature(optimizer.dish['ingredients'], optimizer._per_base_keys)
+            if lines not in arrays_by_lines:
+                arrays_by_lines[lines] = RecipeArrays(optimizer.dish['ingredients'], optimizer._per_base_keys)
+            problem = optimizer._qp_problem(arrays_by_lines[lines])
+            if problem.H is None:
+                results[position] = optimizer._qp_result(problem.recipe, problem.arrays, problem.base_scalers)
+                continue
+            key = (lines, tuple(problem.components), problem.base_scalers.tobytes(), problem.C.tobytes(), problem.d.tobytes())
+            stacks.setdefault(key, []).append((position, optimizer, problem))
+        except Exception as e:
+            results[position] = e
+
+    for stack in stacks.values():
+        first = stack[0][2]
+        qp_results = solve_qp_batch(
+            np.stack([problem.H for _, _, problem in stack]),
+            np.stack([problem.f for _, _, problem in stack]),
+            first.C, first.d,
+        )
+        for (position, optimizer, problem), result in zip(stack, qp_results):
+            try:
+                results[position] = optimizer._finish_qp(problem, result, max_iterations)
+            except Exception as e:
+                results[position] = e
+    return results
+
+
+def solve_counted(optimizer, max_iterations=1000):
+    """(optimizer.solve(), iterations it took, whether it was warm-started). For process
+    pools, where the optimizer's own attributes don't come back to the caller."""
+    result = optimizer.solve(max_iterations)
+    return result, optimizer.iterations, optimizer.warm_started
@@ -1,4 +1,3 @@
-from openai import OpenAI
 import os
 from dotenv import load_dotenv
 import streamlit as st
@@ -142,6 +141,8 @@ class LLMDishOptimizer:
         
         # Get API key from Streamlit secrets
         api_key = st.secrets["OPENAI_API_KEY"]
+        # Imported here so importing the portioning package doesn't pay for openai
+        from openai import OpenAI
         client = OpenAI(api_key=api_key)
         
         # Define the OpenAI API call with the generated prompt
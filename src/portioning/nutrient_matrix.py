@@ -0,0 +1,107 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Nutrient keys of a dish line, in matrix column order
+NUTRIENT_FIELDS = [
+    'Kcal',
+    'Protein (g)',
+    'Fat, Total (g)',
+    'Dietary Fiber (g)',
+    'Carbohydrate, total (g)',
+    'Sodium (mg)',
+    'Calcium (mg)',
+    'Phosphorus, P (mg)',
+    'Fatty acids, total saturated (g)',
+]
+# Ingredient fields; nutrient values are given for BASE_GRAMS_FIELD grams of the ingredient
+BASE_GRAMS_FIELD = 'Grams'
+ENERGY_FIELD = 'Energy (kcal)'
+ATWATER_ENERGY_FIELD = 'Energy (Atwater General Factors) (kcal)'
+
+
+def nutrient_vector(fields):
+    """Nutrient values of one ingredient record's fields, in NUTRIENT_FIELDS order.
+
+    Kcal is the measured energy, or the Atwater energy when that is missing or zero.
+    """
+    energy = fields.get(ENERGY_FIELD) or 0
+    atwater = fields.get(ATWATER_ENERGY_FIELD) or 0
+    kcal = energy if energy > 0 else atwater if atwater > 0 else 0
+    return [float(kcal)] + [float(fields.get(field) or 0) for field in NUTRIENT_FIELDS[1:]]
+
+
+class NutrientMatrix:
+    """Ingredient x nutrient matrix for scaling dish lines by grams.
+
+    Row i holds the nutrient values of ingredient i for its base grams. A line of g grams
+    scales its row by g / base grams; a batch of lines is one row gather and one
+    broadcast multiply, and their totals one vector-matrix product. Built once from the
+    ingredient snapshot (see ReferenceSnapshot) or, without one, from the ingredients at hand.
+    """
+
+    def __init__(self, ingredient_ids, values, base_grams):
+        self.index = {ingredient_id: row for row, ingredient_id in enumerate(ingredient_ids)}
+        self.values = np.asarray(values, dtype=float).reshape(len(self.index), len(NUTRIENT_FIELDS))
+        self.base_grams = np.asarray(base_grams, dtype=float)
+
+    @classmethod
+    def from_fields(cls, fields_by_id, skip_invalid=False):
+        """Build from {ingredient record id: fields}. With skip_invalid, ingredients whose
+        values aren't numbers are left out (and looked up elsewhere) instead of raising."""
+        ingredient_ids, values, base_grams = [], [], []
+        for ingredient_id, fields in fields_by_id.items():
+            try:
+                row = nutrient_vector(fields)
+                grams = float(fields.get(BASE_GRAMS_FIELD) or 0)
+            except (TypeError, ValueError):
+                if not skip_invalid:
+                    raise
+                logger.debug(f"Ingredient {ingredient_id} left out of the nutrient matrix: non-numeric values")
+                continue
+            ingredient_ids.append(ingredient_id)
+            values.append(row)
+            base_grams.append(grams)
+        return cls(ingredient_ids, values, base_grams)
+
+    @classmethod
+    def from_records(cls, records, skip_invalid=True):
+        return cls.from_fields({record['id']: record.get('fields', {}) for record in records}, skip_invalid)
+
+    def __len__(self):
+        return len(self.index)
+
+    def covers(self, ingredient_ids):
+        return all(ingredient_id in self.index for ingredient_id in ingredient_ids)
+
+    def rows(self, ingredient_ids):
+        return np.fromiter((self.index[ingredient_id] for ingredient_id in ingredient_ids), dtype=np.intp)
+
+    def rates(self, ingredient_ids, grams):
+        """grams / base grams per line; inf or nan where an ingredient's base grams is zero."""
+        grams = np.array([float(g) for g in grams], dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return grams / self.base_grams[self.rows(ingredient_ids)]
+
+    def scale(self, ingredient_ids, rates):
+        """(lines x nutrients) values of these ingredients scaled by their line rates."""
+        return self.values[self.rows(ingredient_ids)] * np.asarray(rates, dtype=float)[:, None]
+
+    def totals(self, ingredient_ids, grams):
+        """Nutrient totals of a set of lines, for a what-if recompute of a portion."""
+        return dict(zip(NUTRIENT_FIELDS, (self.rates(ingredient_ids, grams) @ self.values[self.rows(ingredient_ids)]).tolist()))
+
+
+def line_nutrients(row):
+    """{nutrient field: value} for one row of NutrientMatrix.scale()."""
+    return dict(zip(NUTRIENT_FIELDS, row.tolist()))
+
+
+def line_totals(lines):
+    """Summed nutrients of dish lines already scaled to their grams (missing keys count as 0)."""
+    if not lines:
+        return dict.fromkeys(NUTRIENT_FIELDS, 0.0)
+    values = np.array([[line.get(field, 0) or 0 for field in NUTRIENT_FIELDS] for line in lines], dtype=float)
+    return dict(zip(NUTRIENT_FIELDS, values.sum(axis=0).tolist()))
@@ -0,0 +1,130 @@
+"""
+Input fingerprints of portioned orders, so a re-run can leave unchanged orders alone.
+
+An order's fingerprint hashes everything its Client Servings row is computed from: the
+client record (goals, customization tags, constraint link, names), the Portion Algo
+Constraints record, the dish's Dishes rows, the Ingredients records of those rows and of the
+final ingredients, deletions, the skip flag, the solver mode and the optimizer's source. These
+are the records the order is built from, so the check runs before any dish nutrition is computed. After a row is written, the fingerprint is
+stored locally together with the recommendation summary that produced the row.
+
+On a re-run, an order with the same fingerprint is:
+- skipped, when it still has its Client Servings row (Portion Result is linked);
+- re-linked, by writing the stored summary again, when the row is gone.
+
+Either way the optimizer doesn't run and no new row is computed.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from src.portioning.result_cache import CACHE_DIR_ENV, CODE_FINGERPRINT, DEFAULT_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+
+def order_fingerprint(client, constraints, dish_lines, ingredients, deletions, skip_portioning, solver):
+    inputs = {
+        "code": CODE_FINGERPRINT,
+        "solver": solver,
+        "client": client,
+        "constraints": constraints,
+        "dish": dish_lines,
+        "ingredients": ingredients,
+        "deletions": deletions,
+        "skip_portioning": skip_portioning,
+    }
+    encoded = json.dumps(inputs, sort_keys=True, default=repr, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class OrderFingerprints:
+    """SQLite-backed (fingerprint, recommendation summary) per order, by Shopify order line id.
+
+    Fingerprints of the current run are held back until commit(), which stores only the
+    orders whose rows were actually written.
+    """
+
+    def __init__(self, directory=None):
+        directory = directory or os.getenv(CACHE_DIR_ENV) or DEFAULT_CACHE_DIR
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "order_fingerprints.sqlite3")
+        self._lock = threading.Lock()
+        self._fingerprints = {}  # order -> this run's fingerprint
+        self._pending = {}       # order -> (fingerprint, summary) written this run, not yet committed
+        self.skipped = 0
+        self.relinked = 0
+        self.changed = 0
+        self.new = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS orders ("
+                " order_id TEXT PRIMARY KEY, fingerprint TEXT, summary TEXT, written_at REAL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:  # commits on success
+                yield conn
+        finally:
+            conn.close()
+
+    def check(self, order_id, fingerprint):
+        """The stored summary when the order's inputs are unchanged, otherwise None. Also
+        remembers the fingerprint for the row this run writes."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT fingerprint, summary FROM orders WHERE order_id = ?", (str(order_id),)).fetchone()
+        with self._lock:
+            self._fingerprints[order_id] = fingerprint
+            if row is None:
+                self.new += 1
+            elif row[0] != fingerprint:
+                self.changed += 1
+            else:
+                return json.loads(row[1])
+        return None
+
+    def count(self, relinked):
+        with self._lock:
+            if relinked:
+                self.relinked += 1
+            else:
+                self.skipped += 1
+
+    def written(self, order_id, summary):
+        """A row was queued for the order; kept for commit() if this run fingerprinted it."""
+        with self._lock:
+            fingerprint = self._fingerprints.get(order_id)
+            if fingerprint is not None:
+                self._pending[order_id] = (fingerprint, summary)
+
+    def commit(self, written_orders):
+        """Store the fingerprints of the orders whose rows were written."""
+        with self._lock:
+            rows = [(str(order_id), fingerprint, json.dumps(summary, default=str), time.time())
+                    for order_id, (fingerprint, summary) in self._pending.items() if order_id in written_orders]
+            self._pending.clear()
+            self._fingerprints.clear()
+        if rows:
+            with self._connect() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO orders (order_id, fingerprint, summary, written_at) VALUES (?, ?, ?, ?)", rows
+                )
+
+    def stats(self):
+        with self._lock:
+            return {"skipped": self.skipped, "relinked": self.relinked, "changed": self.changed, "new": self.new}
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+            self._fingerprints.clear()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM orders")
@@ -1,16 +1,29 @@
+import asyncio
 import copy
 import json
+import multiprocessing
+import os
+import queue
 import re
+import threading
+import time
 from tqdm import tqdm
+import numpy as np
 import pandas as pd
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from types import SimpleNamespace
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from src.data.exceptions import AirtableDataError, PortioningError
+from src.data.async_store_access import AsyncAirTable
+from src.data.clientservings_writer import AsyncClientServingsWriter
 
 # Local imports
-from src.data.database import db  # shared database instance
+from src.data.database import get_db  # shared database instance, created on first use
 from src.portioning.dish_optimizer_llm import LLMDishOptimizer
-from src.portioning.dish_optimizer_ifelse import NewDishOptimizer
+from src.portioning.dish_optimizer_ifelse import NewDishOptimizer, solve_batch, solve_counted
+from src.portioning.nutrient_matrix import line_nutrients, line_totals
+from src.portioning.order_fingerprints import order_fingerprint
+from src.portioning.result_cache import OptimizerResultCache
 
 
 if __name__ == "__main__":
@@ -23,9 +36,39 @@ if __name__ == "__main__":
     project_dir = os.path.abspath(os.path.join(current_dir, ".."))
     sys.path.append(project_dir)
 
+# Open Orders columns build_client_dish_mapping reads for a portioning run
+PORTIONING_MAPPING_COLUMNS = dict(
+    shopify_id_column="#",
+    client_column="To_Match_Client_Nutrition",
+    dish_column="Dish ID",
+    ingredient_column="Final Ingredients with User Edits",
+    deletion_column="Deletions",
+    skip_portioning_column="Skip Portioning",
+    portion_result_column="Portion Result (in ClientServings)",
+)
+
+# Stages of generate_recommendations_pipeline, as reported in progress["stages"]
+PIPELINE_STAGES = ("fetch", "optimize", "write")
+
+# Orders generate_recommendations_async works on at once (lookups plus optimizer thread)
+ASYNC_MAX_IN_FLIGHT = 32
+
 class MealRecommendation:
-    def __init__(self) -> None:
-        self.db = db
+    def __init__(self, solver="rules", result_cache=None, history=None, fingerprints=None) -> None:
+        self.db = get_db()
+        # NewDishOptimizer mode: "rules" (iterative adjustments) or "qp" (constrained least squares)
+        self.solver = solver
+        # Results of identical optimizer inputs are reused; pass OptimizerResultCache(persist=True)
+        # to keep them across runs
+        self.result_cache = result_cache if result_cache is not None else OptimizerResultCache()
+        # PortionHistory to warm-start each client's solve from their previous portions of the dish
+        self.history = history
+        # OrderFingerprints to skip or re-link orders whose inputs haven't changed since their last result
+        self.fingerprints = fingerprints
+        # Orders in this run that already have a Portion Result (see build_client_dish_mapping)
+        self.portioned_orders = set()
+        # Open Orders record id per order in this run, for Linked OrderItem (see build_client_dish_mapping)
+        self.order_record_ids = {}
         # Initialize database connection
         # Clear previous recommendation results
         # self.clear_previous_results()
@@ -95,6 +138,17 @@ class MealRecommendation:
         }
 
     def optimize(self, dish, customer_requirements):
+        optimizer = self.build_optimizer(dish, customer_requirements)
+        json_part = self.result_cache.solve(optimizer)
+        self.remember_portions(customer_requirements, optimizer, json_part, optimizer.iterations, optimizer.warm_started)
+        return json_part
+
+    def remember_portions(self, client, optimizer, json_part, iterations=None, warm_started=False):
+        # iterations is None for results served from the result cache
+        if self.history is not None:
+            self.history.record(client.get("identifier"), optimizer.dish, json_part, iterations, warm_started)
+
+    def build_optimizer(self, dish, customer_requirements):
         # Define the list of nutritional variables to optimize
         nutrients = [
             "Kcal",
@@ -191,15 +245,12 @@ class MealRecommendation:
             dish,
             fixed_protein_grams,
             fixed_starch_grams,
-            fixed_veggies_grams
+            fixed_veggies_grams,
+            solver=self.solver,
         )
-
-        #try:
-        response = optimizer.solve()
-        return response
-        #except Exception as e:
-            #print
-            #return None
+        if self.history is not None:
+            optimizer.initial_scalers = self.history.initial_scalers(customer_requirements.get("identifier"), optimizer.dish)
+        return optimizer
 
     # Function to aggregate grams by component
     def summarize_components(self, dish):
@@ -216,6 +267,14 @@ class MealRecommendation:
                 components[comp][name] = grams
         return components
 
+    def linked_order_item(self, shopify_id):
+        # The order's Open Orders record id, from the page it was read in; orders that didn't
+        # come through build_client_dish_mapping are looked up one by one
+        record_id = self.order_record_ids.get(shopify_id)
+        if record_id is None:
+            record_id = self.db.get_rcdid_by_shopify_orderlineitem(shopify_id)
+        return record_id
+
     # Create the dict to fill the cells in table recommendation summary later
     def get_recommendation_summary(
         self,
@@ -270,7 +329,7 @@ class MealRecommendation:
 
         recommendation_summary = {
             "Recommendation ID": recommendation_id,
-            "Linked OrderItem": self.db.get_rcdid_by_shopify_orderlineitem(shopify_id),
+            "Linked OrderItem": self.linked_order_item(shopify_id),
             "Dish": dish_name,
             "Customer_FName": client["First_Name"],
             "Customer_LName": client["Last_Name"],
@@ -358,7 +417,7 @@ class MealRecommendation:
 
             recommendation_summary = {
                 "Recommendation ID": recommendation_id,
-                "Linked OrderItem": self.db.get_rcdid_by_shopify_orderlineitem(shopify_id),
+                "Linked OrderItem": self.linked_order_item(shopify_id),
                 "Dish": dish_name,
                 "Customer_FName": client.get("First_Name", "Unknown"),
                 "Customer_LName": client.get("Last_Name", "Unknown"),
@@ -415,77 +474,160 @@ class MealRecommendation:
             "Total Fiber (g)": total_fiber,
         }
 
-    def generate_recommendations_with_thread(self, cancel_event=None, progress=None):
+    def generate_recommendations_with_thread(self, cancel_event=None, progress=None, streaming=False, upsert=False, batch=False):
+        """
+        Portion every open order in the Running Portioning view.
+
+        streaming=True reads the view page by page and submits each page to the
+        optimizer as soon as it arrives, so the first orders are optimized and written
+        while later pages are still downloading. Orders with missing data are then
+        reported as failed cases instead of stopping the run before it starts.
+
+        upsert=True re-portions every order in the view, including ones that already
+        have a Portion Result, and updates their Client Servings rows in place (keyed
+        on Linked OrderItem) instead of adding new ones. Use it instead of clearing
+        the table with delete_all_clientservings before a re-run.
+
+        batch=True solves the orders that share a dish and final ingredient set together
+        (process_dish_batch, one task per group); other orders run one by one as before.
+        With streaming, orders are grouped within each page.
+        """
         #self.db.delete_all_clientservings() # only when reset
-        open_orders = self.db.get_all_open_orders_for_portioning()
+        open_orders = None if streaming else self.db.get_all_open_orders_for_portioning(include_portioned=upsert)
         finishedCount = 0
         failedCount = 0
         failedCases = []
+        # Client Servings rows are buffered and written 10 per request
+        writer = self.db.new_clientservings_writer(upsert=upsert)
+        counted_orders = set()
+        mapping_columns = PORTIONING_MAPPING_COLUMNS
 
         if progress is not None:
             progress["status"] = "Loading open orders…"
             progress["done"] = 0
             progress["failed"] = 0
             progress["total"] = 0
+            progress["written"] = 0
+            progress["fetched"] = len(open_orders) if open_orders is not None else 0
 
-        try:
-            client_dish_pairs = self.build_client_dish_mapping(
-                open_orders,
-                shopify_id_column="#",
-                client_column="To_Match_Client_Nutrition",
-                dish_column="Dish ID",
-                ingredient_column="Final Ingredients with User Edits",
-                deletion_column="Deletions",
-                skip_portioning_column="Skip Portioning"
-            )
-            protein_type_mapping = self.db.get_protein_group_mapping()
+        def collect(future, future_to_pair):
+            # Record the outcome of one finished order, or of each order in a finished dish batch
+            pairs = future_to_pair.pop(future)
+            if isinstance(pairs, list):
+                try:
+                    outcomes = future.result()
+                except Exception as e:
+                    outcomes = [e] * len(pairs)
+                for (shopify_id, _, _), error in zip(pairs, outcomes):
+                    record(shopify_id, error)
+            else:
+                try:
+                    future.result()
+                    record(pairs[0], None)
+                except Exception as e:
+                    record(pairs[0], e)
+
+        def record(shopify_id, error):
+            nonlocal finishedCount, failedCount
+            try:
+                if error is not None:
+                    raise error
+                finishedCount += 1
+                counted_orders.add(shopify_id)
+                writer.flush_if_due()
+                if progress is not None:
+                    progress["done"] = finishedCount
+                    progress["written"] = len(writer.written_orders)
+                    progress["status"] = f"Order {shopify_id} done"
+            except PortioningError as pe:
+                # Handle portioning errors specifically
+                error_message = str(pe)
+                failedCount += 1
+                failedCases.append(f"Portioning error for order {shopify_id}: {error_message}")
+                if progress is not None:
+                    progress["failed"] = failedCount
+                    progress["status"] = f"Order {shopify_id} failed"
+            except Exception as e:
+                # Handle any other exceptions
+                error_message = str(e)
+                failedCount += 1
+                failedCases.append(f"Error processing recommendation for open order {shopify_id}: {error_message}")
+                if progress is not None:
+                    progress["failed"] = failedCount
+                    progress["status"] = f"Order {shopify_id} failed"
 
+        stopped = False
+
+        def cancelled(executor):
+            nonlocal stopped
+            if not stopped and cancel_event is not None and cancel_event.is_set():
+                # Drop any pending work and stop waiting on in-flight futures.
+                executor.shutdown(wait=False, cancel_futures=True)
+                failedCases.append("Cancelled by user — returning partial results")
+                stopped = True
+            return stopped
+
+        try:
+            # Answer ingredient/client/constraint/variant lookups from memory for the whole run
             if progress is not None:
-                progress["total"] = len(client_dish_pairs)
-                progress["status"] = "Submitting orders to optimizer…"
+                progress["status"] = "Loading reference data snapshot…"
+            self.db.load_snapshot()
+            protein_type_mapping = self.db.get_protein_group_mapping()
+            # Dish lines are fetched once per dish for this run, shared by concurrent workers
+            self.db.request_cache.invalidate()
+            # One bulk load for this week's menu; orders for other dishes are loaded per page below
+            self.db.prefetch_dish_lines(self.db.get_weekly_menu_dish_ids())
 
             # Create a ThreadPoolExecutor to run tasks concurrently
             with ThreadPoolExecutor(max_workers=5) as executor:
-                try:
-                    future_to_pair = {
-                        executor.submit(self.process_recommendation, shopify_id, client_id, dish_id, final_ingredients, deletions, skip_portioning, protein_type_mapping):
-                        (shopify_id, client_id, dish_id)
-                        for shopify_id, client_id, dish_id, final_ingredients, deletions, skip_portioning in client_dish_pairs
-                    }
-                except Exception as e:
-                    error_message = str(e)
-                    failedCount += 1
-                    failedCases.append(f"Error creating futures: {error_message}")
+                future_to_pair = {}
 
-                for future in as_completed(future_to_pair):
-                    if cancel_event is not None and cancel_event.is_set():
-                        # Drop any pending work and stop waiting on in-flight futures.
-                        executor.shutdown(wait=False, cancel_futures=True)
-                        failedCases.append("Cancelled by user — returning partial results")
-                        break
-                    shopify_id, client_id, dish_id = future_to_pair[future]
-                    try:
-                        future.result()
-                        finishedCount += 1
-                        if progress is not None:
-                            progress["done"] = finishedCount
-                            progress["status"] = f"Order {shopify_id} done"
-                    except PortioningError as pe:
-                        # Handle portioning errors specifically
-                        error_message = str(pe)
-                        failedCount += 1
-                        failedCases.append(f"Portioning error for order {shopify_id}: {error_message}")
+                def submit(client_dish_pairs):
+                    self.db.prefetch_dish_lines([pair[2] for pair in client_dish_pairs])
+                    singles = client_dish_pairs
+                    if batch:
+                        batches, singles = self.group_orders_by_dish(client_dish_pairs)
+                        for orders in batches:
+                            future = executor.submit(self.process_dish_batch, orders, protein_type_mapping, writer)
+                            future_to_pair[future] = [pair[:3] for pair in orders]
+                    for shopify_id, client_id, dish_id, final_ingredients, deletions, skip_portioning in singles:
+                        future = executor.submit(self.process_recommendation, shopify_id, client_id, dish_id, final_ingredients, deletions, skip_portioning, protein_type_mapping, writer)
+                        future_to_pair[future] = (shopify_id, client_id, dish_id)
+                    if progress is not None:
+                        progress["total"] += len(client_dish_pairs)
+
+                if streaming:
+                    for page in self.db.iterate_open_orders_for_portioning(include_portioned=upsert):
+                        if cancelled(executor):
+                            break
+                        problematic_records = []
+                        client_dish_pairs = self.build_client_dish_mapping(page, problematic_records=problematic_records, portioned_orders=self.portioned_orders, order_record_ids=self.order_record_ids, **mapping_columns)
+                        failedCount += len(problematic_records)
+                        failedCases.extend(problematic_records)
+                        submit(client_dish_pairs)
                         if progress is not None:
+                            progress["fetched"] += len(page)
                             progress["failed"] = failedCount
-                            progress["status"] = f"Order {shopify_id} failed"
+                            progress["status"] = f"Fetched {progress['fetched']} open orders…"
+                        # Collect whatever finished while this page was downloading
+                        for future in [f for f in future_to_pair if f.done()]:
+                            collect(future, future_to_pair)
+                else:
+                    client_dish_pairs = self.build_client_dish_mapping(open_orders, portioned_orders=self.portioned_orders, order_record_ids=self.order_record_ids, **mapping_columns)
+                    if progress is not None:
+                        progress["status"] = "Submitting orders to optimizer…"
+                    try:
+                        submit(client_dish_pairs)
                     except Exception as e:
-                        # Handle any other exceptions
                         error_message = str(e)
                         failedCount += 1
-                        failedCases.append(f"Error processing recommendation for open order {shopify_id}: {error_message}")
-                        if progress is not None:
-                            progress["failed"] = failedCount
-                            progress["status"] = f"Order {shopify_id} failed"
+                        failedCases.append(f"Error creating futures: {error_message}")
+
+                if not stopped:
+                    for future in as_completed(list(future_to_pair)):
+                        if cancelled(executor):
+                            break
+                        collect(future, future_to_pair)
         except AirtableDataError as ade:
             # Handle Airtable data errors specifically
             error_message = str(ade)
@@ -495,9 +637,387 @@ class MealRecommendation:
             error_message = str(e)
             failedCount += 1
             failedCases.append(f"Unexpected error: {error_message}")
-                
+        finally:
+            # Always flush, including after a cancel, so finished orders are kept
+            if progress is not None:
+                progress["status"] = "Writing remaining Client Servings…"
+            writer.close()
+
+        return self._count_written_orders(writer, counted_orders, finishedCount, failedCount, failedCases, progress)
+
+    def _count_written_orders(self, writer, counted_orders, finishedCount, failedCount, failedCases, progress):
+        # Orders that finished after a cancel were still written; count them
+        finishedCount += len(writer.written_orders - counted_orders)
+        for failure in writer.failures:
+            for order_id in failure["orders"]:
+                if order_id in counted_orders:
+                    finishedCount -= 1
+                failedCount += 1
+            failedCases.append(f"Failed to write Client Servings for orders {', '.join(str(o) for o in failure['orders'])}: {failure['error']}")
+        cache_stats = self.result_cache.stats()
+        print(f"Optimizer result cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate)")
+        if progress is not None:
+            progress["done"] = finishedCount
+            progress["failed"] = failedCount
+            progress["written"] = len(writer.written_orders)
+            progress["result_cache"] = cache_stats
+        if self.fingerprints is not None:
+            self.fingerprints.commit(writer.written_orders)
+            fingerprint_stats = self.fingerprints.stats()
+            print(f"Unchanged orders: {fingerprint_stats['skipped']} skipped, {fingerprint_stats['relinked']} re-linked")
+            if progress is not None:
+                progress["fingerprints"] = fingerprint_stats
+        if self.history is not None:
+            warm_stats = self.history.stats()
+            print(f"Warm starts: {warm_stats['warm_starts']} of {warm_stats['warm_starts'] + warm_stats['cold_starts']} solves, {warm_stats['iterations_saved']} iterations saved")
+            if progress is not None:
+                progress["warm_start"] = warm_stats
+
         return finishedCount, failedCount, failedCases
 
+    def generate_recommendations_pipeline(self, cancel_event=None, progress=None, upsert=False,
+                                          fetch_workers=5, cpu_workers=None, max_in_flight=200):
+        """
+        Same run as generate_recommendations_with_thread(streaming=True, upsert=upsert), as a
+        three-stage pipeline so network and CPU are busy at the same time:
+
+        fetch     fetch_workers threads read each order's client, dish and ingredients and
+                  build its optimizer (skip-portioning orders are written here)
+        optimize  a process pool (cpu_workers, default one per core) runs
+                  NewDishOptimizer.solve() outside this process's GIL
+        write     one thread turns results into Client Servings rows for the batching writer
+
+        At most max_in_flight orders are between fetch and write at any time: reading the
+        next open order waits for a slot, which bounds memory when the optimizer falls
+        behind. progress["stages"] reports orders done, queued and per second for each stage.
+        """
+        finishedCount = 0
+        failedCount = 0
+        failedCases = []
+        counted_orders = set()
+        writer = self.db.new_clientservings_writer(upsert=upsert)
+        lock = threading.Lock()
+        slots = threading.BoundedSemaphore(max_in_flight)
+        # Holds at most max_in_flight results, since each one owns a slot
+        write_queue = queue.Queue()
+        outstanding = 0
+        stopped = False
+        started = time.monotonic()
+        stage_done = dict.fromkeys(PIPELINE_STAGES, 0)
+        # Orders that left in the fetch stage: skip portioning, unchanged, or failed
+        fetch_only = 0
+
+        if progress is not None:
+            progress["status"] = "Loading open orders…"
+            progress["done"] = 0
+            progress["failed"] = 0
+            progress["total"] = 0
+            progress["written"] = 0
+            progress["fetched"] = 0
+            progress["stages"] = {}
+
+        def report_stages():
+            # Caller holds lock
+            if progress is None:
+                return
+            elapsed = max(time.monotonic() - started, 1e-9)
+            queued = {"fetch": outstanding - stage_done["fetch"],
+                      "optimize": stage_done["fetch"] - fetch_only - stage_done["optimize"],
+                      "write": write_queue.qsize()}
+            progress["stages"] = {
+                stage: {"done": stage_done[stage], "queued": max(queued[stage], 0), "per_second": round(stage_done[stage] / elapsed, 1)}
+                for stage in PIPELINE_STAGES
+            }
+
+        def finish(shopify_id, stages, error=None):
+            # Record one order leaving the pipeline after `stages` (the ones it went through
+            # that haven't counted it yet) and free its slot
+            nonlocal finishedCount, failedCount, outstanding, fetch_only
+            with lock:
+                for stage in stages:
+                    stage_done[stage] += 1
+                if stages == ("fetch",):
+                    fetch_only += 1
+                outstanding -= 1
+                if error is None:
+                    finishedCount += 1
+                    counted_orders.add(shopify_id)
+                    status = f"Order {shopify_id} done"
+                else:
+                    failedCount += 1
+                    if isinstance(error, PortioningError):
+                        failedCases.append(f"Portioning error for order {shopify_id}: {str(error)}")
+                    else:
+                        failedCases.append(f"Error processing recommendation for open order {shopify_id}: {str(error)}")
+                    status = f"Order {shopify_id} failed"
+                if progress is not None:
+                    progress["done"] = finishedCount
+                    progress["failed"] = failedCount
+                    progress["written"] = len(writer.written_orders)
+                    progress["status"] = status
+                    report_stages()
+            slots.release()
+
+        def drop():
+            # An order abandoned by a cancel: free its slot without counting it
+            nonlocal outstanding
+            with lock:
+                outstanding -= 1
+            slots.release()
+
+        def fetch(pair):
+            shopify_id, client_id, dish_id, final_ingredients, deletions, skip_portioning = pair
+            try:
+                order = self._prepare_order(shopify_id, client_id, dish_id, final_ingredients, deletions, skip_portioning,
+                                            protein_type_mapping, writer)
+                if order is None:
+                    finish(shopify_id, ("fetch",))
+                    return
+                optimizer = self.build_optimizer(order.final_dish, order.client)
+            except Exception as e:
+                finish(shopify_id, ("fetch",), e)
+                return
+            with lock:
+                stage_done["fetch"] += 1
+            key, cached = self.result_cache.lookup(optimizer)
+            if cached is not None:
+                future = Future()
+                future.set_result((cached, None, False))
+                solved(order, optimizer, key, future)
+                return
+            try:
+                future = cpu_pool.submit(solve_counted, optimizer)
+            except RuntimeError:
+                # The pool was shut down by a cancel
+                drop()
+                return
+            future.add_done_callback(lambda f: solved(order, optimizer, key, f))
+
+        def solved(order, optimizer, key, future):
+            with lock:
+                stage_done["optimize"] += 1
+            write_queue.put((order, optimizer, key, future))
+
+        def write_results():
+            while True:
+                item = write_queue.get()
+                if item is None:
+                    return
+                order, optimizer, key, future = item
+                if future.cancelled():
+                    drop()
+                    continue
+                try:
+                    json_part, iterations, warm_started = future.result()
+                    if iterations is not None:
+                        self.result_cache.store(key, json_part)
+                    self.remember_portions(order.client, optimizer, json_part, iterations, warm_started)
+                    self._output_optimized(order, json_part, writer)
+                    writer.flush_if_due()
+                    finish(order.shopify_id, ("write",))
+                except Exception as e:
+                    finish(order.shopify_id, ("write",), e)
+
+        def cancelled():
+            nonlocal stopped
+            if not stopped and cancel_event is not None and cancel_event.is_set():
+                fetch_pool.shutdown(wait=False, cancel_futures=True)
+                cpu_pool.shutdown(wait=False, cancel_futures=True)
+                failedCases.append("Cancelled by user — returning partial results")
+                stopped = True
+            return stopped
+
+        fetch_pool = ThreadPoolExecutor(max_workers=fetch_workers)
+        # forkserver: workers don't inherit this (threaded) process's locks
+        cpu_pool = ProcessPoolExecutor(max_workers=cpu_workers or os.cpu_count() or 1,
+                                       mp_context=multiprocessing.get_context("forkserver"))
+        write_thread = threading.Thread(target=write_results, name="portioning-writer", daemon=True)
+        write_thread.start()
+        try:
+            if progress is not None:
+                progress["status"] = "Loading reference data snapshot…"
+            self.db.load_snapshot()
+            protein_type_mapping = self.db.get_protein_group_mapping()
+            self.db.request_cache.invalidate()
+            self.db.prefetch_dish_lines(self.db.get_weekly_menu_dish_ids())
+
+            for page in self.db.iterate_open_orders_for_portioning(include_portioned=upsert):
+                if cancelled():
+                    break
+                problematic_records = []
+                client_dish_pairs = self.build_client_dish_mapping(page, problematic_records=problematic_records, portioned_orders=self.portioned_orders, order_record_ids=self.order_record_ids, **PORTIONING_MAPPING_COLUMNS)
+                self.db.prefetch_dish_lines([pair[2] for pair in client_dish_pairs])
+                with lock:
+                    failedCount += len(problematic_records)
+                    failedCases.extend(problematic_records)
+                    if progress is not None:
+                        progress["total"] += len(client_dish_pairs)
+                        progress["fetched"] += len(page)
+                        progress["failed"] = failedCount
+                        progress["status"] = f"Fetched {progress['fetched']} open orders…"
+                for pair in client_dish_pairs:
+                    # Backpressure: wait for an order to leave the pipeline
+                    while not slots.acquire(timeout=0.1):
+                        if cancelled():
+                            break
+                    if stopped:
+                        break
+                    with lock:
+                        outstanding += 1
+                    fetch_pool.submit(fetch, pair)
+                if stopped:
+                    break
+
+            while not cancelled():
+                with lock:
+                    if outstanding <= 0:
+                        break
+                time.sleep(0.1)
+        except AirtableDataError as ade:
+            failedCases.append(f"Airtable data error: {str(ade)}")
+        except Exception as e:
+            failedCount += 1
+            failedCases.append(f"Unexpected error: {str(e)}")
+        finally:
+            fetch_pool.shutdown(wait=not stopped, cancel_futures=True)
+            cpu_pool.shutdown(wait=not stopped, cancel_futures=True)
+            # Results that arrived before a cancel are still written
+            write_queue.put(None)
+            write_thread.join()
+            if progress is not None:
+                progress["status"] = "Writing remaining Client Servings…"
+            writer.close()
+
+        return self._count_written_orders(writer, counted_orders, finishedCount, failedCount, failedCases, progress)
+
+    def generate_recommendations_async(self, cancel_event=None, progress=None, upsert=False,
+                                       max_in_flight=ASYNC_MAX_IN_FLIGHT):
+        """
+        Same run as generate_recommendations_with_thread(streaming=True, upsert=upsert), driven by an
+        asyncio event loop instead of a thread pool. Open order pages, client and dish
+        lookups and Client Servings writes are all requests on one AsyncAirTable, so the
+        rate budget stays saturated without a thread per order. At most max_in_flight
+        orders run at once; reading open orders waits for a free slot.
+
+        A cancel stops pending requests and orders that haven't reached the optimizer at
+        once. Orders already optimizing in a worker thread finish before the run returns,
+        but results that arrive after the final flush are not written.
+        """
+        return asyncio.run(self._generate_recommendations_async(cancel_event, progress, upsert, max_in_flight))
+
+    async def _generate_recommendations_async(self, cancel_event, progress, upsert=False,
+                                              max_in_flight=ASYNC_MAX_IN_FLIGHT):
+        finishedCount = 0
+        failedCount = 0
+        failedCases = []
+        counted_orders = set()
+        adb = AsyncAirTable(self.db)
+        writer = AsyncClientServingsWriter(self.db, adb, upsert=upsert)
+        dish_lookups = {}
+        order_tasks = set()
+        order_slots = asyncio.Semaphore(max_in_flight)
+
+        if progress is not None:
+            progress["status"] = "Loading open orders…"
+            progress["done"] = 0
+            progress["failed"] = 0
+            progress["total"] = 0
+            progress["written"] = 0
+            progress["fetched"] = 0
+
+        async def dish_lines(dish_id):
+            # One request per dish for the whole run; each order gets its own copy to edit
+            if dish_id not in dish_lookups:
+                dish_lookups[dish_id] = asyncio.ensure_future(adb.get_dish_calc_nutritions_by_dishId(dish_id))
+            return copy.deepcopy(await dish_lookups[dish_id])
+
+        async def run_order(shopify_id, client_id, dish_id, final_ingredients, deletions, skip_portioning):
+            nonlocal finishedCount, failedCount
+            try:
+                client = dish = None
+                if final_ingredients:
+                    client, dish = await asyncio.gather(adb.get_client_details(recId=client_id), dish_lines(dish_id))
+                    if client is None:
+                        raise AirtableDataError(f"Client {client_id} not found")
+                # The rest of the order (optimizer, lookups, history) is synchronous: run it in a
+                # worker thread so the loop keeps other requests going and a cancel isn't held up
+                await asyncio.to_thread(self.process_recommendation, shopify_id, client_id, dish_id, final_ingredients,
+                                        deletions, skip_portioning, protein_type_mapping, writer, client=client, dish=dish)
+                finishedCount += 1
+                counted_orders.add(shopify_id)
+                writer.flush_if_due()
+                if progress is not None:
+                    progress["done"] = finishedCount
+                    progress["written"] = len(writer.written_orders)
+                    progress["status"] = f"Order {shopify_id} done"
+            except PortioningError as pe:
+                failedCount += 1
+                failedCases.append(f"Portioning error for order {shopify_id}: {str(pe)}")
+                if progress is not None:
+                    progress["failed"] = failedCount
+                    progress["status"] = f"Order {shopify_id} failed"
+            except Exception as e:
+                failedCount += 1
+                failedCases.append(f"Error processing recommendation for open order {shopify_id}: {str(e)}")
+                if progress is not None:
+                    progress["failed"] = failedCount
+                    progress["status"] = f"Order {shopify_id} failed"
+
+        async def watch_cancel(run):
+            while not cancel_event.is_set():
+                await asyncio.sleep(0.1)
+            run.cancel()
+
+        watcher = asyncio.create_task(watch_cancel(asyncio.current_task())) if cancel_event is not None else None
+        try:
+            if progress is not None:
+                progress["status"] = "Loading reference data snapshot…"
+            await asyncio.to_thread(self.db.load_snapshot)
+            # Both may read Airtable; keep them off the loop
+            protein_type_mapping = await asyncio.to_thread(self.db.get_protein_group_mapping)
+            self.db.request_cache.invalidate()
+            await adb.prefetch_dish_lines(await asyncio.to_thread(self.db.get_weekly_menu_dish_ids))
+
+            async for page in adb.iterate_open_orders_for_portioning(include_portioned=upsert):
+                problematic_records = []
+                client_dish_pairs = self.build_client_dish_mapping(page, problematic_records=problematic_records, portioned_orders=self.portioned_orders, order_record_ids=self.order_record_ids, **PORTIONING_MAPPING_COLUMNS)
+                failedCount += len(problematic_records)
+                failedCases.extend(problematic_records)
+                await adb.prefetch_dish_lines([pair[2] for pair in client_dish_pairs])
+                if progress is not None:
+                    progress["total"] += len(client_dish_pairs)
+                    progress["fetched"] += len(page)
+                    progress["failed"] = failedCount
+                    progress["status"] = f"Fetched {progress['fetched']} open orders…"
+                for pair in client_dish_pairs:
+                    await order_slots.acquire()
+                    task = asyncio.create_task(run_order(*pair))
+                    task.add_done_callback(lambda _: order_slots.release())
+                    order_tasks.add(task)
+            if order_tasks:
+                await asyncio.gather(*order_tasks)
+        except asyncio.CancelledError:
+            for task in order_tasks:
+                task.cancel()
+            for task in dish_lookups.values():
+                task.cancel()
+            failedCases.append("Cancelled by user — returning partial results")
+        except AirtableDataError as ade:
+            failedCases.append(f"Airtable data error: {str(ade)}")
+        except Exception as e:
+            failedCount += 1
+            failedCases.append(f"Unexpected error: {str(e)}")
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            # Always flush, including after a cancel, so finished orders are kept
+            if progress is not None:
+                progress["status"] = "Writing remaining Client Servings…"
+            await writer.aclose()
+            await adb.aclose()
+
+        return self._count_written_orders(writer, counted_orders, finishedCount, failedCount, failedCases, progress)
+
     def generate_recommendations(self):
         
         # self.db.delete_all_clientservings() # only when reset
@@ -516,14 +1036,121 @@ class MealRecommendation:
         return client_dish_pairs
         
 
-    def process_recommendation(self, shopify_id, client_id, dish_id, final_ingredients, deletions,skip_portioning,protein_type_mapping):
+    def _unchanged_order(self, shopify_id, client, dish_lines, ingredient_records, deletions, skip_portioning, writer=None):
+        # True when the order's inputs match its last written result: skipped if it still has
+        # its Client Servings row, otherwise re-linked by writing the stored summary again.
+        # Fingerprinted on the source records (see get_order_source_records), so it runs
+        # before the dish nutrition is built
+        constraint_id = (client.get("Portion Algo Constraints") or [None])[0]
+        constraints = self.db.get_constraints_details_by_rcdId(id=constraint_id) if constraint_id else None
+        fingerprint = order_fingerprint(client, constraints, [line['fields'] for line in dish_lines],
+                                        {rec_id: record['fields'] for rec_id, record in ingredient_records.items()},
+                                        deletions, skip_portioning, self.solver)
+        summary = self.fingerprints.check(shopify_id, fingerprint)
+        if summary is None:
+            return False
+        if shopify_id in self.portioned_orders:
+            self.fingerprints.count(relinked=False)
+        else:
+            self.output_recommendation(summary, shopify_id, writer)
+            self.fingerprints.count(relinked=True)
+        return True
+
+    def output_recommendation(self, recommendation_summary, shopify_id, writer=None):
+        if self.fingerprints is not None:
+            self.fingerprints.written(shopify_id, recommendation_summary)
+        # Buffer through the batched writer when one is given, otherwise write straight away
+        if writer is not None:
+            writer.add(recommendation_summary, shopify_id)
+        else:
+            self.db.output_clientservings(recommendation_summary)
+
+    def process_recommendation(self, shopify_id, client_id, dish_id, final_ingredients, deletions,skip_portioning,protein_type_mapping, writer=None, client=None, dish=None):
         # Extracted recommendation logic for concurrent execution in generate_recommendations
+        # client / dish may be passed in already fetched (see the asyncio driver)
+        order = self._prepare_order(shopify_id, client_id, dish_id, final_ingredients, deletions, skip_portioning,
+                                    protein_type_mapping, writer, client=client, dish=dish)
+        if order is None:
+            return
+        # Run optimization and process response
+        self._output_optimized(order, self.optimize(order.final_dish, order.client), writer)
+
+    def process_dish_batch(self, orders, protein_type_mapping, writer=None):
+        """
+        Portion orders that share a dish and final ingredient set (see group_orders_by_dish):
+        the dish lines are fetched once and every client is solved in one solve_batch call.
+        `orders` are build_client_dish_mapping tuples. Returns one entry per order, None
+        when it was written or the exception that stopped it, so one bad order doesn't fail
+        the others.
+        """
+        outcomes = [None] * len(orders)
+        dish = self.db.get_dish_calc_nutritions_by_dishId(dish_id=orders[0][2])
+        prepared, optimizers = [], []
+        for position, (shopify_id, client_id, dish_id, final_ingredients, deletions, skip_portioning) in enumerate(orders):
+            try:
+                order = self._prepare_order(shopify_id, client_id, dish_id, final_ingredients, deletions, skip_portioning,
+                                            protein_type_mapping, writer, dish=copy.deepcopy(dish))
+                if order is not None:
+                    optimizer = self.build_optimizer(order.final_dish, order.client)
+                    key, cached = self.result_cache.lookup(optimizer)
+                    if cached is None:
+                        optimizers.append(optimizer)
+                    prepared.append((position, order, optimizer, key, cached))
+            except Exception as e:
+                outcomes[position] = e
+
+        # Only the cache misses are solved
+        solved = iter(solve_batch(optimizers))
+        for position, order, optimizer, key, json_part in prepared:
+            if json_part is None:
+                json_part = next(solved)
+                if not isinstance(json_part, Exception):
+                    self.result_cache.store(key, json_part)
+            try:
+                if not isinstance(json_part, Exception):
+                    self.remember_portions(order.client, optimizer, json_part, optimizer.iterations, optimizer.warm_started)
+                if isinstance(json_part, Exception):
+                    raise json_part
+                self._output_optimized(order, json_part, writer)
+            except Exception as e:
+                outcomes[position] = e
+        return outcomes
+
+    def group_orders_by_dish(self, client_dish_pairs, min_batch=2):
+        """
+        Split build_client_dish_mapping tuples into (batches, singles). A batch is the orders
+        with the same dish and the same final ingredients, so every client gets the same
+        dish lines and only the targets differ; any group smaller than min_batch, and
+        orders with skip portioning or no final ingredients, stay single orders for
+        process_recommendation.
+        """
+        groups = defaultdict(list)
+        singles = []
+        for pair in client_dish_pairs:
+            _, _, dish_id, final_ingredients, _, skip_portioning = pair
+            if skip_portioning or not final_ingredients:
+                singles.append(pair)
+            else:
+                # In order: _prepare_order builds the dish lines in final_ingredients order
+                groups[(dish_id, tuple(final_ingredients))].append(pair)
+        batches = []
+        for group in groups.values():
+            if len(group) >= min_batch:
+                batches.append(group)
+            else:
+                singles.extend(group)
+        return batches, singles
+
+    def _prepare_order(self, shopify_id, client_id, dish_id, final_ingredients, deletions, skip_portioning, protein_type_mapping, writer=None, client=None, dish=None):
+        # The order's final dish, ready to optimize; None when there is nothing to optimize
+        # (no final dish, or skip portioning, whose default summary is written here)
         
         # Check if final_ingredients is None or empty
         if final_ingredients is None or len(final_ingredients) == 0:
             raise PortioningError(f"Skipping order {shopify_id}: No Final Ingredients with User Edits provided")
         
-        client = self.db.get_client_details(recId=client_id)
+        if client is None:
+            client = self.db.get_client_details(recId=client_id)
         
         # Check if any nutrition goals are zero
         zero_goals = []
@@ -541,16 +1168,26 @@ class MealRecommendation:
         if len(zero_goals) > 2:
             raise PortioningError(f"Skipping order {shopify_id}: More than 2 zero nutrition goals detected for {client['identifier']}: {', '.join(zero_goals)}")
         
-        dish = self.db.get_dish_calc_nutritions_by_dishId(dish_id=dish_id)
+        ingredient_records = None
+        if self.fingerprints is not None:
+            dish_lines, ingredient_records = self.db.get_order_source_records(dish_id, final_ingredients)
+            if self._unchanged_order(shopify_id, client, dish_lines, ingredient_records, deletions, skip_portioning, writer):
+                return
+
+        if dish is None:
+            dish = self.db.get_dish_calc_nutritions_by_dishId(dish_id=dish_id)
         if any(ing['Grams'] == 0 for ing in dish):
             raise ValueError(f"Skipping order {shopify_id}: At least one ingredient has zero starting grams in the dish {dish_id}")
 
+        # One bulk lookup for every final ingredient instead of two .get() calls each
+        final_ingredient_details = self.db.get_ingredients_details_by_recIds(final_ingredients, records=ingredient_records)
+
         final_ingredients_set = set()
         orig_ingredients_set = set()
         final_dish = []
         for final_ingredient in final_ingredients:
             final_ingredients_set.add(
-                self.db.get_ingredient_details_by_recId(final_ingredient)["Ingredient ID"]
+                final_ingredient_details[final_ingredient]["Ingredient ID"]
             )
 
         # Populate original and final dish details
@@ -565,8 +1202,9 @@ class MealRecommendation:
                 final_dish.append(ingredient)
 
         # Add new ingredients not present in the original recipe
+        new_ingredients = []
         for ingredient_recId in final_ingredients:
-            ingredient = self.db.get_ingredient_details_by_recId(ingredient_recId)
+            ingredient = dict(final_ingredient_details[ingredient_recId])
             if ingredient["Ingredient ID"] not in orig_ingredients_set:
                 ingredient['id'] = ingredient_recId
                 ingredient["Component (from Ingredient)"] = [ingredient["Component"]]
@@ -577,20 +1215,21 @@ class MealRecommendation:
                     default_grams = main_dish_ingredients[0]["Grams"]
                 else:
                     default_grams = 5 if component == "Garnish" else 20 if component == "Sauce" else 50 if component == "Veggies" else 200
-                scale = default_grams / ingredient["Grams"]
-                ingredient['Kcal'] = ingredient["Energy (kcal)"] * scale
-                ingredient['Carbohydrate, total (g)'] = ingredient['Carbohydrate, total (g)'] * scale
-                ingredient['Protein (g)'] = ingredient['Protein (g)'] * scale
-                ingredient['Fat, Total (g)'] = ingredient['Fat, Total (g)'] * scale
-                ingredient['Dietary Fiber (g)'] = ingredient['Dietary Fiber (g)'] * scale
-                ingredient['Sodium (mg)'] = ingredient['Sodium (mg)'] * scale
-                ingredient['Calcium (mg)'] = ingredient['Calcium (mg)'] * scale
-                ingredient['Phosphorus, P (mg)'] = ingredient['Phosphorus, P (mg)'] * scale
-                ingredient['Fatty acids, total saturated (g)'] = ingredient['Fatty acids, total saturated (g)'] * scale
+                new_ingredients.append((ingredient, default_grams))
+
+        if new_ingredients:
+            # Scale all substitutions from their base grams to the default grams in one batch
+            rec_ids = [ingredient['id'] for ingredient, _ in new_ingredients]
+            matrix = self.db.nutrient_matrix({rec_id: final_ingredient_details[rec_id] for rec_id in rec_ids})
+            rates = matrix.rates(rec_ids, [default_grams for _, default_grams in new_ingredients])
+            if not np.all(np.isfinite(rates)):
+                raise ZeroDivisionError(f"Skipping order {shopify_id}: a substituted ingredient has zero base grams")
+            for (ingredient, default_grams), row in zip(new_ingredients, matrix.scale(rec_ids, rates)):
+                ingredient.update(line_nutrients(row))
                 ingredient["Grams"] = default_grams
                 ingredient["Airtable Dish Name"] = dish[0]["Airtable Dish Name"]
                 ingredient["Recommendation ID"] = shopify_id
-                ingredient['protein_type'] = protein_type_mapping.get(ingredient_recId, "ignore")
+                ingredient['protein_type'] = protein_type_mapping.get(ingredient['id'], "ignore")
                 final_dish.append(ingredient)
         
         
@@ -603,16 +1242,17 @@ class MealRecommendation:
         # Check if portioning should be skipped. If so, output default recommendation summary
         if skip_portioning:
             print(f"Skipping portioning for Dish ID {dish_id} (Client ID {client_id}).")
+            totals = line_totals(dish)
             nutritional_information={
-                            "Calories": round(sum(ingredient.get("Kcal", 0) for ingredient in dish), 1),
-                            "Protein": round(sum(ingredient.get("Protein (g)", 0) for ingredient in dish), 1),
-                            "Carbohydrates": round(sum(ingredient.get("Carbohydrate, total (g)", 0) for ingredient in dish), 1),
-                            "Fiber": round(sum(ingredient.get("Dietary Fiber (g)", 0) for ingredient in dish), 1),
-                            "Fat": round(sum(ingredient.get("Fat, Total (g)", 0) for ingredient in dish), 1),
-                            "Sodium (mg)": round(sum(ingredient.get("Sodium (mg)", 0) for ingredient in dish), 1),
-                            "Calcium (mg)": round(sum(ingredient.get("Calcium (mg)", 0) for ingredient in dish), 1),
-                            "Phosphorus, P (mg)": round(sum(ingredient.get("Phosphorus, P (mg)", 0) for ingredient in dish), 1),
-                            "Fatty acids, total saturated (g)": round(sum(ingredient.get("Fatty acids, total saturated (g)", 0) for ingredient in dish), 1),
+                            "Calories": round(totals["Kcal"], 1),
+                            "Protein": round(totals["Protein (g)"], 1),
+                            "Carbohydrates": round(totals["Carbohydrate, total (g)"], 1),
+                            "Fiber": round(totals["Dietary Fiber (g)"], 1),
+                            "Fat": round(totals["Fat, Total (g)"], 1),
+                            "Sodium (mg)": round(totals["Sodium (mg)"], 1),
+                            "Calcium (mg)": round(totals["Calcium (mg)"], 1),
+                            "Phosphorus, P (mg)": round(totals["Phosphorus, P (mg)"], 1),
+                            "Fatty acids, total saturated (g)": round(totals["Fatty acids, total saturated (g)"], 1),
                         }
             percentages = {}
             for nutrient in ['kcal', 'protein(g)', 'fat(g)', 'dietaryFiber(g)', 'carbohydrate(g)']:
@@ -640,11 +1280,13 @@ class MealRecommendation:
             )
             # Calculate percentages for default recommendation
             
-            self.db.output_clientservings(default_recommendation_summary)
+            self.output_recommendation(default_recommendation_summary, shopify_id, writer)
             return
-        # try:
-        # Run optimization and process response
-        json_part = self.optimize(final_dish, client)
+        return SimpleNamespace(shopify_id=shopify_id, client=client, final_dish=final_dish, dish_name=dish_name,
+                               recommendation_id=recommendation_id, final_ingredients=final_ingredients, deletions=deletions)
+
+    def _output_optimized(self, order, json_part, writer=None):
+        shopify_id = order.shopify_id
         # if response.startswith("```json") and response.endswith("```"):
             # response = response[7:-3].strip()
         # print(f"Optimization response for {shopify_id} (Client ID {client_id}): {response}")
@@ -656,18 +1298,18 @@ class MealRecommendation:
         review_needed = bool(json_part.get("results", {}).get("review_needed", False))
         notes = str(json_part.get("results", {}).get("notes", False))
         recommendation_summary = self.get_recommendation_summary(
-            dish_name,
-            recommendation_id,
+            order.dish_name,
+            order.recommendation_id,
             shopify_id,
             recipe,
-            client,
+            order.client,
             nutritional_information,
-            final_ingredients=final_ingredients,
-            deletions=deletions,
+            final_ingredients=order.final_ingredients,
+            deletions=order.deletions,
             explanation=notes + "; " + explanation,
             review_needed=review_needed
         )
-        self.db.output_clientservings(recommendation_summary)
+        self.output_recommendation(recommendation_summary, shopify_id, writer)
         
         """ except Exception as e:
             # Fallback to default recommendation summary in case of failure
@@ -692,10 +1334,19 @@ class MealRecommendation:
         dish_column,
         ingredient_column,
         deletion_column,
-        skip_portioning_column
+        skip_portioning_column,
+        portion_result_column=None,
+        problematic_records=None,
+        portioned_orders=None,
+        order_record_ids=None
     ):
+        # Pass a list as problematic_records to collect bad records instead of raising
+        # Pass a set as portioned_orders to collect the orders that already have a Portion Result
+        # Pass a dict as order_record_ids to collect each order's Open Orders record id
+        raise_on_problems = problematic_records is None
         client_dish_pairs = []
-        problematic_records = []  # List to track problematic records
+        if problematic_records is None:
+            problematic_records = []  # List to track problematic records
 
         for open_order in open_orders:  
             record_data = open_order["fields"]
@@ -720,6 +1371,11 @@ class MealRecommendation:
             client_id = record_data[client_column][0]
             dish_id = record_data[dish_column]
             
+            if portioned_orders is not None and record_data.get(portion_result_column):
+                portioned_orders.add(shopify_id)
+            if order_record_ids is not None and "id" in open_order:
+                order_record_ids[shopify_id] = open_order["id"]
+
             if skip_portioning_column in record_data and record_data[skip_portioning_column] is not None:
                 skip_portioning = record_data[skip_portioning_column]
             else:
@@ -730,7 +1386,7 @@ class MealRecommendation:
             )
                 
         # If there were any problematic records, raise an exception with all of them
-        if problematic_records:
+        if problematic_records and raise_on_problems:
             error_message = "Found {} problematic records when in preparation stage of cleaning data\n{}".format(
                 len(problematic_records),
                 ";\n".join(problematic_records)
@@ -0,0 +1,112 @@
+"""
+Local history of the portions each client was given, for warm-starting the optimizer.
+
+Keyed on the client identifier and the dish's ingredient lines (ingredient IDs in recipe
+order), so the same dish, or another dish with the same lines, starts next week from
+this week's scalers instead of the heuristic ones. Most clients keep their targets from
+week to week, and the optimizer then needs only a few iterations.
+
+Every row also keeps the iterations the last cold (not warm-started) solve took, so
+each warm solve records how many iterations it saved.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from src.portioning.result_cache import CACHE_DIR_ENV, DEFAULT_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+
+def _ingredients_key(dish):
+    return json.dumps([ingredient['ingredientId'] for ingredient in dish['ingredients']])
+
+
+class PortionHistory:
+    """SQLite-backed final scalers per (client identifier, ingredient lines)."""
+
+    def __init__(self, directory=None):
+        directory = directory or os.getenv(CACHE_DIR_ENV) or DEFAULT_CACHE_DIR
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "portion_history.sqlite3")
+        self._lock = threading.Lock()
+        self.warm_starts = 0
+        self.cold_starts = 0
+        self.warm_iterations = 0
+        self.iterations_saved = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS portions ("
+                " client TEXT, ingredients TEXT, scalers TEXT, cold_iterations INTEGER,"
+                " last_iterations INTEGER, updated_at REAL, PRIMARY KEY (client, ingredients))"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:  # commits on success
+                yield conn
+        finally:
+            conn.close()
+
+    def initial_scalers(self, client, dish):
+        """The client's last scalers for these ingredient lines, or None."""
+        if not client or not dish:
+            return None
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT scalers FROM portions WHERE client = ? AND ingredients = ?", (client, _ingredients_key(dish))
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def record(self, client, dish, result, iterations=None, warm_started=False):
+        """Store the scalers of a portioning result (grams / base grams per line). With the
+        solve's iteration count, also count it as a warm or cold start; results served
+        from the result cache have none and only refresh the scalers."""
+        if not client or not dish or not isinstance(result, dict):
+            return
+        lines = result.get("modified_recipe", {}).get("ingredients", [])
+        if len(lines) != len(dish['ingredients']):
+            return
+        scalers = [
+            line["Grams"] / ingredient['baseGrams'] if ingredient['baseGrams'] else 1.0
+            for line, ingredient in zip(lines, dish['ingredients'])
+        ]
+        key = _ingredients_key(dish)
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT cold_iterations FROM portions WHERE client = ? AND ingredients = ?", (client, key)
+            ).fetchone()
+            cold_iterations = row[0] if row is not None else None
+            if iterations is not None:
+                if warm_started:
+                    self.warm_starts += 1
+                    self.warm_iterations += iterations
+                    if cold_iterations is not None:
+                        self.iterations_saved += max(cold_iterations - iterations, 0)
+                else:
+                    self.cold_starts += 1
+                    cold_iterations = iterations
+            conn.execute(
+                "INSERT OR REPLACE INTO portions (client, ingredients, scalers, cold_iterations, last_iterations, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (client, key, json.dumps(scalers), cold_iterations, iterations, time.time()),
+            )
+
+    def stats(self):
+        with self._lock:
+            return {
+                "warm_starts": self.warm_starts,
+                "cold_starts": self.cold_starts,
+                "warm_iterations": self.warm_iterations,
+                "iterations_saved": self.iterations_saved,
+            }
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM portions")
@@ -0,0 +1,175 @@
+"""
+Small dense convex QP solver, used by NewDishOptimizer's "qp" mode.
+
+    minimize    1/2 x'Hx + f'x
+    subject to  Cx <= d
+
+H must be positive definite. The dual has only lambda >= 0 as constraints, so it is
+solved by accelerated projected gradient. The constraints that leave active are then
+solved exactly as equalities, adding or dropping one constraint at a time until the
+KKT conditions hold (active-set polish), so limits that bind hold to rounding error.
+Meant for a handful of variables and a dozen constraints; everything is dense.
+solve_qp_batch solves many such problems that share their constraints in one pass.
+"""
+import numpy as np
+
+DEFAULT_MAX_ITERATIONS = 2000
+DEFAULT_TOLERANCE = 1e-9
+
+
+class QPResult:
+    def __init__(self, x, active, feasible, iterations):
+        self.x = x                    # solution (best effort when infeasible)
+        self.active = active          # indices of the constraints that bind at x
+        self.feasible = feasible      # False when no x satisfies Cx <= d (within tolerance)
+        self.iterations = iterations  # dual gradient steps + active-set changes
+
+    def __repr__(self):
+        return f"QPResult(x={self.x}, active={self.active}, feasible={self.feasible}, iterations={self.iterations})"
+
+
+def _kkt_solve(H, f, C, d, active):
+    """x and multipliers minimizing the objective with the `active` constraints held as equalities."""
+    n = len(f)
+    if not active:
+        return np.linalg.solve(H, -f), np.zeros(0)
+    A = C[active]
+    kkt = np.block([[H, A.T], [A, np.zeros((len(active), len(active)))]])
+    rhs = np.concatenate([-f, d[active]])
+    # lstsq copes with dependent active rows (e.g. two limits on the same component)
+    solution = np.linalg.lstsq(kkt, rhs, rcond=None)[0]
+    return solution[:n], solution[n:]
+
+
+def solve_qp(H, f, C, d, max_iterations=DEFAULT_MAX_ITERATIONS, tolerance=DEFAULT_TOLERANCE, x0=None):
+    """x0, a guess at the solution (e.g. last week's), starts the active-set polish from the
+    constraints that bind at x0 and skips the dual iterations when that converges."""
+    H = np.asarray(H, dtype=float)
+    f = np.asarray(f, dtype=float)
+    C = np.asarray(C, dtype=float).reshape(-1, len(f))
+    d = np.asarray(d, dtype=float)
+    if not len(C):
+        return QPResult(np.linalg.solve(H, -f), [], True, 0)
+
+    # Unit rows, so one step size and one tolerance suit every constraint
+    norms = np.linalg.norm(C, axis=1)
+    C, d = C / norms[:, None], d / norms
+
+    if x0 is not None:
+        guess = np.asarray(x0, dtype=float)
+        active = np.flatnonzero(np.abs(C @ guess - d) <= np.sqrt(tolerance)).tolist()
+        x, iterations, converged = _polish(H, f, C, d, guess, active, 0, tolerance)
+        if converged:
+            return _result(C, d, x, iterations, tolerance)
+
+    H_inv = np.linalg.inv(H)
+    H_inv_Ct = H_inv @ C.T
+    x_free = -H_inv @ f
+    P = C @ H_inv_Ct
+    q = d - C @ x_free
+    step = 1.0 / max(np.linalg.eigvalsh(P).max(), tolerance)
+
+    # FISTA on the dual: minimize 1/2 l'Pl + q'l over l >= 0; x(l) = x_free - H^-1 C'l
+    lam = np.zeros(len(d))
+    y = lam.copy()
+    t = 1.0
+    iterations = 0
+    for iterations in range(1, max_iterations + 1):
+        lam_next = np.maximum(0.0, y - step * (P @ y + q))
+        if np.abs(lam_next - lam).max() <= tolerance * max(1.0, lam_next.max()):
+            lam = lam_next
+            break
+        t_next = (1.0 + np.sqrt(1.0 + 4.0 * t * t)) / 2.0
+        y = lam_next + ((t - 1.0) / t_next) * (lam_next - lam)
+        lam, t = lam_next, t_next
+    x = x_free - H_inv_Ct @ lam
+    x, iterations, _ = _polish(H, f, C, d, x, _dual_active(lam, tolerance), iterations, tolerance)
+    return _result(C, d, x, iterations, tolerance)
+
+
+def _dual_active(lam, tolerance):
+    return sorted(np.flatnonzero(lam > tolerance).tolist())
+
+
+def _result(C, d, x, iterations, tolerance):
+    violation = C @ x - d
+    feasible = bool(violation.max() <= np.sqrt(tolerance))
+    binding = np.flatnonzero(np.abs(violation) <= np.sqrt(tolerance)).tolist()
+    return QPResult(x, binding, feasible, iterations)
+
+
+def solve_qp_batch(H, f, C, d, max_iterations=DEFAULT_MAX_ITERATIONS, tolerance=DEFAULT_TOLERANCE):
+    """solve_qp for k problems that share the constraints Cx <= d: H is (k, n, n), f is (k, n).
+
+    The dual iterations run on the whole stack at once (a problem stops stepping once it
+    has converged), the active-set polish runs per problem and feasibility is checked for
+    the stack in one product. Returns one QPResult per problem, in order.
+    """
+    H = np.asarray(H, dtype=float)
+    f = np.asarray(f, dtype=float)
+    count, n = f.shape
+    C = np.asarray(C, dtype=float).reshape(-1, n)
+    d = np.asarray(d, dtype=float)
+    if not len(C):
+        return [QPResult(x, [], True, 0) for x in np.linalg.solve(H, -f[..., None])[..., 0]]
+
+    norms = np.linalg.norm(C, axis=1)
+    C, d = C / norms[:, None], d / norms
+
+    H_inv = np.linalg.inv(H)
+    H_inv_Ct = H_inv @ C.T
+    x_free = -(H_inv @ f[..., None])[..., 0]
+    P = C @ H_inv_Ct
+    q = d - x_free @ C.T
+    step = 1.0 / np.maximum(np.linalg.eigvalsh(P).max(axis=1), tolerance)
+
+    lam = np.zeros((count, len(d)))
+    y = lam.copy()
+    t = 1.0
+    iterations = np.zeros(count, dtype=int)
+    running = np.arange(count)
+    for iteration in range(1, max_iterations + 1):
+        # Every running problem has taken the same number of steps, so they share t
+        lam_next = np.maximum(0.0, y[running] - step[running, None] * ((P[running] @ y[running, :, None])[..., 0] + q[running]))
+        done = np.abs(lam_next - lam[running]).max(axis=1) <= tolerance * np.maximum(1.0, lam_next.max(axis=1))
+        t_next = (1.0 + np.sqrt(1.0 + 4.0 * t * t)) / 2.0
+        y[running] = lam_next + ((t - 1.0) / t_next) * (lam_next - lam[running])
+        lam[running] = lam_next
+        iterations[running] = iteration
+        running = running[~done]
+        t = t_next
+        if not len(running):
+            break
+    x = x_free - (H_inv_Ct @ lam[..., None])[..., 0]
+
+    for k in range(count):
+        x[k], iterations[k], _ = _polish(H[k], f[k], C, d, x[k], _dual_active(lam[k], tolerance), int(iterations[k]), tolerance)
+
+    violation = x @ C.T - d
+    feasible = violation.max(axis=1) <= np.sqrt(tolerance)
+    binding = np.abs(violation) <= np.sqrt(tolerance)
+    return [
+        QPResult(x[k], np.flatnonzero(binding[k]).tolist(), bool(feasible[k]), int(iterations[k]))
+        for k in range(count)
+    ]
+
+
+def _polish(H, f, C, d, x, active, iterations, tolerance):
+    """Active-set polish starting from `active`; returns (x, iterations, converged). x is
+    only replaced once the KKT conditions hold."""
+    active = sorted(active)
+    for _ in range(2 * len(d) + len(f)):
+        iterations += 1
+        x_active, multipliers = _kkt_solve(H, f, C, d, active)
+        if len(multipliers) and multipliers.min() < -tolerance:
+            active.pop(int(np.argmin(multipliers)))
+            continue
+        violation = C @ x_active - d
+        if violation.max() > tolerance:
+            worst = int(np.argmax(violation))
+            if worst in active:
+                break
+            active = sorted(active + [worst])
+            continue
+        return x_active, iterations, True
+    return x, iterations, False
@@ -0,0 +1,195 @@
+"""
+Content-addressed cache of NewDishOptimizer results.
+
+Two orders with identical optimizer inputs get identical portions: same dish lines and
+final ingredients, same goals, same constraint record and customization (double sauce,
+fixed grams), same solver mode and same warm start. The key is a hash of exactly those
+inputs, as the optimizer holds them, plus the optimizer's source, so a change to the
+optimizer code never serves results computed by the old one.
+
+Results are kept in an in-memory LRU for the run and, with `persist=True`, in a SQLite
+file that keeps the most recently used entries across runs.
+"""
+import copy
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+from src.portioning import dish_optimizer_ifelse, qp_solver
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(".cache", "optimizer")
+CACHE_DIR_ENV = "OPTIMIZER_CACHE_DIR"
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_MAX_PERSISTED = 20000
+# Trim the persisted table back to max_persisted entries every this many stores
+TRIM_EVERY = 200
+
+
+def _code_fingerprint():
+    digest = hashlib.sha256()
+    for module in (dish_optimizer_ifelse, qp_solver):
+        digest.update(Path(module.__file__).read_bytes())
+    return digest.hexdigest()[:16]
+
+
+CODE_FINGERPRINT = _code_fingerprint()
+
+
+def optimizer_key(optimizer):
+    """Hash of everything NewDishOptimizer.solve() reads. Customization Tags and the
+    constraint record enter through what the optimizer was built with (double_sauce,
+    nutrient bounds, veggie >= starch, per-100-kcal limits, fixed grams)."""
+    inputs = {
+        "code": CODE_FINGERPRINT,
+        "solver": optimizer.solver,
+        "dish": optimizer.dish,
+        "grouped_ingredients": optimizer.grouped_ingredients,
+        "requirements": optimizer.customer_requirements,
+        "nutrients": optimizer.nutrients,
+        "nutrient_constraints": optimizer.nutrient_constraints,
+        "garnish_grams": optimizer.garnish_grams,
+        "double_sauce": optimizer.double_sauce,
+        "veggie_ge_starch": optimizer.veggie_ge_starch,
+        "min_meat_per_100_cal": optimizer.min_meat_per_100_cal,
+        "max_meal_grams_per_100_cal": optimizer.max_meal_grams_per_100_cal,
+        "fixed_grams": [optimizer.fixed_protein_grams, optimizer.fixed_starch_grams, optimizer.fixed_veggies_grams],
+        "initial_scalers": optimizer.initial_scalers,
+    }
+    encoded = json.dumps(inputs, sort_keys=True, default=repr, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class OptimizerResultCache:
+    """LRU of optimizer results by optimizer_key, optionally backed by a SQLite file.
+
+    Callers get deep copies, since they edit the result dicts. Exceptions are never
+    cached: an order that failed is solved again next time.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, persist=False, directory=None,
+                 max_persisted=DEFAULT_MAX_PERSISTED):
+        self.max_entries = max_entries
+        self.max_persisted = max_persisted
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._stores = 0
+        self.path = None
+        if persist:
+            directory = directory or os.getenv(CACHE_DIR_ENV) or DEFAULT_CACHE_DIR
+            os.makedirs(directory, exist_ok=True)
+            self.path = os.path.join(directory, "optimizer_results.sqlite3")
+            with self._connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, used_at REAL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS results_used_at ON results (used_at)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:  # commits on success
+                yield conn
+        finally:
+            conn.close()
+
+    def solve(self, optimizer):
+        """optimizer.solve(), or the stored result of an identical earlier solve."""
+        key, result = self.lookup(optimizer)
+        if result is None:
+            result = optimizer.solve()
+            self.store(key, result)
+        return result
+
+    def lookup(self, optimizer):
+        """(key, cached result or None); pass the key to store() after a miss."""
+        key = optimizer_key(optimizer)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return key, copy.deepcopy(self._entries[key])
+        if self.path is not None:
+            with self._connect() as conn:
+                row = conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE results SET used_at = ? WHERE key = ?", (time.time(), key))
+            if row is not None:
+                result = json.loads(row[0])
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                    self._remember(key, result)
+                return key, copy.deepcopy(result)
+        with self._lock:
+            self.misses += 1
+        return key, None
+
+    def store(self, key, result):
+        if result is None:
+            return
+        with self._lock:
+            self._remember(key, copy.deepcopy(result))
+            self._stores += 1
+            trim = self._stores % TRIM_EVERY == 0
+        if self.path is not None:
+            try:
+                value = json.dumps(result)
+            except (TypeError, ValueError) as e:
+                logger.warning(f"Optimizer result not persisted: {str(e)}")
+                return
+            with self._connect() as conn:
+                conn.execute("INSERT OR REPLACE INTO results (key, value, used_at) VALUES (?, ?, ?)",
+                             (key, value, time.time()))
+                if trim:
+                    conn.execute(
+                        "DELETE FROM results WHERE key NOT IN (SELECT key FROM results ORDER BY used_at DESC LIMIT ?)",
+                        (self.max_persisted,),
+                    )
+
+    def _remember(self, key, result):
+        # Caller holds self._lock
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hit_rate(), 3),
+                "entries": len(self._entries),
+                "evictions": self.evictions,
+            }
+        if self.path is not None:
+            with self._connect() as conn:
+                stats["persisted"] = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.path is not None:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM results")
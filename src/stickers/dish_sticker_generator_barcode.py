@@ -326,7 +326,7 @@ def read_client_serving(db):
     fields_to_return = ['#', 'Customer Name', 'Meal Sticker (from Linked OrderItem)', 'Meal Portion (from Linked OrderItem)', 'Delivery Date', 'Position Id', 'Dish ID (from Linked OrderItem)','Delivery Zone (from Linked OrderItem)','# of Parts','MealType from Profile (from Linked OrderItem)']
     try:
         # Initialize table
-        records = db.get_clientservings_data(view=VIEW_ID)
+        records = db.get_clientservings_data(view=VIEW_ID, fields=fields_to_return)
         
         if not records:
             raise AirTableError("No records found in the specified view.")
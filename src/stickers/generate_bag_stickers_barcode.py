@@ -18,6 +18,7 @@ BASE_DIR = Path(__file__).resolve().parents[2]  # Streamlit-App
 sys.path.append(str(BASE_DIR))
 
 from src.data.store_access import new_database_access
+from src.data import field_ids
 from src.stickers.dish_barcode_ids import dish_barcode_from_open_order_fields
 from src.stickers.shipping_sticker_generator_v3 import (
     populate_sticker,
@@ -31,6 +32,27 @@ DEFAULT_BAG_TEMPLATE = BASE_DIR / "template" / "Shipping_Sticker_Template_v3.ppt
 
 ICE_PACK_TAG = "Ice Pack"
 
+# Open Orders fields used for bag stickers
+ORDER_FIELDS = [
+    field_ids.OPEN_ORDERS_SHIPPING_NAME,
+    field_ids.OPEN_ORDERS_SHIPPING_ADDRESS_1,
+    field_ids.OPEN_ORDERS_SHIPPING_ADDRESS_2,
+    field_ids.OPEN_ORDERS_SHIPPING_CITY,
+    field_ids.OPEN_ORDERS_SHIPPING_PROVINCE,
+    field_ids.OPEN_ORDERS_SHIPPING_POSTAL_CODE,
+    field_ids.OPEN_ORDERS_ZONE_NUMBER,
+    "Shipping Phone",
+    "Delivery Date",
+    field_ids.OPEN_ORDERS_INDEX,
+    field_ids.OPEN_ORDERS_CUSTOMER_NAME,
+    field_ids.OPEN_ORDERS_PARTS,
+    "Meal Sticker",
+    "Meal Portion",
+    "Portion Result (in ClientServings)",
+    "Customization Tags",
+    "Customization Tags (from To_Match_Client_Nutrition)",
+]
+
 
 def unwrap(value, default=""):
     """Airtable lookup fields sometimes return list values."""
@@ -103,7 +125,7 @@ def get_open_orders_df(db):
     Delivery Date, Meal Sticker, Meal Portion, Customer Name, shipping fields,
     # of Parts, Zone Number, Shipping Name, and tags/customization info.
     """
-    records = db.get_all_open_orders(view="viwDpTtU0qaT9NcvG")  
+    records = db.get_all_open_orders(view="viwDpTtU0qaT9NcvG", fields=ORDER_FIELDS)
 
     rows = []
     for record in records:
@@ -386,26 +408,28 @@ def generate_bag_stickers_barcode(
         with open(export_mapping_path, "w") as f:
             json.dump(mapping, f, indent=2)
 
-    # Write each bag to Airtable Bag Tracking (source of truth for plating website).
-    for entry in mapping:
-        dish_record_ids = list(
-            dict.fromkeys(
-                str(d["dishBarcode"])
-                for d in entry["dishes"]
-                if isinstance(d, dict) and str(d.get("dishBarcode", "")).startswith("rec")
-            )
+    # Write all bags to Airtable Bag Tracking (source of truth for plating website) in one batch.
+    bags = [
+        dict(
+            bag_barcode=entry["bagBarcode"],
+            dish_record_ids=list(
+                dict.fromkeys(
+                    str(d["dishBarcode"])
+                    for d in entry["dishes"]
+                    if isinstance(d, dict) and str(d.get("dishBarcode", "")).startswith("rec")
+                )
+            ),
+            ice_pack_required=entry["icePackRequired"],
+            shipping_name=entry.get("shippingName"),
+            zone=entry.get("zone"),
+            household_members=entry.get("householdMembers"),
         )
-        try:
-            db.upsert_bag_record(
-                bag_barcode=entry["bagBarcode"],
-                dish_record_ids=dish_record_ids,
-                ice_pack_required=entry["icePackRequired"],
-                shipping_name=entry.get("shippingName"),
-                zone=entry.get("zone"),
-                household_members=entry.get("householdMembers"),
-            )
-        except Exception as e:
-            print(f"⚠️ Could not write bag {entry['bagBarcode']} to Airtable: {e}")
+        for entry in mapping
+    ]
+    try:
+        db.batch_upsert_bags(bags)
+    except Exception as e:
+        print(f"⚠️ Could not write {len(bags)} bags to Airtable: {e}")
 
     return prs, df
 
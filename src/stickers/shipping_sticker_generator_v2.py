@@ -7,12 +7,27 @@ import logging
 import copy
 from src.data.exceptions import AirTableError
 from src.data.store_access import new_database_access
+from src.data import field_ids
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 VIEW = "viwDpTtU0qaT9NcvG"  # View for open orders
+# Open Orders fields read below
+ORDER_FIELDS = [
+    field_ids.OPEN_ORDERS_SHIPPING_NAME,
+    field_ids.OPEN_ORDERS_SHIPPING_ADDRESS_1,
+    field_ids.OPEN_ORDERS_SHIPPING_ADDRESS_2,
+    field_ids.OPEN_ORDERS_SHIPPING_CITY,
+    field_ids.OPEN_ORDERS_SHIPPING_PROVINCE,
+    field_ids.OPEN_ORDERS_SHIPPING_POSTAL_CODE,
+    field_ids.OPEN_ORDERS_ZONE_NUMBER,
+    "Shipping Phone",
+    "Delivery Date",
+    field_ids.OPEN_ORDERS_QUANTITY,
+    "MealType from Profile",
+]
 
 class PPTGenerationError(Exception):
     """Custom exception for PowerPoint generation errors"""
@@ -25,7 +40,7 @@ def process_order_data(db):
         logger.info("Starting order data processing")
 
         # Get data from Airtable
-        orders = db.get_all_open_orders(view=VIEW)
+        orders = db.get_all_open_orders(view=VIEW, fields=ORDER_FIELDS)
 
         if not orders:
             raise AirTableError("No open orders found")
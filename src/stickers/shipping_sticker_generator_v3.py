@@ -19,6 +19,7 @@ sys.path.append(str(BASE_DIR))
 
 from src.data.exceptions import AirTableError
 from src.data.store_access import new_database_access
+from src.data import field_ids
 from src.stickers.dish_barcode_ids import dish_barcode_from_open_order_fields
 
 
@@ -26,6 +27,26 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 VIEW = "viwDpTtU0qaT9NcvG"
+# Open Orders fields read by process_order_data
+ORDER_FIELDS = [
+    field_ids.OPEN_ORDERS_SHIPPING_NAME,
+    field_ids.OPEN_ORDERS_SHIPPING_ADDRESS_1,
+    field_ids.OPEN_ORDERS_SHIPPING_ADDRESS_2,
+    field_ids.OPEN_ORDERS_SHIPPING_CITY,
+    field_ids.OPEN_ORDERS_SHIPPING_PROVINCE,
+    field_ids.OPEN_ORDERS_SHIPPING_POSTAL_CODE,
+    field_ids.OPEN_ORDERS_ZONE_NUMBER,
+    "Shipping Phone",
+    "Delivery Date",
+    field_ids.OPEN_ORDERS_QUANTITY,
+    field_ids.OPEN_ORDERS_CUSTOMER_NAME,
+    "MealType from Profile",
+    "Meal Sticker",
+    "Portion Result (in ClientServings)",
+    # customization_tags_from_fields merges whichever of these exist
+    "Customization Tags",
+    "Customization Tags (from To_Match_Client_Nutrition)",
+]
 
 PORTION_PER_BAG = 6.8
 STICKERS_PER_BAG = 2
@@ -183,7 +204,7 @@ def process_order_data(db):
     """
     logger.info("Starting shipping sticker barcode data processing")
 
-    orders = db.get_all_open_orders(view=VIEW)
+    orders = db.get_all_open_orders(view=VIEW, fields=ORDER_FIELDS)
 
     if not orders:
         raise AirTableError("No open orders found")
@@ -883,26 +904,32 @@ def add_code128_barcode(slide, prs, barcode_value):
     )
 
 
-def upsert_bag_to_airtable(db, shipping_info):
-    dish_ids = [
-        str(d["dishBarcode"])
-        for d in shipping_info["Dishes"]
-        if isinstance(d, dict) and d.get("dishBarcode")
-    ]
+def bag_upsert_args(shipping_info):
+    """batch_upsert_bags entry for one shipping_list item."""
+    return dict(
+        bag_barcode=shipping_info["Bag Barcode"],
+        dish_record_ids=[
+            str(d["dishBarcode"])
+            for d in shipping_info["Dishes"]
+            if isinstance(d, dict) and d.get("dishBarcode")
+        ],
+        ice_pack_required=shipping_info.get("Ice Pack Required", False),
+        shipping_name=shipping_info.get("Shipping Name"),
+        zone=shipping_info.get("Zone Number"),
+        household_members=shipping_info.get("Household Members"),
+    )
+
+
+def upsert_bags_to_airtable(db, shipping_list):
+    """Write every bag of the run to Bag Tracking in one batch; failures only log a warning."""
     try:
-        db.upsert_bag_record(
-            bag_barcode=shipping_info["Bag Barcode"],
-            dish_record_ids=dish_ids,
-            ice_pack_required=shipping_info["Ice Pack Required"],
-            shipping_name=shipping_info.get("Shipping Name"),
-            zone=shipping_info.get("Zone Number"),
-            household_members=shipping_info.get("Household Members"),
-        )
+        db.batch_upsert_bags([bag_upsert_args(info) for info in shipping_list])
     except Exception as e:
-        logger.warning(f"Could not write bag {shipping_info['Bag Barcode']} to Airtable: {e}")
+        logger.warning(f"Could not write {len(shipping_list)} bags to Airtable: {e}")
 
 
-def create_shipping_stickers_barcode_ppt(db, shipping_list, template_path=None):
+def create_shipping_stickers_barcode_ppt(db, shipping_list, template_path=None, write_bags=True):
+    # write_bags=False when the caller has already written the bags (see generate_shipping_stickers_barcode)
     if template_path is None:
         template_path = BASE_DIR / "template" / "Shipping_Sticker_Template_v3.pptx"
 
@@ -923,7 +950,8 @@ def create_shipping_stickers_barcode_ppt(db, shipping_list, template_path=None):
             add_code128_barcode(slide, prs, shipping_info["Bag Barcode"])
             total_stickers += 1
 
-        upsert_bag_to_airtable(db, shipping_info)
+    if write_bags:
+        upsert_bags_to_airtable(db, shipping_list)
 
     # Remove original template slide.
     r_id = prs.slides._sldIdLst[0].rId
@@ -947,28 +975,14 @@ def generate_shipping_stickers_barcode(db):
     if not shipping_list:
         raise AirTableError("No shipping records to process")
 
-    for info in shipping_list:
-        dish_record_ids = [
-            str(d.get("dishBarcode", ""))
-            for d in info.get("Dishes", [])
-            if str(d.get("dishBarcode", "")).startswith("rec")
-        ]
-        try:
-            db.upsert_bag_record(
-                bag_barcode=info["Bag Barcode"],
-                dish_record_ids=dish_record_ids,
-                ice_pack_required=info.get("Ice Pack Required", False),
-                shipping_name=info.get("Shipping Name"),
-                zone=info.get("Zone Number"),
-                household_members=info.get("Household Members"),
-            )
-        except Exception as e:
-            logger.warning(f"Could not write bag {info['Bag Barcode']} to Airtable: {e}")
+    # Bag Tracking is written once per run, before the stickers that point at it
+    upsert_bags_to_airtable(db, shipping_list)
 
     ppt_file = create_shipping_stickers_barcode_ppt(
         db,
         shipping_list,
         template_path=template_path,
+        write_bags=False,
     )
 
     return ppt_file, shipping_list
@@ -3,6 +3,8 @@ import time
 
 from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
+from src.data.instrumentation import finish_job, start_job
+
 
 class CancellableTask:
     """Runs a long-running function in a background thread with cooperative cancel.
@@ -12,9 +14,12 @@ class CancellableTask:
     called, the event is set; it's the target's responsibility to stop work.
     """
 
-    def __init__(self, target, *args, **kwargs):
+    def __init__(self, target, *args, task_name=None, **kwargs):
         self.cancel_event = threading.Event()
+        self.name = task_name or getattr(target, "__name__", "task")
         self.result = None
+        # Airtable usage summary of the run (see src.data.instrumentation), set when done
+        self.metrics = None
         self.error = None
         self.done = False
         self.start_time = None
@@ -30,12 +35,14 @@ class CancellableTask:
             add_script_run_ctx(self._thread, ctx)
 
     def _run(self):
+        job = start_job(self.name)
         try:
             self._kwargs["cancel_event"] = self.cancel_event
             self.result = self._target(*self._args, **self._kwargs)
         except Exception as e:
             self.error = e
         finally:
+            self.metrics = finish_job(job)
             self.end_time = time.time()
             self.done = True
 
@@ -1,4 +1,5 @@
 # Standard library imports
+import json
 import os
 import time
 import traceback
@@ -13,17 +14,53 @@ from pptx import Presentation
 
 # Local application imports
 from src.portioning.portion_controller import MealRecommendation
+from src.portioning.result_cache import OptimizerResultCache
+from src.portioning.portion_history import PortionHistory
+from src.portioning.order_fingerprints import OrderFingerprints
 from src.stickers.shipping_sticker_generator import *
 from src.stickers.shipping_sticker_generator_v2 import *
 from src.stickers.shipping_sticker_generator_v3 import generate_shipping_stickers_barcode
 from src.stickers.dish_sticker_generator_airtable import *
 from src.stickers.dish_sticker_generator_barcode import *
 from src.generators.one_pager_generator import *
-from src.data.store_access import new_database_access
+from src.data.store_access import new_database_access, get_airtable_traffic_stats
+from src.data.database import get_db
 from src.generators.clientservings_excel_output import *
 from src.generators.to_make_sheet_generator import *
 from src.utils.cancellable import CancellableTask
 
+def show_airtable_metrics(task, key):
+    """Per-method Airtable usage of a finished task, with a JSON export."""
+    summary = getattr(task, "metrics", None)
+    if task is None or not task.is_done() or not summary or not summary["methods"]:
+        return
+    with st.expander(f"Airtable usage: {summary['requests']} requests in {summary['elapsed_seconds']}s"):
+        rows = []
+        for method, stats in summary["methods"].items():
+            tables = stats["tables"].values()
+            rows.append({
+                "Method": method,
+                "Tables": ", ".join(stats["tables"]),
+                "Calls": stats["calls"],
+                "Errors": stats["errors"],
+                "p50 ms": stats["p50_ms"],
+                "p95 ms": stats["p95_ms"],
+                "p99 ms": stats["p99_ms"],
+                "Total s": stats["total_seconds"],
+                "Requests": sum(t["requests"] for t in tables),
+                "KB received": round(sum(t["bytes_received"] for t in tables) / 1024, 1),
+                "Retries": sum(t["retries"] for t in tables),
+                "Throttled s": round(sum(t["throttle_seconds"] for t in tables), 2),
+            })
+        st.dataframe(pd.DataFrame(rows), hide_index=True)
+        st.download_button(
+            label="Download Airtable metrics (JSON)",
+            data=json.dumps(summary, indent=2),
+            file_name=f"{summary['job']}_airtable_metrics.json",
+            mime="application/json",
+            key=f"{key}_metrics_download"
+        )
+
 # Streamlit app
 def main():
     db = new_database_access()
@@ -68,6 +105,31 @@ def main():
         st.markdown("⚠️ Currently :red[only] orders included in :red[this view] will be processed: [Open Orders > Running Portioning](https://airtable.com/appEe646yuQexwHJo/tblxT3Pg9Qh0BVZhM/viwrZHgdsYWnAMhtX?blocks=hide)")
 
         portion_task = st.session_state.get("portion_task")
+        portion_running = portion_task is not None and not portion_task.is_done()
+
+        # Reference data (Ingredients, Clients, Constraints, Variants) is loaded once and reused across runs
+        portioning_db = get_db()
+        snapshot = portioning_db.snapshot
+        col_snapshot, col_refresh = st.columns([3, 1])
+        with col_snapshot:
+            if snapshot is not None and snapshot.is_loaded():
+                summary = snapshot.summary()
+                age_str = str(timedelta(seconds=int(snapshot.age_seconds())))
+                st.caption(
+                    f"📦 Reference data snapshot from {summary['loaded_at'].strftime('%Y-%m-%d %H:%M')} ({age_str} ago): "
+                    f"{summary['ingredients']} ingredients, {summary['clients']} clients, {summary['constraints']} constraints. "
+                    "Refresh it if you changed Ingredients, Clients, Constraints or Variants since then."
+                )
+            else:
+                st.caption("📦 Reference data snapshot not loaded yet — it will be loaded at the start of the next run.")
+        with col_refresh:
+            if st.button("Refresh Reference Data", key="portion_refresh_snapshot", disabled=portion_running):
+                try:
+                    with st.spinner('Refreshing reference data...'):
+                        portioning_db.refresh_snapshot()
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Failed to refresh reference data: {str(e)}")
 
         if portion_task is not None and not portion_task.is_done():
             # A run is in progress — show Cancel + live status, poll via rerun.
@@ -77,6 +139,8 @@ def main():
             done_count = progress.get("done", 0)
             failed_count = progress.get("failed", 0)
             total_count = progress.get("total", 0)
+            written_count = progress.get("written", 0)
+            fetched_count = progress.get("fetched", 0)
             status = progress.get("status", "Starting…")
 
             col_cancel, col_status = st.columns([1, 3])
@@ -89,7 +153,7 @@ def main():
                         st.rerun()
             with col_status:
                 if total_count:
-                    detail = f"{done_count}/{total_count} orders done"
+                    detail = f"{fetched_count} fetched, {done_count}/{total_count} optimized, {written_count} written"
                     if failed_count:
                         detail += f" ({failed_count} failed)"
                     detail += f" — {status}"
@@ -99,6 +163,18 @@ def main():
                     st.warning(f"Cancelling — waiting for in-flight orders to wrap up… ({elapsed_str}) | {detail}")
                 else:
                     st.info(f"Running portioning algorithm… 🕐 {elapsed_str} | {detail}")
+                stages = progress.get("stages")
+                if stages:
+                    st.caption("Stages: " + ", ".join(
+                        f"{stage} {numbers['done']} done, {numbers['queued']} queued, {numbers['per_second']}/s"
+                        for stage, numbers in stages.items()
+                    ))
+                traffic = get_airtable_traffic_stats()
+                st.caption(
+                    f"Airtable traffic: {traffic['queue_depth']} waiting "
+                    f"({traffic['interactive_waiting']} interactive), {traffic['requests']} requests, "
+                    f"{traffic['throttle_seconds']}s throttled, {traffic['retries']} retries"
+                )
 
             # Poll: sleep briefly then rerun until task finishes.
             time.sleep(2)
@@ -114,6 +190,15 @@ def main():
                         st.warning(f"Portioning cancelled after {elapsed_str}. {finishedCount} orders completed before cancellation.")
                     else:
                         st.success(f"{finishedCount} orders completed in {elapsed_str}! ✅")
+                    cache_stats = st.session_state.get("portion_progress", {}).get("result_cache")
+                    if cache_stats:
+                        st.caption(f"Optimizer result cache: {cache_stats['hits']} of {cache_stats['hits'] + cache_stats['misses']} orders reused ({cache_stats['hit_rate']:.0%})")
+                    warm_stats = st.session_state.get("portion_progress", {}).get("warm_start")
+                    if warm_stats:
+                        st.caption(f"Warm starts: {warm_stats['warm_starts']} solves started from previous portions, {warm_stats['iterations_saved']} optimizer iterations saved")
+                    fingerprint_stats = st.session_state.get("portion_progress", {}).get("fingerprints")
+                    if fingerprint_stats:
+                        st.caption(f"Unchanged orders: {fingerprint_stats['skipped']} skipped, {fingerprint_stats['relinked']} re-linked to their previous result")
                     if len(failedCases) > 0:
                         if failedCount > 0:
                             st.error(f"{failedCount} orders failed to process. Please review the following cases:")
@@ -122,11 +207,77 @@ def main():
                             st.error("Portioning stopped half way through, please correct the following cases and re-run the algorithm:")
                             st.write(failedCases)
 
+            show_airtable_metrics(portion_task, "portion")
+
+            stream_orders = st.checkbox(
+                "Start optimizing while open orders are still downloading",
+                value=True,
+                key="portion_streaming",
+                help="Orders with missing client or dish data are reported as failed instead of stopping the run before it starts.",
+            )
+            use_asyncio = st.checkbox(
+                "Use the asyncio Airtable client",
+                value=False,
+                key="portion_asyncio",
+                help="Drives all Airtable requests from one event loop instead of a thread pool; Cancel takes effect immediately.",
+            )
+            reportion = st.checkbox(
+                "Re-portion orders that already have results",
+                value=False,
+                key="portion_upsert",
+                help="Portions every order in the Running Portioning view and updates each order's existing Client Servings row in place, instead of skipping orders that have a Portion Result.",
+            )
+            solver = st.selectbox(
+                "Portion solver",
+                ["rules", "qp"],
+                key="portion_solver",
+                help="rules: the iterative ingredient adjustments. qp: solves each dish as a constrained least-squares problem, falling back to rules when the portion limits can't all be met.",
+            )
+            use_pipeline = st.checkbox(
+                "Optimize in a process pool",
+                value=False,
+                key="portion_pipeline",
+                help="Fetch, optimize and write run as separate stages: threads fetch orders, one process per core runs the optimizer, and one thread writes. Takes precedence over the asyncio client.",
+            )
+            batch_dishes = st.checkbox(
+                "Solve orders for the same dish together",
+                value=False,
+                key="portion_batch",
+                help="Orders with the same dish and final ingredients are portioned in one batch (stacked solve in qp mode). Thread-pool client only.",
+            )
+            reuse_results = st.checkbox(
+                "Reuse optimizer results from earlier runs",
+                value=False,
+                key="portion_result_cache",
+                help="Orders whose dish, ingredients, goals and constraints match an earlier solve reuse its portions (kept on disk, least recently used dropped first). Identical orders within a run are always solved once.",
+            )
+            warm_start = st.checkbox(
+                "Start from each client's previous portions",
+                value=False,
+                key="portion_warm_start",
+                help="Each client's solve starts from the portions they got last time for the same ingredient lines, and this run's portions are kept for next time. Usually needs far fewer optimizer iterations.",
+            )
+            skip_unchanged = st.checkbox(
+                "Skip orders whose inputs haven't changed",
+                value=False,
+                key="portion_fingerprints",
+                help="Orders whose client, constraints, dish, ingredients and deletions match their last written result are left alone (with re-portioning) or re-linked to that result. They are checked before any dish nutrition is computed, so the optimizer and the ingredient lookups don't run.",
+            )
             if st.button("Yeh! Run Portioning Now"):
-                meal_recommendation = MealRecommendation()
-                progress = {"status": "Starting…", "done": 0, "failed": 0, "total": 0}
+                meal_recommendation = MealRecommendation(
+                    solver=solver,
+                    result_cache=OptimizerResultCache(persist=True) if reuse_results else None,
+                    history=PortionHistory() if warm_start else None,
+                    fingerprints=OrderFingerprints() if skip_unchanged else None,
+                )
+                progress = {"status": "Starting…", "done": 0, "failed": 0, "total": 0, "fetched": 0}
                 st.session_state.portion_progress = progress
-                task = CancellableTask(meal_recommendation.generate_recommendations_with_thread, progress=progress)
+                if use_pipeline:
+                    task = CancellableTask(meal_recommendation.generate_recommendations_pipeline, progress=progress, upsert=reportion, task_name="portioning")
+                elif use_asyncio:
+                    task = CancellableTask(meal_recommendation.generate_recommendations_async, progress=progress, upsert=reportion, task_name="portioning")
+                else:
+                    task = CancellableTask(meal_recommendation.generate_recommendations_with_thread, progress=progress, streaming=stream_orders, upsert=reportion, batch=batch_dishes, task_name="portioning")
                 task.start()
                 st.session_state.portion_task = task
                 st.rerun()
@@ -172,10 +323,12 @@ def main():
                     )
                     st.success(f"Excel file generated successfully in {elapsed_str}!")
 
+            show_airtable_metrics(clientservings_task, "clientservings")
+
             if st.button("Get ClientServings"):
                 progress = {"status": "Starting…", "done": 0, "total": 0}
                 st.session_state.clientservings_progress = progress
-                task = CancellableTask(lambda cancel_event=None: generate_clientservings_excel(db, progress=progress))
+                task = CancellableTask(lambda cancel_event=None: generate_clientservings_excel(db, progress=progress), task_name="clientservings_excel")
                 task.start()
                 st.session_state.clientservings_task = task
                 st.rerun()
@@ -605,6 +758,8 @@ def main():
                                 key="barcode_download"
                             )
 
+            show_airtable_metrics(barcode_task, "barcode")
+
             if st.button("I have applied position id, lets get Barcode Dish Stickers"):
                 if len(qr_prs_file.slides) == 0:
                     st.error("The Barcode template contains no slides. Please use a valid template.")
@@ -613,7 +768,7 @@ def main():
                 st.session_state.pop("barcode_saved_path", None)
                 progress = {"status": "Starting…", "slide_count": 0, "total_slides": 0}
                 st.session_state.barcode_progress = progress
-                task = CancellableTask(generate_dish_stickers_barcode, db, progress=progress)
+                task = CancellableTask(generate_dish_stickers_barcode, db, progress=progress, task_name="barcode_dish_stickers")
                 task.start()
                 st.session_state.barcode_task = task
                 st.rerun()
@@ -671,6 +826,8 @@ def main():
                             )
                     st.success(f"One-Sheeter generated successfully in {elapsed_str}!")
 
+            show_airtable_metrics(one_sheeter_task, "one_sheeter")
+
             if st.button("Yes I ran the meal sticker already, now lets generate One-Sheeter"):
                 template_path = 'template/One_Pager_Template_v2.pptx'
                 prs_file = Presentation(template_path)
@@ -679,7 +836,7 @@ def main():
                 st.session_state.pop("one_sheeter_saved_path", None)
                 progress = {"status": "Starting…", "done": 0, "total": 0}
                 st.session_state.one_sheeter_progress = progress
-                task = CancellableTask(lambda cancel_event=None: generate_one_pagers(db, template_path, progress=progress))
+                task = CancellableTask(lambda cancel_event=None: generate_one_pagers(db, template_path, progress=progress), task_name="one_sheeter")
                 task.start()
                 st.session_state.one_sheeter_task = task
                 st.rerun()
@@ -717,8 +874,10 @@ def main():
                     )
                     st.success(f"To-Make Sheet generated successfully in {elapsed_str}!")
 
+            show_airtable_metrics(to_make_sheet_task, "to_make_sheet")
+
             if st.button("Generate To-Make Sheet"):
-                task = CancellableTask(lambda cancel_event=None: generate_to_make_sheet(db))
+                task = CancellableTask(lambda cancel_event=None: generate_to_make_sheet(db), task_name="to_make_sheet")
                 task.start()
                 st.session_state.to_make_sheet_task = task
                 st.rerun()